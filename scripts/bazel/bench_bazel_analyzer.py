@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Measure the parse cost of xc_bazel_analyzer on a synthetic server log, and
+# check that the cost of a single huge command grows linearly with its size.
+#
+# Usage: ./bench_bazel_analyzer.py [lines]
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from xc_bazel_analyzer import (
+    EXECUTE_MARK,
+    REGISTER_MARK,
+    ServerLogReader,
+    parse_timestamp,
+)
+
+
+def generate_log(path: str, lines: int) -> int:
+    """
+    Write a server log of about "lines" lines, every command has 100 lines and
+    every 10th command failed with a SpawnExecException. Return the number of
+    commands.
+    """
+    client_env = ", ".join(f"--client_env=VAR_{i}=value_{i}" for i in range(40))
+    commands = 0
+    with open(path, "w") as f:
+        written = 0
+        while written < lines:
+            ts = f"2412{commands % 28 + 1:02d} 15:02:{commands % 60:02d}.{commands % 1000:03d}"
+            f.write(f"{ts}:I 1408 {REGISTER_MARK} Starting command {commands}\n")
+            f.write(
+                f"{ts}:I 1408 {EXECUTE_MARK} [build, {client_env}, --sandbox_debug, //pkg:target{commands}]\n"
+            )
+            body = 97
+            if commands % 10 == 0:
+                f.write("Caused by: com.google.devtools.build.lib.exec.SpawnExecException: failed\n")
+                f.write(
+                    f"  /tmp/sandbox/process-wrapper '--timeout=0' /usr/bin/gcc -c foo{commands}.c\n"
+                )
+                body -= 2
+            for i in range(body):
+                f.write(f"{ts}:I 1408 [com.google.devtools.build.lib.Foo.bar] some message {i}\n")
+            f.write("end\n")
+            written += 100
+            commands += 1
+    return commands
+
+
+def bench_large_command(directory: str):
+    """
+    Parse logs whose middle command has 50 and 200 MiB of output, the time
+    must grow linearly (the pending command used to be copied for every
+    block read).
+    """
+    durations = []
+    for size_mb in [50, 200]:
+        path = os.path.join(directory, "large.log")
+        with open(path, "w") as f:
+            for i in range(3):
+                f.write(f"241208 15:02:50.151:I 1408 {REGISTER_MARK} Starting command {i}\n")
+                f.write(f"241208 15:02:50.151:I 1408 {EXECUTE_MARK} [build, //pkg:target{i}]\n")
+                line = "x" * 99 + "\n"
+                f.write(line * (size_mb * 1024 * 1024 // 100 if i == 1 else 10))
+
+        reader = ServerLogReader(path)
+        start_time = time.perf_counter()
+        parsed = sum(1 for _ in reader.commands())
+        durations.append(time.perf_counter() - start_time)
+        reader.close()
+        os.unlink(path)
+        assert parsed == 3
+        print(f"one command of {size_mb} MiB: {durations[-1]:.2f}s")
+
+    if durations[1] > durations[0] * 8:
+        raise RuntimeError("the parse time of a command is not linear in its size")
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("lines", nargs="?", type=int, default=1_000_000, help="lines of the log")
+    lines = parser.parse_args().lines
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "java.log")
+        commands = generate_log(path, lines)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"lines: {lines}, commands: {commands}, size: {size_mb:.1f} MiB")
+
+        reader = ServerLogReader(path)
+        start_time = time.perf_counter()
+        parsed = sum(1 for _ in reader.commands())
+        duration = time.perf_counter() - start_time
+        reader.close()
+        assert parsed == commands
+
+        print(f"parse: {duration:.2f}s, {size_mb / duration:.1f} MiB/s")
+        print(f"per command: {duration / commands * 1e6:.0f}us")
+
+        bench_large_command(directory)
+
+    text = "241208 15:02:50.151"
+    count = 100_000
+    start_time = time.perf_counter()
+    for _ in range(count):
+        datetime.datetime.strptime(text, "%y%m%d %H:%M:%S.%f")
+    strptime_cost = (time.perf_counter() - start_time) / count
+    start_time = time.perf_counter()
+    for _ in range(count):
+        parse_timestamp(text)
+    decoder_cost = (time.perf_counter() - start_time) / count
+    print(f"timestamp: strptime {strptime_cost * 1e6:.2f}us, fixed-width {decoder_cost * 1e6:.2f}us")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# Compare xc_sort_compile_commands.sort with the json.load/json.dump sort on a
+# synthetic compile_commands.json, check that the outputs are the same bytes
+# (for the indented, the minified and the spilled-to-disk cases) and print
+# the time and the peak RSS of both. Then check the merge of a few fresh
+# entries into the sorted file, and compare its time with the full sort, and
+# the round trip of the compacted file.
+#
+# Usage: ./bench_sort_compile_commands.py [entries]
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import xc_sort_compile_commands
+
+def generate(entries: int) -> list:
+    random.seed(0)
+    flags = [f"-I external/dep_{i}/include" for i in range(60)] + [
+        "-DNDEBUG",
+        '-DVERSION="1.0"',
+        "-fno-exceptions",
+        "-Wall",
+    ]
+    data = []
+    for i in range(entries):
+        # duplicated files keep their order, non-ASCII is escaped
+        file = f"src/module_{random.randrange(entries // 2)}/file_{i % 7}.cc"
+        if i % 97 == 0:
+            file = f"src/unicode/名前_{i}.cc"
+        data.append(
+            {
+                "file": file,
+                "arguments": ["clang++", "-c", file, "-o", f"{file}.o"] + flags,
+                "directory": "/home/user/.cache/bazel/execroot/main",
+            }
+        )
+    if entries:
+        # entries that are not laid out the way the fast path expects
+        data[0]["output"] = {"nested": [1, 2.5, None, True]}
+    return data
+
+
+def reference_sort(path: str):
+    with open(path, "r") as file:
+        data = json.load(file)
+    sorted_data = sorted(data, key=lambda x: x["file"])
+    with open(path, "w") as file:
+        json.dump(sorted_data, file, indent=2)
+
+
+def run_child(code: str, path: str) -> tuple[float, int]:
+    """
+    Run the sort in a child process, return the time and the peak RSS (KiB).
+
+    The peak is read from VmHWM of the child itself, ru_maxrss would include
+    the memory of this process (the child is spawned with vfork).
+    """
+    code += "\nprint([l for l in open('/proc/self/status') if l.startswith('VmHWM')][0])"
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-c", code, path], cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    duration = time.perf_counter() - start
+    return duration, int(output.split()[-2])
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "entries", nargs="?", type=int, default=100_000, help="entries of the synthetic file"
+    )
+    entries = parser.parse_args().entries
+
+    data = generate(entries)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, indent in [("indented", 2), ("minified", None)]:
+            expected_path = os.path.join(tmp, "expected.json")
+            with open(expected_path, "w") as f:
+                json.dump(data, f, indent=indent)
+            size_mb = os.path.getsize(expected_path) / 1024 / 1024
+            print(f"{name}: {entries} entries, {size_mb:.1f} MiB")
+            with open(expected_path, "rb") as f:
+                content = f.read()
+
+            duration, rss = run_child(
+                "import sys, bench_sort_compile_commands as b; b.reference_sort(sys.argv[1])",
+                expected_path,
+            )
+            print(f"  json.load: {duration:.3f}s, peak RSS {rss / 1024:.0f} MiB")
+            with open(expected_path, "rb") as f:
+                expected = f.read()
+
+            for budget in [xc_sort_compile_commands.MEMORY_BUDGET, 1024 * 1024]:
+                path = os.path.join(tmp, "compile_commands.json")
+                with open(path, "wb") as f:
+                    f.write(content)
+                duration, rss = run_child(
+                    "import sys, xc_sort_compile_commands as s; "
+                    f"s.sort(sys.argv[1], {budget})",
+                    path,
+                )
+                with open(path, "rb") as f:
+                    if f.read() != expected:
+                        raise RuntimeError(f"output differs, {name}, memory budget {budget}")
+                print(
+                    f"  streaming (budget {budget // 1024 // 1024} MiB): {duration:.3f}s,"
+                    f" peak RSS {rss / 1024:.0f} MiB"
+                )
+
+        # the edge cases, compared with the reference
+        for case in [[], [{"file": "b"}, {"file": "a", "x": []}], [{"file": "a\\u0041"}]]:
+            path = os.path.join(tmp, "case.json")
+            for indent in [2, None]:
+                with open(path, "w") as f:
+                    json.dump(case, f, indent=indent)
+                xc_sort_compile_commands.sort(path)
+                with open(path, "rb") as f:
+                    actual = f.read()
+                reference_sort(path)
+                with open(path, "rb") as f:
+                    if f.read() != actual:
+                        raise RuntimeError(f"output differs: {case}")
+        bench_merge(data, tmp)
+        bench_compact(data, tmp)
+    print("outputs are identical")
+
+
+def reference_merge(data: list, fresh: list) -> bytes:
+    files = {entry["file"] for entry in fresh}
+    merged = [entry for entry in data if entry["file"] not in files] + fresh
+    return json.dumps(sorted(merged, key=lambda x: x["file"]), indent=2).encode()
+
+
+def bench_merge(data: list, tmp: str):
+    """
+    Merge a few fresh entries (changed, duplicated and new files) into the
+    sorted database, compare with the full sort.
+    """
+    random.seed(1)
+    fresh = []
+    for entry in random.sample(data, min(len(data), 20)):
+        fresh.append(dict(entry, arguments=entry["arguments"] + ["-DCHANGED"]))
+    fresh.append(dict(fresh[0], arguments=["clang++", "-DSECOND"]))
+    fresh += [{"file": "aaa/first.cc"}, {"file": "zzz/last.cc"}, {"file": "src/new.cc"}]
+
+    path = os.path.join(tmp, "compile_commands.json")
+    fresh_path = os.path.join(tmp, "fresh.json")
+    with open(fresh_path, "w") as f:
+        json.dump(fresh, f)
+    with open(path, "w") as f:
+        json.dump(sorted(data, key=lambda x: x["file"]), f, indent=2)
+
+    print(f"merge {len(fresh)} entries:")
+    duration, _ = run_child(
+        "import sys, xc_sort_compile_commands as s; s.sort(sys.argv[1])", path
+    )
+    print(f"  sort: {duration:.3f}s")
+    duration, _ = run_child(
+        f"import sys, xc_sort_compile_commands as s; s.merge({fresh_path!r}, sys.argv[1])", path
+    )
+    print(f"  merge: {duration:.3f}s")
+    with open(path, "rb") as f:
+        if f.read() != reference_merge(data, fresh):
+            raise RuntimeError("merged output differs")
+
+    for existing, case in [
+        ([], [{"file": "a"}]),
+        ([{"file": "b"}], [{"file": "a"}, {"file": "c"}]),
+        ([{"file": "a"}, {"file": "a", "x": "1"}, {"file": "b"}], [{"file": "a", "x": "2"}]),
+        ([{"file": "a"}, {"file": "b"}], [{"file": "b", "x": "2"}]),
+    ]:
+        with open(path, "w") as f:
+            json.dump(existing, f, indent=2)
+        with open(fresh_path, "w") as f:
+            json.dump(case, f)
+        xc_sort_compile_commands.merge(fresh_path, path)
+        with open(path, "rb") as f:
+            if f.read() != reference_merge(existing, case):
+                raise RuntimeError(f"merged output differs: {existing} {case}")
+
+
+def bench_compact(data: list, tmp: str):
+    """
+    Compact the sorted database and expand it back, the bytes must be the same.
+    """
+    path = os.path.join(tmp, "compile_commands.json")
+    expected = json.dumps(sorted(data, key=lambda x: x["file"]), indent=2).encode()
+    with open(path, "wb") as f:
+        f.write(expected)
+
+    print("compact:")
+    duration, _ = run_child(
+        "import sys, xc_sort_compile_commands as s; s.profile(sys.argv[1], True)", path
+    )
+    compact_path = xc_sort_compile_commands.compact_path_of(path)
+    print(f"  profile and compact: {duration:.3f}s")
+    duration, _ = run_child(
+        "import sys, json\n"
+        "with open(sys.argv[1]) as f: json.load(f)",
+        path,
+    )
+    print(f"  json.load: {duration:.3f}s ({os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+    duration, _ = run_child(
+        "import sys, json\n"
+        "with open(sys.argv[1]) as f: json.load(f)",
+        compact_path,
+    )
+    print(
+        f"  json.load compact: {duration:.3f}s"
+        f" ({os.path.getsize(compact_path) / 1024 / 1024:.1f} MiB)"
+    )
+    os.unlink(path)
+    duration, _ = run_child(
+        f"import sys, xc_sort_compile_commands as s; s.expand({compact_path!r}, sys.argv[1])",
+        path,
+    )
+    print(f"  expand: {duration:.3f}s")
+    with open(path, "rb") as f:
+        if f.read() != expected:
+            raise RuntimeError("expanded output differs")
+
+    # the entries without compactable arguments are kept as they are
+    mixed = [
+        {"file": "a.cc", "arguments": ["cc", "-c", "a.cc", "-o", "a.o"], "directory": "/src"},
+        {"file": "b.cc", "command": "cc -c b.cc", "directory": "/src"},
+        {"file": "c.cc", "arguments": "cc -c c.cc", "directory": None},
+        {"file": "d.cc", "arguments": ["cc", 1]},
+    ]
+    with open(path, "w") as f:
+        json.dump(mixed, f, indent=2)
+    xc_sort_compile_commands.profile(path, True)
+    os.unlink(path)
+    xc_sort_compile_commands.expand(compact_path, path)
+    with open(path, "r") as f:
+        if json.load(f) != mixed:
+            raise RuntimeError("expanded mixed entries differ")
+
+
+if __name__ == "__main__":
+    run()
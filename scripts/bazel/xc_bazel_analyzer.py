@@ -1,55 +1,260 @@
 #!/usr/bin/env python3
 
+import argparse
 import datetime
+import json
 import logging
+import os
 import re
+import shlex
+import sqlite3
+import time
+from typing import Iterator, Optional
 
 import xiaochen_py
 
 
 REGISTER_MARK = "[com.google.devtools.build.lib.server.CommandManager.registerCommand]"
 EXECUTE_MARK = "[com.google.devtools.build.lib.server.GrpcServerImpl.executeCommand]"
+# the lines are scanned as bytes, only the lines of interest are decoded
+REGISTER_MARK_BYTES = REGISTER_MARK.encode("utf-8")
+EXECUTE_MARK_BYTES = EXECUTE_MARK.encode("utf-8")
+EXCEPTION_MARK_BYTES = b"Caused by:"
+
+# 241208 15:02:50.151:I 1408
+TIMESTAMP_PATTERN = re.compile(r"(\d{6} \d{2}:\d{2}:\d{2}.\d{3}):I \d+")
+# --client_env=GIT_ASKPASS=__private_value_removed__
+CLIENT_ENV_PATTERN = re.compile(r"--client_env=(.*)=(.*)")
+PROCESS_WRAPPER_PATTERN = re.compile(r"^\s+\S+process-wrapper (.*)")
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "xc_bazel_analyzer",
+)
+CHECKPOINT_PATH = os.path.join(CACHE_DIR, "checkpoint.json")
+INDEX_PATH = os.path.join(CACHE_DIR, "index.sqlite")
+
+
+class ServerLogReader:
+    """
+    Read the bazel server log in one pass and yield the commands while reading.
+
+    `resume_offset` is the offset of the first command that may be incomplete
+    (the last command in the log), reading again from it gives all the
+    commands that are not complete yet.
+    """
+
+    path: str
+    inode: int
+    resume_offset: int
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.file = open(path, "rb")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.resume_offset = offset
+
+    def close(self):
+        self.file.close()
+
+    def commands(
+        self, follow: bool = False, poll_interval: float = 1.0, block_size: int = 1024 * 1024
+    ) -> Iterator["BazelCommand"]:
+        """
+        Yield the commands from `resume_offset`.
+
+        The log is read in blocks and split at the lines of REGISTER_MARK, the
+        lines are not iterated in Python. Only the log of the current command
+        is kept in memory.
+
+        If `follow` is True, wait for new data at the end of the log (like
+        "tail -f"), a command is yielded once the next command starts.
+        Otherwise the last command is yielded at the end of the log, even if
+        it may be incomplete.
+        """
+        self.file.seek(self.resume_offset)
+        # "data" holds the log from the start of the current command, which is
+        # at the offset "base" of the log. It's a bytearray: appending a block
+        # and deleting the consumed prefix don't copy the pending command, so
+        # the time is linear in the size of the log even for huge commands
+        base = self.resume_offset
+        data = bytearray()
+        # where to search the next mark in "data"
+        scan = 0
+
+        while True:
+            block = self.file.read(block_size)
+            if not block:
+                if not follow:
+                    break
+                if self.rotated():
+                    return
+                time.sleep(poll_interval)
+                continue
 
-
-def run():
+            data += block
+            while True:
+                mark = data.find(REGISTER_MARK_BYTES, scan)
+                if mark == -1:
+                    # the mark may be cut by the end of the block
+                    scan = max(0, len(data) - len(REGISTER_MARK_BYTES) + 1)
+                    break
+
+                line_start = data.rfind(b"\n", 0, mark) + 1
+                if line_start > 0:
+                    # the previous command is complete, don't read it again
+                    command = parse_command(data[:line_start], base, base + line_start)
+                    del data[:line_start]
+                    base += line_start
+                    mark -= line_start
+                    self.resume_offset = base
+                    if command:
+                        yield command
+                scan = mark + len(REGISTER_MARK_BYTES)
+
+        # the last log
+        if data:
+            command = parse_command(data, base, base + len(data))
+            if command:
+                yield command
+
+    def rotated(self) -> bool:
+        """
+        Return True if the log at the path is not the opened file anymore
+        (e.g. the bazel server restarted).
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def read_command(self, start: int, end: int) -> Optional["BazelCommand"]:
+        """
+        Read the command at the byte range of the log.
+        """
+        return parse_command(self.read_log(start, end), start, end)
+
+    def read_log(self, start: int, end: int) -> bytes:
+        """
+        Return the byte range of the log, e.g. the raw log of a command
+        (BazelCommand.start_offset, BazelCommand.end_offset).
+        """
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+
+def parse_command(command_log: bytes, start: int, end: int) -> Optional["BazelCommand"]:
+    try:
+        return BazelCommand(command_log, start, end)
+    except ValueError:
+        # ignore the invalid command
+        return None
+
+
+def load_checkpoint(server_log_path: str) -> dict:
+    """
+    Return the checkpoint of the log:
+    - inode: the inode of the log when the checkpoint was saved
+    - offset: where to resume reading
+    - last_build: the byte range of the last build command, or None
+    """
+    try:
+        with open(CHECKPOINT_PATH, "r") as f:
+            checkpoints = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        checkpoints = dict()
+    return checkpoints.get(server_log_path, dict())
+
+
+def save_checkpoint(server_log_path: str, checkpoint: dict):
+    try:
+        with open(CHECKPOINT_PATH, "r") as f:
+            checkpoints = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        checkpoints = dict()
+    checkpoints[server_log_path] = checkpoint
+
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def open_server_log(server_log_path: str, reset: bool = False) -> tuple[ServerLogReader, dict]:
+    """
+    Open the log at the checkpoint, the checkpoint is dropped if the log was
+    replaced or truncated since it was saved.
+    """
+    checkpoint = dict() if reset else load_checkpoint(server_log_path)
+    st = os.stat(server_log_path)
+    if checkpoint.get("inode") != st.st_ino or checkpoint.get("offset", 0) > st.st_size:
+        checkpoint = {"inode": st.st_ino, "offset": 0, "last_build": None}
+
+    reader = ServerLogReader(server_log_path, checkpoint["offset"])
+    checkpoint["inode"] = reader.inode
+    return reader, checkpoint
+
+
+def get_server_log_path() -> Optional[str]:
     output, exit_code = xiaochen_py.run_command(
         "bazel info server_log", slient=True, stream_output=False
     )
     if exit_code != 0:
         logging.error("Failed to get bazel server log")
+        return None
+
+    return output.decode("utf-8").strip()
+
+
+def follow(server_log_path: str, reset: bool = False):
+    """
+    Print the commands appended to the log, and the failed spawns of the build
+    commands, until interrupted.
+    """
+    while True:
+        reader, checkpoint = open_server_log(server_log_path, reset)
+        reset = False
+        for command in reader.commands(follow=True):
+            print(f"[{command.timestamp.astimezone()}] {command.entry} {' '.join(command.server_args)}")
+            if command.entry in ["build"]:
+                checkpoint["last_build"] = [command.start_offset, command.end_offset]
+                for exception in command.exceptions:
+                    parse_exception(exception)
+            checkpoint["offset"] = reader.resume_offset
+            save_checkpoint(server_log_path, checkpoint)
+        reader.close()
+        logging.info("server log rotated, reopening")
+
+
+def run(follow_log: bool = False, reset: bool = False):
+    server_log_path = get_server_log_path()
+    if server_log_path is None:
         return
-
-    server_log_path = output.decode("utf-8").strip()
     logging.info(f"server log path: {server_log_path}")
 
-    file = open(server_log_path, "r")
-    lines = file.readlines()
+    if follow_log:
+        follow(server_log_path, reset)
+        return
 
-    command_logs = []
-    current_log = []
-    for line in lines:
-        if REGISTER_MARK in line:
-            if current_log:
-                command_logs.append(current_log)
-            current_log = []
-        current_log.append(line)
-    # append the last log
-    command_logs.append(current_log)
-
-    bazel_commands = []
-    for command_log in command_logs:
-        try:
-            bazel_commands.append(BazelCommand(command_log))
-        except ValueError:
-            # ignore the invalid command
-            continue
-
-    # filter 'build' commands
-    build_commands = [c for c in bazel_commands if c.entry in ["build"]]
-    if not build_commands:
+    # only the part appended since the last run is parsed
+    reader, checkpoint = open_server_log(server_log_path, reset)
+    last_command = None
+    for command in reader.commands():
+        # filter 'build' commands
+        if command.entry in ["build"]:
+            last_command = command
+    if last_command:
+        checkpoint["last_build"] = [last_command.start_offset, last_command.end_offset]
+    elif checkpoint.get("last_build"):
+        last_command = reader.read_command(*checkpoint["last_build"])
+    checkpoint["offset"] = reader.resume_offset
+    save_checkpoint(server_log_path, checkpoint)
+    reader.close()
+
+    if not last_command:
         logging.error("No build commands found")
         return
-    last_command = build_commands[-1]
 
     # logging.debug(f"entry: {last_command.entry}")
     # logging.debug(f"client_env: {last_command.client_env}")
@@ -57,13 +262,7 @@ def run():
     # logging.debug(f"target_args: {last_command.target_args}")
     # logging.debug(f"timestamp: {last_command.timestamp.astimezone()}")
 
-    target = ""
-    for arg in last_command.server_args:
-        if not arg.startswith("--"):
-            target = arg
-            break
-
-    print(f"target: {target}")
+    print(f"target: {last_command.target}")
 
     if "--sandbox_debug" not in last_command.server_args:
         logging.error(
@@ -76,15 +275,27 @@ def run():
 
 
 def parse_exception(exception: str):
+    for compiler, compiler_args, warapper_args in parse_spawns(exception):
+        print(f"compiler: {compiler}")
+        print(f"compiler_args: {compiler_args}")
+        print(f"warapper_args: {warapper_args}")
+
+
+def parse_spawns(exception: str) -> list[tuple[str, list[str], list[str]]]:
+    """
+    Return tuple(compiler, compiler_args, warapper_args) of every
+    process-wrapper invocation in a "SpawnExecException", or an empty list for
+    the other exceptions.
+    """
     lines = exception.split("\n")
 
     # filter "SpawnExecException"
     if len(lines) < 1 or "SpawnExecException" not in lines[0]:
-        return
+        return []
 
+    spawns = []
     for line in lines:
-        pattern = re.compile(r"^\s+\S+process-wrapper (.*)")
-        match = pattern.match(line)
+        match = PROCESS_WRAPPER_PATTERN.match(line)
         if match:
             all_args = match.group(1)
             all_args = all_args.split(" ")
@@ -107,12 +318,287 @@ def parse_exception(exception: str):
                         compiler = arg
                         compiler_args_start = True
 
-            print(f"compiler: {compiler}")
-            print(f"compiler_args: {compiler_args}")
-            print(f"warapper_args: {warapper_args}")
+            spawns.append((compiler, compiler_args, warapper_args))
+    return spawns
+
+
+SPAWN_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    inode INTEGER NOT NULL,
+    -- where to resume indexing (ServerLogReader.resume_offset)
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    -- seconds since epoch
+    timestamp REAL NOT NULL,
+    entry TEXT NOT NULL,
+    target TEXT NOT NULL,
+    UNIQUE (log_id, start_offset)
+);
+CREATE INDEX IF NOT EXISTS commands_timestamp ON commands(timestamp);
+CREATE INDEX IF NOT EXISTS commands_target ON commands(target);
+CREATE TABLE IF NOT EXISTS spawns (
+    id INTEGER PRIMARY KEY,
+    command_id INTEGER NOT NULL REFERENCES commands(id) ON DELETE CASCADE,
+    -- the byte range of the SpawnExecException in the log
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    compiler TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spawns_command ON spawns(command_id);
+"""
+
+
+class SpawnIndex:
+    """
+    A persistent index of the commands and their failed spawns in the server
+    logs, every failed spawn is kept as a byte range of its log, so it can be
+    read again with one seek.
+    """
+
+    def __init__(self, index_path: str = INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self.conn = sqlite3.connect(index_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SPAWN_INDEX_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, server_log_path: str) -> int:
+        """
+        Index the part of the log appended since the last update, return the
+        number of indexed commands.
+        """
+        path = os.path.abspath(server_log_path)
+        st = os.stat(path)
+        row = self.conn.execute(
+            "SELECT id, inode, offset FROM logs WHERE path = ?", (path,)
+        ).fetchone()
+        with self.conn:
+            if row and (row[1] != st.st_ino or row[2] > st.st_size):
+                # the log was replaced or truncated
+                self.conn.execute("DELETE FROM logs WHERE id = ?", (row[0],))
+                row = None
+            if not row:
+                cursor = self.conn.execute(
+                    "INSERT INTO logs (path, inode, offset) VALUES (?, ?, 0)", (path, st.st_ino)
+                )
+                row = (cursor.lastrowid, st.st_ino, 0)
+        log_id, _, offset = row
+
+        reader = ServerLogReader(path, offset)
+        count = 0
+        with self.conn:
+            # the last command of the previous update may be incomplete
+            self.conn.execute(
+                "DELETE FROM commands WHERE log_id = ? AND start_offset >= ?", (log_id, offset)
+            )
+            for command in reader.commands():
+                cursor = self.conn.execute(
+                    "INSERT INTO commands (log_id, start_offset, end_offset, timestamp, entry, target)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        log_id,
+                        command.start_offset,
+                        command.end_offset,
+                        command.timestamp.timestamp(),
+                        command.entry,
+                        command.target,
+                    ),
+                )
+                command_id = cursor.lastrowid
+                for exception, (start, end) in zip(command.exceptions, command.exception_ranges):
+                    spawns = parse_spawns(exception)
+                    if spawns:
+                        self.conn.execute(
+                            "INSERT INTO spawns (command_id, start_offset, end_offset, compiler)"
+                            " VALUES (?, ?, ?, ?)",
+                            (command_id, start, end, spawns[0][0]),
+                        )
+                count += 1
+            self.conn.execute(
+                "UPDATE logs SET inode = ?, offset = ? WHERE id = ?",
+                (reader.inode, reader.resume_offset, log_id),
+            )
+        reader.close()
+        return count
+
+    def failures(
+        self,
+        target: Optional[str] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+    ) -> list[tuple]:
+        """
+        Return tuple(spawn id, timestamp, entry, target, compiler) of the failed
+        spawns, in time order. A target ending with "/..." matches all the
+        targets under the package.
+        """
+        conditions = []
+        params = []
+        if target:
+            if target.endswith("/..."):
+                conditions.append("commands.target LIKE ?")
+                params.append(target[: -len("...")] + "%")
+            else:
+                conditions.append("commands.target = ?")
+                params.append(target)
+        if since:
+            conditions.append("commands.timestamp >= ?")
+            params.append(since.timestamp())
+        if until:
+            conditions.append("commands.timestamp < ?")
+            params.append(until.timestamp())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT spawns.id, commands.timestamp, commands.entry, commands.target, spawns.compiler
+            FROM spawns JOIN commands ON spawns.command_id = commands.id
+            {where}
+            ORDER BY commands.timestamp, spawns.id
+        """
+        return [
+            (
+                spawn_id,
+                datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc),
+                entry,
+                target,
+                compiler,
+            )
+            for spawn_id, timestamp, entry, target, compiler in self.conn.execute(query, params)
+        ]
+
+    def read_spawn(self, spawn_id: int) -> Optional[str]:
+        """
+        Return the SpawnExecException of the spawn, read from the log with one
+        seek. Return None if the spawn doesn't exist or the log was replaced.
+        """
+        row = self.conn.execute(
+            """
+            SELECT logs.path, logs.inode, spawns.start_offset, spawns.end_offset
+            FROM spawns
+            JOIN commands ON spawns.command_id = commands.id
+            JOIN logs ON commands.log_id = logs.id
+            WHERE spawns.id = ?
+            """,
+            (spawn_id,),
+        ).fetchone()
+        if not row:
+            return None
+        path, inode, start, end = row
+        try:
+            reader = ServerLogReader(path)
+        except FileNotFoundError:
+            return None
+        if reader.inode != inode:
+            reader.close()
+            return None
+        data = reader.read_log(start, end)
+        reader.close()
+        return data.decode("utf-8", errors="replace")
+
+
+def parse_time(text: str) -> datetime.datetime:
+    """
+    Parse a time like "2024-12-08" or "2024-12-08 15:02", in local time if no
+    timezone is given.
+    """
+    value = datetime.datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value
+
+
+def index_logs(index: SpawnIndex, log_paths: Optional[list[str]]) -> bool:
+    if not log_paths:
+        server_log_path = get_server_log_path()
+        if server_log_path is None:
+            return False
+        log_paths = [server_log_path]
+    for path in log_paths:
+        count = index.update(path)
+        logging.info(f"indexed {count} commands of {path}")
+    return True
+
+
+def list_failures(args):
+    index = SpawnIndex()
+    if not index_logs(index, args.log):
+        return
+    since = parse_time(args.since) if args.since else None
+    until = parse_time(args.until) if args.until else None
+    for spawn_id, timestamp, entry, target, compiler in index.failures(args.target, since, until):
+        print(f"[{spawn_id}] {timestamp.astimezone()} {entry} {target} {compiler}")
+    index.close()
+
+
+def show_spawn(args):
+    index = SpawnIndex()
+    exception = index.read_spawn(args.spawn_id)
+    index.close()
+    if exception is None:
+        logging.error(f"spawn {args.spawn_id} not found (or its log was replaced)")
+        return
+
+    for compiler, compiler_args, warapper_args in parse_spawns(exception):
+        print(f"warapper_args: {warapper_args}")
+        print(shlex.join([compiler] + compiler_args))
+
+
+def get_line(data: bytes, pos: int) -> bytes:
+    """
+    Return the line (with the trailing b"\\n") that contains the position.
+    """
+    start = data.rfind(b"\n", 0, pos) + 1
+    end = data.find(b"\n", pos)
+    if end == -1:
+        return data[start:]
+    return data[start : end + 1]
+
+
+def parse_timestamp(text: str) -> datetime.datetime:
+    """
+    Decode the fixed-width timestamp "241208 15:02:50.151" (UTC), the same
+    result as strptime with "%y%m%d %H:%M:%S.%f" but much faster.
+    """
+    year = int(text[0:2])
+    # the same pivot as "%y"
+    year += 2000 if year < 69 else 1900
+    return datetime.datetime(
+        year,
+        int(text[2:4]),
+        int(text[4:6]),
+        int(text[7:9]),
+        int(text[10:12]),
+        int(text[13:15]),
+        int(text[16:19]) * 1000,
+        tzinfo=datetime.timezone.utc,
+    )
 
 
 class BazelCommand:
+    # the commands are kept in memory for the whole log, slots keep them small
+    __slots__ = (
+        "entry",
+        "server_args",
+        "client_env",
+        "target_args",
+        "primitive_args",
+        "exec_command",
+        "timestamp",
+        "exceptions",
+        "exception_ranges",
+        "start_offset",
+        "end_offset",
+    )
+
     entry: str
     server_args: list[str]
     # store client env in a separate attribute since it's too long
@@ -122,35 +608,68 @@ class BazelCommand:
     # for debugging
     primitive_args: list[str]
     exec_command: str
-    command_log: str
     timestamp: datetime
     exceptions: list[str]
+    # the byte range of every exception in the server log
+    exception_ranges: list[tuple[int, int]]
+
+    # the byte range of the command in the server log, the raw log is not kept
+    # in memory (see ServerLogReader.read_log)
+    start_offset: int
+    end_offset: int
+
+    def __init__(self, command_log: bytes, start_offset: int = 0, end_offset: int = 0):
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+
+        # only the lines of interest are decoded, they are found with
+        # bytes.find instead of iterating all the lines
+        register_count = command_log.count(REGISTER_MARK_BYTES)
+        execute_count = command_log.count(EXECUTE_MARK_BYTES)
+        execute_line = b""
+        if execute_count == 1:
+            execute_line = get_line(command_log, command_log.find(EXECUTE_MARK_BYTES))
+
+        # an exception starts at a "Caused by:" line, and ends at the first line
+        # that neither starts with a space nor is another "Caused by:" line (an
+        # exception not ended before the end of the log is dropped)
+        self.exceptions = []
+        self.exception_ranges = []
+        pos = command_log.find(EXCEPTION_MARK_BYTES)
+        while pos != -1:
+            line_start = command_log.rfind(b"\n", 0, pos) + 1
+            exception_start = line_start
+            current_exception = []
+            while line_start < len(command_log):
+                line = get_line(command_log, line_start)
+                if current_exception and not (
+                    line.startswith(b" ") or EXCEPTION_MARK_BYTES in line
+                ):
+                    self.exceptions.append("\n".join(current_exception))
+                    self.exception_ranges.append(
+                        (start_offset + exception_start, start_offset + line_start)
+                    )
+                    break
+                current_exception.append(line.decode("utf-8", errors="replace"))
+                line_start += len(line)
+            pos = command_log.find(EXCEPTION_MARK_BYTES, line_start)
 
-    def __init__(self, command_log: str):
         # validate the command_log
-        register_lines = [line for line in command_log if REGISTER_MARK in line]
-        execute_lines = [line for line in command_log if EXECUTE_MARK in line]
-        if len(register_lines) != 1 or len(execute_lines) != 1:
+        if register_count != 1 or execute_count != 1:
             raise ValueError(
                 "Invalid command log: must contain exactly one REGISTER and one EXECUTE line"
             )
-        execute_line = execute_lines[0]
+        execute_line = execute_line.decode("utf-8", errors="replace")
 
         self.exec_command = execute_line
-        self.command_log = command_log
 
         # parse the timestamp
         # 241208 15:02:50.151:I 1408
-
-        pattern = re.compile(r"(\d{6} \d{2}:\d{2}:\d{2}.\d{3}):I \d+")
-        match = pattern.match(execute_line)
+        match = TIMESTAMP_PATTERN.match(execute_line)
         if not match:
             logging.error(f"failed to match timestamp: {execute_line}")
             raise ValueError
-        self.timestamp = datetime.datetime.strptime(
-            match.group(1), "%y%m%d %H:%M:%S.%f"
-        )
-        self.timestamp = self.timestamp.replace(tzinfo=datetime.timezone.utc)
+        self.timestamp = parse_timestamp(match.group(1))
 
         parts = execute_line.split(EXECUTE_MARK)
         if len(parts) != 2:
@@ -164,7 +683,7 @@ class BazelCommand:
             all_args = all_args.split(", ")
             self.primitive_args = all_args
         else:
-            logging.error(f"failed to parse entry: {command_log}, all_args: {all_args}")
+            logging.error(f"failed to parse entry: {execute_line}, all_args: {all_args}")
             raise ValueError
 
         self.server_args = []
@@ -182,8 +701,7 @@ class BazelCommand:
             # key: GIT_ASKPASS
             # value: __private_value_removed__
             if word.startswith("--client_env"):
-                pattern = re.compile(r"--client_env=(.*)=(.*)")
-                match = pattern.match(word)
+                match = CLIENT_ENV_PATTERN.match(word)
                 if match:
                     key = match.group(1)
                     value = match.group(2)
@@ -202,23 +720,58 @@ class BazelCommand:
             else:
                 self.server_args.append(word)
 
-        self.exceptions = []
-        in_exception = False
-        current_exception = []
-        for line in command_log:
-            if "Caused by:" in line:
-                in_exception = True
-                current_exception.append(line)
-                continue
-
-            if in_exception:
-                if line.startswith(" "):
-                    current_exception.append(line)
-                else:
-                    self.exceptions.append("\n".join(current_exception))
-                    current_exception = []
-                    in_exception = False
+    @property
+    def target(self) -> str:
+        """
+        The first server arg that is not an option.
+        """
+        for arg in self.server_args:
+            if not arg.startswith("--"):
+                return arg
+        return ""
 
 
 if __name__ == "__main__":
-    run()
+    # Usage: ./xc_bazel_analyzer.py [--follow] [--reset]
+    #        ./xc_bazel_analyzer.py failures [--log PATH]... [--target TARGET] [--since TIME] [--until TIME]
+    #        ./xc_bazel_analyzer.py show <spawn_id>
+    #
+    # Without a subcommand, print the failed spawns of the last build command
+    # in the bazel server log. Only the part of the log appended since the last
+    # run is parsed.
+    #
+    # "failures" lists the failed spawns of all the indexed logs, "show" prints
+    # the command of one failed spawn.
+
+    xiaochen_py.setup_logging()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--follow", action="store_true", help="keep reading the commands appended to the log"
+    )
+    parser.add_argument(
+        "--reset", action="store_true", help="ignore the checkpoint, parse the whole log"
+    )
+    subparsers = parser.add_subparsers(dest="subcommand")
+
+    parser_failures = subparsers.add_parser("failures", help="list the failed spawns")
+    parser_failures.add_argument(
+        "--log",
+        action="append",
+        help="server log to index before listing, can be repeated (default: the current server log)",
+    )
+    parser_failures.add_argument("--target", help='e.g. "//pkg:target" or "//pkg/..."')
+    parser_failures.add_argument("--since", help='e.g. "2024-12-08" or "2024-12-08 15:00"')
+    parser_failures.add_argument("--until", help='e.g. "2024-12-08" or "2024-12-08 15:00"')
+    parser_failures.set_defaults(func=list_failures)
+
+    parser_show = subparsers.add_parser("show", help="print the command of a failed spawn")
+    parser_show.add_argument("spawn_id", type=int)
+    parser_show.set_defaults(func=show_spawn)
+
+    args = parser.parse_args()
+
+    if args.subcommand:
+        args.func(args)
+    else:
+        run(args.follow, args.reset)
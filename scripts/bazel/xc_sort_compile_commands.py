@@ -1,11 +1,46 @@
 #!/usr/bin/env python3
+import argparse
+import heapq
 import json
+import mmap
+import os
+import pickle
+import re
+import tempfile
+from typing import Iterator, Optional
 
 import xiaochen_py
 
 
 COMPILE_COMMANDS_FILE = "compile_commands.json"
 
+# the sort keys of the entries are kept in memory up to this size, the sorted
+# runs are spilled to temporary files past it and merged at the end
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# A string as json.dump (ensure_ascii=True) writes it: printable ASCII, the
+# short escapes and "\uXXXX" in lowercase hex.
+JSON_STRING = rb'"[ !#-\[\]-~]*(?:\\(?:["\\bfnrt]|u[0-9a-f]{4})[ !#-\[\]-~]*)*"'
+
+# An entry of the array as json.dump(indent=2) writes it, for the entries with
+# string or list-of-strings values (i.e. all the entries of a compilation
+# database). The entries matching it are copied to the output as they are.
+CANONICAL_ENTRY_PATTERN = re.compile(
+    rb"\{\}|\{\n    S: V(?:,\n    S: V)*\n  \}".replace(
+        b"V", rb"(?:S|\[\]|\[\n      S(?:,\n      S)*\n    \])"
+    ).replace(b"S", JSON_STRING)
+)
+FILE_KEY_PATTERN = re.compile(rb'\n    "file": (' + JSON_STRING + rb")")
+
+# the structural characters and the strings (which may contain them) of any
+# JSON text
+ANY_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+TOKEN_PATTERN = re.compile(rb"[\[\]{}]|" + ANY_STRING, re.DOTALL)
+# an object without nested objects, in any layout, matched in one go
+FLAT_OBJECT_PATTERN = re.compile(
+    rb"\{(?:[^\"\[\]{}]|S|\[(?:[^\"\[\]{}]|S)*\])*\}".replace(b"S", ANY_STRING), re.DOTALL
+)
+
 
 def generate():
     # use a temporary output_base avoid discarding analysis cache
@@ -17,28 +52,616 @@ def generate():
     )
 
 
-def sort():
-    origin = xiaochen_py.get_file_info(COMPILE_COMMANDS_FILE)
+def scan_entries_indented(data) -> Iterator[tuple[int, int]]:
+    """
+    Yield the byte range of every entry of an array written by
+    json.dump(indent=2): "[\\n  {...},\\n  {...}\\n]". A raw newline can't
+    appear in a JSON string, so every entry ends at the first "\\n  }".
+
+    Raise ValueError if the data is laid out otherwise.
+    """
+    if data[:5] != b"[\n  {":
+        raise ValueError("not an indented array")
+    start = 4
+    while True:
+        end = data.find(b"\n  }", start)
+        if end == -1:
+            raise ValueError("not an indented array")
+        end += 4
+        yield start, end
+        if data[end : end + 5] == b",\n  {":
+            start = end + 4
+        elif data[end : end + 2] == b"\n]" and not data[end + 2 :].strip():
+            return
+        else:
+            raise ValueError("not an indented array")
+
+
+def scan_entries(data) -> Iterator[tuple[int, int]]:
+    """
+    Yield the byte range of every entry of a JSON array of objects, in any
+    layout. Only the brackets and the strings are tokenized, the entries are
+    not decoded here.
+    """
+    depth = 0
+    start = 0
+    # the end of the last token at depth 0 or 1, and the number of entries
+    pos = 0
+    count = 0
+    match = TOKEN_PATTERN.search(data)
+    while match:
+        token = match.group()
+        if depth <= 1:
+            gap = data[pos : match.start()].strip()
+            expected = b"," if depth == 1 and count and token != b"]" else b""
+            if gap != expected:
+                raise ValueError(f"invalid JSON array at offset {pos}")
+        if depth == 1 and token == b"{":
+            # most entries have no nested objects, skip them without tokenizing
+            entry = FLAT_OBJECT_PATTERN.match(data, match.start())
+            if entry:
+                pos = entry.end()
+                count += 1
+                yield match.start(), pos
+                match = TOKEN_PATTERN.search(data, pos)
+                continue
+        if token in (b"[", b"{"):
+            if depth == 0:
+                if token != b"[":
+                    raise ValueError("not a JSON array")
+                pos = match.end()
+            elif depth == 1:
+                if token != b"{":
+                    raise ValueError(f"entry at offset {match.start()} is not an object")
+                start = match.start()
+            depth += 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+            if depth == 1:
+                pos = match.end()
+                count += 1
+                yield start, pos
+            elif depth == 0:
+                if data[match.end() :].strip():
+                    raise ValueError(f"extra data at offset {match.end()}")
+                return
+        elif depth == 1:
+            raise ValueError(f"entry at offset {match.start()} is not an object")
+        match = TOKEN_PATTERN.search(data, match.end())
+    raise ValueError("unterminated JSON array")
+
+
+def encode_entry(entry: dict) -> bytes:
+    """
+    Return the entry as json.dump(indent=2) writes it inside the array.
+    """
+    return json.dumps(entry, indent=2).replace("\n", "\n  ").encode("ascii")
+
+
+def read_entry(data, start: int, end: int) -> tuple[str, Optional[bytes]]:
+    """
+    Return the "file" of the entry at data[start:end], and the entry encoded
+    by encode_entry() if the raw bytes differ from it (None if they can be
+    copied as they are).
+    """
+    canonical = (
+        CANONICAL_ENTRY_PATTERN.fullmatch(data, start, end) is not None
+        # "\\u0041" is a valid but not the canonical form of "A", let json decide
+        and data.find(b"\\u", start, end) == -1
+    )
+    if canonical:
+        match = FILE_KEY_PATTERN.search(data, start, end)
+        if match:
+            literal = match.group(1)
+            if b"\\" in literal:
+                return json.loads(literal), None
+            return literal[1:-1].decode("ascii"), None
+
+    entry = json.loads(data[start:end])
+    return entry["file"], encode_entry(entry)
+
+
+def spill(run: list, directory: str) -> str:
+    """
+    Write a sorted run to a file in the directory, return its path.
+    """
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for record in run:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def load_run(path: str) -> Iterator[tuple]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def sort_entries(data, spans, memory_budget: int, run_dir: str) -> Iterator[tuple]:
+    """
+    Return an iterator of tuple(file, index, start, end, encoded entry or None)
+    of the entries sorted by "file" (entries of the same file keep their order).
+
+    The records are sorted in memory up to `memory_budget` bytes, past it the
+    sorted runs are spilled to `run_dir` and merged.
+    """
+    runs = list()
+    run = list()
+    run_size = 0
+    for index, (start, end) in enumerate(spans):
+        file, encoded = read_entry(data, start, end)
+        run.append((file, index, start, end, encoded))
+        # the tuple, the ints and the strings
+        run_size += 160 + len(file) + (len(encoded) if encoded is not None else 0)
+        if run_size > memory_budget:
+            run.sort()
+            runs.append(spill(run, run_dir))
+            run = list()
+            run_size = 0
+
+    run.sort()
+    if not runs:
+        return iter(run)
+    runs.append(spill(run, run_dir))
+    return heapq.merge(*[load_run(path) for path in runs])
 
-    with open(COMPILE_COMMANDS_FILE, "r") as file:
-        data = json.load(file)
 
-    sorted_data = sorted(data, key=lambda x: x["file"])
+def set_mode_of(temp_path: str, path: str):
+    """
+    Give the temporary file (created 0600 by mkstemp) the mode of the file it
+    replaces, or the mode open() would create it with if there is none.
+    """
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o7777
+    else:
+        # the umask can only be read by setting it
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(temp_path, mode)
 
-    with open(COMPILE_COMMANDS_FILE, "w") as file:
-        json.dump(sorted_data, file, indent=2)
 
-    new_info = xiaochen_py.get_file_info(COMPILE_COMMANDS_FILE)
+def write_entries(path: str, data, records) -> int:
+    """
+    Write the records as json.dump(indent=2) writes the array of entries, the
+    raw entries are copied from `data` (an mmap) without decoding. The file is
+    replaced atomically. Return the number of records.
+
+    The (start, end) of a record may also span several raw entries (with the
+    separators between them), they are copied in one go.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".compile_commands.", dir=directory)
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as f, memoryview(data) as view:
+            f.write(b"[")
+            for record in records:
+                start, end, encoded = record[-3:]
+                f.write(b",\n  " if count else b"\n  ")
+                f.write(view[start:end] if encoded is None else encoded)
+                count += 1
+            f.write(b"\n]" if count else b"]")
+        set_mode_of(temp_path, path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return count
+
+
+class SortedEntries:
+    """
+    The entries of a database written by sort() (or merge()), sorted by
+    "file" and laid out by json.dump(indent=2). An entry starts at offset 4 or
+    after ",\\n  ", which only appears between the entries, so any byte offset
+    leads to an entry boundary. The entries are binary searched on the byte
+    offsets without reading the rest of the file.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        if len(data) < 8 and data[:].strip() == b"[]":
+            # no entries
+            self.first = self.end = 1
+            return
+        if data[:5] != b"[\n  {" or data[-2:] != b"\n]":
+            raise ValueError("not written by json.dump(indent=2), sort it first")
+        self.first = 4
+        # the end of the last entry
+        self.end = len(data) - 2
+
+    def start_after(self, pos: int) -> int:
+        """
+        Return the start of the first entry at or after pos, self.end if none.
+        """
+        if pos <= self.first:
+            return self.first
+        i = self.data.find(b",\n  {", pos - 4, self.end)
+        return self.end if i == -1 else i + 4
+
+    def start_before(self, pos: int) -> int:
+        """
+        Return the start of the last entry at or before pos.
+        """
+        i = self.data.rfind(b",\n  {", self.first, pos + 1)
+        return self.first if i == -1 else i + 4
+
+    def entry_end(self, start: int) -> int:
+        return self.data.find(b"\n  }", start) + 4
+
+    def next_start(self, start: int) -> int:
+        end = self.entry_end(start)
+        return end + 4 if end < self.end else self.end
+
+    def key(self, start: int) -> str:
+        return read_entry(self.data, start, self.entry_end(start))[0]
+
+    def bisect(self, key: str, lo: Optional[int] = None, right: bool = False) -> int:
+        """
+        Return the start of the first entry whose "file" is >= key (> key if
+        `right`), self.end if none.
+        """
+        lo = self.first if lo is None else lo
+        hi = self.end
+        # the entries starting before lo are < key, the ones at or after hi are >= key
+        while lo < hi:
+            mid = self.start_after((lo + hi) // 2)
+            if mid >= hi:
+                mid = self.start_before((lo + hi) // 2)
+            mid_key = self.key(mid)
+            if mid_key < key or (right and mid_key == key):
+                lo = self.next_start(mid)
+            else:
+                hi = mid
+        return lo
+
+    def count(self, start: int, end: int) -> int:
+        """
+        Return the number of entries in [start, end).
+        """
+        count = 0
+        while start < end:
+            start = self.next_start(start)
+            count += 1
+        return count
+
+
+def sort(path: str = COMPILE_COMMANDS_FILE, memory_budget: int = MEMORY_BUDGET):
+    origin = xiaochen_py.get_file_info(path)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data, tempfile.TemporaryDirectory(dir=directory) as run_dir:
+        try:
+            records = sort_entries(data, scan_entries_indented(data), memory_budget, run_dir)
+        except ValueError:
+            # not written by json.dump(indent=2), find the entries by the tokens
+            records = sort_entries(data, scan_entries(data), memory_budget, run_dir)
+        count = write_entries(path, data, records)
+
+    new_info = xiaochen_py.get_file_info(path)
     print(f"origin file size: {origin.size}, new file size: {new_info.size}")
 
+    print(f"sorted compile_commands.json has been written to {path} with {count} entries")
+
+
+def merge(fresh_path: str, path: str = COMPILE_COMMANDS_FILE):
+    """
+    Replace the entries of the files in `fresh_path` (a partial
+    compile_commands.json, e.g. of the changed targets only) in the sorted
+    database at `path`, and insert the new files. The other entries are
+    copied as raw byte ranges, only the boundaries of the replaced entries are
+    looked up.
+    """
+    with open(fresh_path, "r") as file:
+        fresh = dict()
+        for entry in json.load(file):
+            fresh.setdefault(entry["file"], list()).append(encode_entry(entry))
+
+    origin = xiaochen_py.get_file_info(path)
+
+    replaced = 0
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        entries = SortedEntries(data)
+        records = list()
+        pos = entries.first
+        for key in sorted(fresh):
+            lo = entries.bisect(key, pos)
+            hi = entries.bisect(key, lo, right=True)
+            if lo > pos:
+                # the untouched entries, without the separator after them
+                records.append((pos, lo - 4 if lo < entries.end else lo, None))
+            records.extend((0, 0, encoded) for encoded in fresh[key])
+            replaced += entries.count(lo, hi)
+            pos = hi
+        if pos < entries.end:
+            records.append((pos, entries.end, None))
+        write_entries(path, data, records)
+
+    new_info = xiaochen_py.get_file_info(path)
+    print(f"origin file size: {origin.size}, new file size: {new_info.size}")
+
+    added = sum(len(encoded) for encoded in fresh.values())
+    print(
+        f"merged {added} entries of {len(fresh)} files into {path}, {replaced} entries were replaced"
+    )
+
+
+# the arguments of a profile that are different for every entry
+FILE_ARG = -1
+OUTPUT_ARG = -2
+
+COMPACT_FORMAT = "xc-compact-compile-commands/1"
+
+
+class FlagProfiles:
+    """
+    The distinct argument lists ("profiles") of the entries, with the source
+    file and the "-o" output of every entry taken out, so the entries compiled
+    with the same flags share one profile. The argument strings and the
+    directories are interned in one string table.
+
+    A compacted entry keeps all its keys in order, "arguments" becomes
+    [profile id] or [profile id, output] and "directory" a string id. The
+    other values (e.g. "command", or "arguments" that is not a list of
+    strings) are kept as they are.
+    """
+
+    def __init__(self):
+        self.strings = list()
+        self.string_ids = dict()
+        self.profiles = list()
+        self.profile_ids = dict()
+        # the number of entries and the first file of every profile
+        self.counts = list()
+        self.examples = list()
+
+    def intern(self, string: str) -> int:
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def compact(self, entry: dict) -> dict:
+        compacted = dict()
+        for key, value in entry.items():
+            if key == "arguments" and isinstance(value, list) and all(
+                isinstance(arg, str) for arg in value
+            ):
+                output = None
+                ids = list()
+                for i, arg in enumerate(value):
+                    if arg == entry.get("file"):
+                        ids.append(FILE_ARG)
+                    elif output is None and i > 0 and value[i - 1] == "-o":
+                        output = arg
+                        ids.append(OUTPUT_ARG)
+                    else:
+                        ids.append(self.intern(arg))
+                ids = tuple(ids)
+                profile_id = self.profile_ids.get(ids)
+                if profile_id is None:
+                    profile_id = len(self.profiles)
+                    self.profiles.append(ids)
+                    self.profile_ids[ids] = profile_id
+                    self.counts.append(0)
+                    self.examples.append(entry.get("file"))
+                self.counts[profile_id] += 1
+                compacted[key] = [profile_id] if output is None else [profile_id, output]
+            elif key == "directory" and isinstance(value, str):
+                compacted[key] = self.intern(value)
+            else:
+                compacted[key] = value
+        return compacted
+
+    def expand(self, compacted: dict) -> dict:
+        entry = dict()
+        for key, value in compacted.items():
+            if key == "arguments" and is_profile_reference(value):
+                output = value[1] if len(value) > 1 else None
+                file = compacted.get("file")
+                entry[key] = [
+                    file if i == FILE_ARG else output if i == OUTPUT_ARG else self.strings[i]
+                    for i in self.profiles[value[0]]
+                ]
+            elif key == "directory" and type(value) is int:
+                entry[key] = self.strings[value]
+            else:
+                entry[key] = value
+        return entry
+
+    def arguments(self, profile_id: int) -> list[str]:
+        return [
+            "<file>" if i == FILE_ARG else "<output>" if i == OUTPUT_ARG else self.strings[i]
+            for i in self.profiles[profile_id]
+        ]
+
+
+def is_profile_reference(arguments) -> bool:
+    """
+    Return True if the "arguments" of a compacted entry is [profile id] or
+    [profile id, output], not the original value kept as it is.
+    """
+    return (
+        isinstance(arguments, list)
+        and 1 <= len(arguments) <= 2
+        and type(arguments[0]) is int
+        and (len(arguments) == 1 or isinstance(arguments[1], str))
+    )
+
+
+def iter_entries(data) -> Iterator[dict]:
+    """
+    Yield the decoded entries one by one.
+    """
+    try:
+        spans = list(scan_entries_indented(data))
+    except ValueError:
+        spans = scan_entries(data)
+    for start, end in spans:
+        yield json.loads(data[start:end])
+
+
+def report_profiles(profiles: FlagProfiles, top: int):
+    total = sum(profiles.counts)
     print(
-        f"sorted compile_commands.json has been written to {COMPILE_COMMANDS_FILE} with {len(sorted_data)} entries"
+        f"{total} entries, {len(profiles.profiles)} distinct flag profiles,"
+        f" {len(profiles.strings)} distinct strings"
     )
+    order = sorted(range(len(profiles.profiles)), key=lambda i: -profiles.counts[i])
+    if not order:
+        return
+    base = profiles.arguments(order[0])
+    for profile_id in order[:top]:
+        arguments = profiles.arguments(profile_id)
+        print(
+            f"profile {profile_id}: {profiles.counts[profile_id]} entries,"
+            f" {len(arguments)} arguments, e.g. {profiles.examples[profile_id]}"
+        )
+        if profile_id == order[0]:
+            continue
+        # the differences from the most common profile
+        added = [arg for arg in arguments if arg not in base]
+        removed = [arg for arg in base if arg not in arguments]
+        if added:
+            print(f"  + {' '.join(added)}")
+        if removed:
+            print(f"  - {' '.join(removed)}")
+    if len(order) > top:
+        print(f"... {len(order) - top} more profiles")
+
+
+def compact_path_of(path: str) -> str:
+    return os.path.splitext(path)[0] + ".compact.json"
+
+
+def profile(path: str = COMPILE_COMMANDS_FILE, write_compact: bool = False, top: int = 10):
+    """
+    Group the entries by their flags and report the distinct profiles. With
+    `write_compact`, also write the compacted database next to the file, see
+    expand() for the way back.
+    """
+    profiles = FlagProfiles()
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        entries = [profiles.compact(entry) for entry in iter_entries(data)]
+
+    report_profiles(profiles, top)
+    if not write_compact:
+        return
+
+    compact_path = compact_path_of(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".compile_commands.", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(
+                {
+                    "format": COMPACT_FORMAT,
+                    "strings": profiles.strings,
+                    "profiles": profiles.profiles,
+                    "entries": entries,
+                },
+                file,
+                separators=(",", ":"),
+            )
+        set_mode_of(temp_path, compact_path)
+        os.replace(temp_path, compact_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    origin = xiaochen_py.get_file_info(path)
+    new_info = xiaochen_py.get_file_info(compact_path)
+    print(f"origin file size: {origin.size}, compact file size: {new_info.size}")
+    print(f"compact compile_commands.json has been written to {compact_path}")
+
+
+def expand(compact_path: str, path: str = COMPILE_COMMANDS_FILE):
+    """
+    Write the standard compile_commands.json from a file written by
+    profile(write_compact=True), the entries are the same as the ones it was
+    compacted from (and so are the bytes, if that file was written by sort()).
+    """
+    with open(compact_path, "r") as file:
+        compact = json.load(file)
+    if compact.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"{compact_path} is not a compact compile_commands.json")
+
+    profiles = FlagProfiles()
+    profiles.strings = compact["strings"]
+    profiles.profiles = compact["profiles"]
+    records = ((0, 0, encode_entry(profiles.expand(entry))) for entry in compact["entries"])
+    count = write_entries(path, b"", records)
+    print(f"compile_commands.json has been written to {path} with {count} entries")
 
 
 if __name__ == "__main__":
+    # Usage: ./xc_sort_compile_commands.py [file] [--memory-budget MiB]
+    #        ./xc_sort_compile_commands.py [file] --merge FRESH
+    #
+    # It reads the compile_commands.json file in the current directory
+    # and sorts it by "file" key. The output is the same as
+    # json.dump(sorted_data, file, indent=2), the entries are copied without
+    # being decoded when the input already has this layout.
+    #        ./xc_sort_compile_commands.py [file] --profiles [--compact]
+    #        ./xc_sort_compile_commands.py [file] --expand COMPACT
+    #
+    # With --merge, the entries of the files in FRESH (e.g. generated for the
+    # changed targets only) replace the ones in the sorted file, the result is
+    # the same as sorting the file with the old entries of these files removed
+    # and the fresh ones added.
+    #
+    # --profiles reports the distinct flag sets of the entries, --compact also
+    # writes them to compile_commands.compact.json (a string table, the flag
+    # profiles and the per-file references), --expand writes the standard
+    # file back from it.
+
     # generate()
 
-    # It reads the compile_commands.json file in the current directory
-    # and sorts it by "file" key.
-    sort()
+    xiaochen_py.setup_logging()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", nargs="?", default=COMPILE_COMMANDS_FILE)
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=MEMORY_BUDGET // 1024 // 1024,
+        help="MiB of sort keys kept in memory, the rest is merged from temporary files",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--merge",
+        metavar="FRESH",
+        help="merge the entries of a partial compile_commands.json into the sorted file",
+    )
+    group.add_argument(
+        "--profiles", action="store_true", help="report the distinct flag profiles"
+    )
+    group.add_argument(
+        "--expand", metavar="COMPACT", help="write the file from a compacted one"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="with --profiles, write the compacted file next to the file",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="with --profiles, the number of profiles to print"
+    )
+    args = parser.parse_args()
+
+    if args.merge:
+        merge(args.merge, args.file)
+    elif args.profiles:
+        profile(args.file, args.compact, args.top)
+    elif args.expand:
+        expand(args.expand, args.file)
+    else:
+        sort(args.file, args.memory_budget * 1024 * 1024)
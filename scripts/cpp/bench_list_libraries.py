@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Benchmarks of xc_list_libraries.py on a synthetic tree of generated static
+# libraries.
+#
+# Usage: ./bench_list_libraries.py jobs [--libraries N] [--symbols N]
+#        ./bench_list_libraries.py resolve
+#        ./bench_list_libraries.py native [--libraries N] [--symbols N]
+#
+# "native" checks that xc_elf_symbols lists the same symbols as nm for every
+# generated archive before timing both.
+
+import argparse
+import os
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import xc_list_libraries
+from xc_elf_symbols import read_archive_symbols
+from xc_symbol_index import SymbolIndex
+
+
+def generate_library(directory: str, i: int, symbols: int):
+    """
+    Generate "lib<i>.a" which defines "symbols" functions, every function calls
+    a function of the previous library.
+    """
+    source_path = os.path.join(directory, f"lib{i}.c")
+    with open(source_path, "w") as f:
+        for j in range(symbols):
+            if i > 0:
+                f.write(f"int lib{i - 1}_func{j}(void);\n")
+                f.write(f"int lib{i}_func{j}(void) {{ return lib{i - 1}_func{j}() + 1; }}\n")
+            else:
+                f.write(f"int lib{i}_func{j}(void) {{ return {j}; }}\n")
+
+        # the other kinds of symbols that nm lists (or skips)
+        f.write(f"__attribute__((weak)) int lib{i}_weak(void) {{ return 0; }}\n")
+        f.write(f"extern int lib{i}_weak_ref(void) __attribute__((weak));\n")
+        f.write(f"int lib{i}_data = 1;\n")
+        f.write(f"int lib{i}_common;\n")
+        f.write(f"static int lib{i}_static(void) {{ return lib{i}_weak_ref ? lib{i}_weak_ref() : 0; }}\n")
+        f.write(f"int lib{i}_use_static(void) {{ return lib{i}_static(); }}\n")
+
+    object_path = os.path.join(directory, f"lib{i}.o")
+    library_path = os.path.join(directory, f"lib{i}.a")
+    subprocess.run(["gcc", "-fcommon", "-c", source_path, "-o", object_path], check=True)
+    subprocess.run(["ar", "rcs", library_path, object_path], check=True)
+    os.remove(source_path)
+    os.remove(object_path)
+
+
+def generate_tree(directory: str, libraries: int, symbols: int):
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(lambda i: generate_library(directory, i, symbols), range(libraries)))
+
+
+def bench_jobs(args):
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"generating {args.libraries} libraries with {args.symbols} symbols each")
+        generate_tree(directory, args.libraries, args.symbols)
+        libraries = xc_list_libraries.find_libraries(directory)
+
+        cpu_count = os.cpu_count() or 1
+        jobs_list = sorted({1, 2, 4, 8, 16, 32, cpu_count})
+        baseline = None
+        for jobs in jobs_list:
+            index = SymbolIndex(os.path.join(directory, "index.sqlite"), rebuild=True)
+            start_time = time.perf_counter()
+            xc_list_libraries.load_symbols(libraries, index, jobs)
+            duration = time.perf_counter() - start_time
+            index.close()
+
+            if baseline is None:
+                baseline = duration
+            print(f"jobs: {jobs:>2}, {duration:.2f}s, speedup: {baseline / duration:.1f}x")
+
+
+def bench_resolve(args):
+    """
+    Resolve the dependencies of synthetic symbol tables (no nm), the cost per
+    symbol should stay flat as the total grows.
+    """
+    random.seed(0)
+    for total in [1_000, 10_000, 100_000]:
+        libraries = [f"lib{i}.a" for i in range(max(10, total // 100))]
+        per_library = total // len(libraries)
+
+        defined_symbols = dict()
+        undefined_symbols = dict()
+        for i, lib in enumerate(libraries):
+            defined_symbols[lib] = [f"lib{i}_func{j}" for j in range(per_library)]
+        for i, lib in enumerate(libraries):
+            undefined = list()
+            for _ in range(per_library):
+                # depend on a library built earlier, plus some unresolved symbols
+                if i > 0 and random.random() < 0.9:
+                    other = random.randrange(i)
+                    undefined.append(f"lib{other}_func{random.randrange(per_library)}")
+                else:
+                    undefined.append(f"missing_func{random.randrange(per_library)}")
+            undefined_symbols[lib] = undefined
+
+        start_time = time.perf_counter()
+        definitions = xc_list_libraries.build_definitions(defined_symbols)
+        dependencies, _ = xc_list_libraries.compute_dependencies(
+            undefined_symbols, definitions, set()
+        )
+        xc_list_libraries.topological_sort(libraries, dependencies)
+        duration = time.perf_counter() - start_time
+
+        print(
+            f"symbols: {total:>7}, libraries: {len(libraries):>5}, "
+            f"{duration * 1000:8.1f}ms, {duration / total * 1e9:6.0f}ns/symbol"
+        )
+
+
+def bench_native(args):
+    """
+    Check that the native reader gives the same symbols as nm, then compare
+    their speed.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"generating {args.libraries} libraries with {args.symbols} symbols each")
+        generate_tree(directory, args.libraries, args.symbols)
+        libraries = xc_list_libraries.find_libraries(directory)
+
+        for library in libraries:
+            native = read_archive_symbols(library)
+            nm = xc_list_libraries.get_symbols_nm(library)
+            if sorted(native[0]) != sorted(nm[0]) or sorted(native[1]) != sorted(nm[1]):
+                raise RuntimeError(f"symbols of {library} differ from nm")
+        print(f"parity: {len(libraries)} libraries match nm")
+
+        for name, extract in [
+            ("nm", xc_list_libraries.get_symbols_nm),
+            ("native", read_archive_symbols),
+        ]:
+            start_time = time.perf_counter()
+            for library in libraries:
+                extract(library)
+            duration = time.perf_counter() - start_time
+            print(f"{name:>6}: {duration:.2f}s, {duration / len(libraries) * 1000:.2f}ms/library")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_jobs = subparsers.add_parser("jobs", help="scaling of the parallel nm extraction")
+    parser_jobs.add_argument("--libraries", type=int, default=200)
+    parser_jobs.add_argument("--symbols", type=int, default=200)
+    parser_jobs.set_defaults(func=bench_jobs)
+
+    parser_resolve = subparsers.add_parser("resolve", help="scaling of the dependency resolution")
+    parser_resolve.set_defaults(func=bench_resolve)
+
+    parser_native = subparsers.add_parser("native", help="parity and speed of the native reader vs nm")
+    parser_native.add_argument("--libraries", type=int, default=200)
+    parser_native.add_argument("--symbols", type=int, default=200)
+    parser_native.set_defaults(func=bench_native)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,174 @@
+# Read the external symbols of static libraries without spawning nm.
+#
+# An "ar" archive is mapped with mmap. The archive symbol index (the "/" or
+# "/SYM64/" member) only lists the defined symbols, so the ".symtab" section
+# of every ELF member is read instead, it lists both the defined and the
+# undefined symbols.
+#
+# references:
+# - https://man7.org/linux/man-pages/man5/elf.5.html
+# - https://en.wikipedia.org/wiki/Ar_(Unix)#System_V_(or_GNU)_variant
+
+import mmap
+import struct
+
+
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER = struct.Struct("16s12s6s6s8s10s2s")
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+SHT_SYMTAB = 2
+SHN_UNDEF = 0
+
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+# the bindings listed by "nm --extern-only"
+EXTERN_BINDINGS = (STB_GLOBAL, STB_WEAK, STB_GNU_UNIQUE)
+
+
+class UnsupportedFormat(ValueError):
+    """
+    The file is not an archive of ELF objects that can be read (e.g. a thin
+    archive or LLVM bitcode members), the caller should fall back to nm.
+    """
+
+
+class ElfLayout:
+    """
+    The struct layouts of one ELF class and byte order.
+    """
+
+    def __init__(self, elf_class: int, elf_data: int):
+        if elf_data == ELFDATA2LSB:
+            order = "<"
+        elif elf_data == ELFDATA2MSB:
+            order = ">"
+        else:
+            raise UnsupportedFormat(f"unknown ELF data encoding: {elf_data}")
+
+        if elf_class == ELFCLASS64:
+            # e_type .. e_shstrndx, after e_ident
+            self.header = struct.Struct(order + "HHIQQQIHHHHHH")
+            # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, ...
+            self.section = struct.Struct(order + "IIQQQQIIQQ")
+            # st_name, st_info, st_other, st_shndx, st_value, st_size
+            self.symbol = struct.Struct(order + "IBBHQQ")
+            self.symbol_fields = (0, 1, 3)
+        elif elf_class == ELFCLASS32:
+            self.header = struct.Struct(order + "HHIIIIIHHHHHH")
+            self.section = struct.Struct(order + "IIIIIIIIII")
+            # st_name, st_value, st_size, st_info, st_other, st_shndx
+            self.symbol = struct.Struct(order + "IIIBBH")
+            self.symbol_fields = (0, 3, 5)
+        else:
+            raise UnsupportedFormat(f"unknown ELF class: {elf_class}")
+
+
+LAYOUTS = dict()
+
+
+def get_layout(elf_class: int, elf_data: int) -> ElfLayout:
+    key = (elf_class, elf_data)
+    if key not in LAYOUTS:
+        LAYOUTS[key] = ElfLayout(elf_class, elf_data)
+    return LAYOUTS[key]
+
+
+def read_elf_symbols(data, defined: list[str], undefined: list[str]):
+    """
+    Append the external symbols of an ELF object to the lists, the same
+    symbols as "nm --extern-only" lists: type "U" goes to `undefined`, all the
+    other types (including the weak undefined "w") go to `defined`.
+
+    Args:
+    - data: A memoryview of the whole object.
+    """
+    if bytes(data[:4]) != ELF_MAGIC:
+        raise UnsupportedFormat("not an ELF object")
+    layout = get_layout(data[4], data[5])
+
+    header = layout.header.unpack_from(data, 16)
+    e_shoff, e_shentsize, e_shnum = header[5], header[10], header[11]
+    if e_shoff == 0:
+        return
+    if e_shnum == 0:
+        # extended section numbering, the number is in the first section header
+        e_shnum = layout.section.unpack_from(data, e_shoff)[5]
+
+    sections = [
+        layout.section.unpack_from(data, e_shoff + i * e_shentsize) for i in range(e_shnum)
+    ]
+
+    name_field, info_field, shndx_field = layout.symbol_fields
+    for section in sections:
+        if section[1] != SHT_SYMTAB:
+            continue
+        sh_offset, sh_size, sh_link = section[4], section[5], section[6]
+        strtab = sections[sh_link]
+        strtab_start = strtab[4]
+        strtab_end = strtab_start + strtab[5]
+        # the symbol table and the string table are searched in a bytes copy,
+        # memoryview doesn't support "find"
+        strings = bytes(data[strtab_start:strtab_end])
+
+        for symbol in layout.symbol.iter_unpack(data[sh_offset : sh_offset + sh_size]):
+            st_name = symbol[name_field]
+            if st_name == 0 or (symbol[info_field] >> 4) not in EXTERN_BINDINGS:
+                continue
+            end = strings.find(b"\0", st_name)
+            name = strings[st_name:end].decode("utf-8")
+            if symbol[shndx_field] == SHN_UNDEF and (symbol[info_field] >> 4) != STB_WEAK:
+                undefined.append(name)
+            else:
+                defined.append(name)
+
+
+def iter_members(data):
+    """
+    Yield tuple(name, memoryview of the content) of every member of an "ar"
+    archive, the special members ("/", "//", "/SYM64/") included.
+    """
+    if bytes(data[: len(AR_MAGIC)]) != AR_MAGIC:
+        raise UnsupportedFormat("not an ar archive (thin archives are not supported)")
+
+    offset = len(AR_MAGIC)
+    while offset + AR_HEADER.size <= len(data):
+        name, _, _, _, _, size, fmag = AR_HEADER.unpack_from(data, offset)
+        if fmag != b"`\n":
+            raise UnsupportedFormat(f"bad member header at offset {offset}")
+        size = int(size)
+        start = offset + AR_HEADER.size
+        yield name.rstrip(b" "), data[start : start + size]
+        # members are aligned to 2 bytes
+        offset = start + size + (size & 1)
+
+
+def read_archive_symbols(path: str) -> tuple[list[str], list[str]]:
+    """
+    Return the defined and undefined external symbols of all the members of
+    an archive (or of a single ELF object).
+    """
+    defined = list()
+    undefined = list()
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            return defined, undefined
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # every view of the mmap must be released before it's closed
+            with memoryview(mm) as data:
+                if bytes(data[:4]) == ELF_MAGIC:
+                    read_elf_symbols(data, defined, undefined)
+                    return defined, undefined
+
+                for name, content in iter_members(data):
+                    with content:
+                        if name in (b"/", b"//", b"/SYM64/", b"__.SYMDEF", b"__.SYMDEF SORTED"):
+                            continue
+                        read_elf_symbols(content, defined, undefined)
+    return defined, undefined
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
-import sys
+import struct
 import subprocess
+import sys
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
+from xc_elf_symbols import UnsupportedFormat, read_archive_symbols
+from xc_symbol_index import SymbolIndex
 
-def get_std_symbols() -> list[str]:
-    std_symbols = list()
+
+def get_std_symbols(jobs: int = 1) -> set[str]:
+    std_symbols = set()
     std_libs = [
         "/usr/lib32/libc.so.6",  # glibc
         "/usr/lib32/libm.so.6",  # math library
     ]
-    for lib in std_libs:
-        result = subprocess.run(
+
+    def run_nm(lib):
+        return subprocess.run(
             # -D, --dynamic: Display the dynamic symbols rather than the normal symbols.  This is only meaningful for dynamic objects, such as certain types of shared libraries.
             # -g, --extern-only: Display only external symbols.
             ["nm", "--dynamic", "--extern-only", lib],
@@ -21,6 +29,11 @@ def get_std_symbols() -> list[str]:
             text=True,
             check=True,
         )
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(run_nm, std_libs))
+
+    for result in results:
         for line in result.stdout.splitlines():
             parts = line.split()
             if len(parts) == 3:
@@ -31,12 +44,12 @@ def get_std_symbols() -> list[str]:
                 # W: (global symbol) The  symbol  is  a weak symbol that has not been specifically tagged as a weak object symbol.
                 if symbol_type in ["D", "T", "i", "W"]:
                     symbol_name = symbol_name.split("@")[0]
-                    std_symbols.append(symbol_name)
+                    std_symbols.add(sys.intern(symbol_name))
 
     return std_symbols
 
 
-def get_symbols(library: str) -> tuple[list[str], list[str]]:
+def get_symbols_nm(library: str) -> tuple[list[str], list[str]]:
     result = subprocess.run(
         # --extern-only: Display only external symbols.
         ["nm", "--extern-only", library],
@@ -61,25 +74,51 @@ def get_symbols(library: str) -> tuple[list[str], list[str]]:
             else:
                 defined_symbols.append(symbol_name)
 
+    return defined_symbols, undefined_symbols
+
+
+def get_symbols(library: str) -> tuple[list[str], list[str]]:
+    try:
+        # read the ELF symbol tables directly, no nm process
+        defined_symbols, undefined_symbols = read_archive_symbols(library)
+    except (UnsupportedFormat, struct.error, UnicodeDecodeError, IndexError):
+        # e.g. thin archives or LLVM bitcode members
+        defined_symbols, undefined_symbols = get_symbols_nm(library)
+
+    # symbol names are interned, the same name appears in many libraries and
+    # the dependency computation compares them a lot
+    defined_symbols = [sys.intern(symbol) for symbol in defined_symbols]
+    undefined_symbols = [sys.intern(symbol) for symbol in undefined_symbols]
+
     # remove self-references
+    defined_set = set(defined_symbols)
     undefined_symbols = [
-        symbol for symbol in undefined_symbols if symbol not in defined_symbols
+        symbol for symbol in undefined_symbols if symbol not in defined_set
     ]
 
     return defined_symbols, undefined_symbols
 
 
-def list_libraries(directory: str, symbols: list[str]):
+def find_libraries(directory: str) -> list[str]:
     libraries = []
     for root, _, files in os.walk(directory):
         for file in files:
             if file.endswith(".a"):
                 file_path = os.path.join(root, file)
                 libraries.append(file_path)
+    return libraries
 
-    print(f"found {len(libraries)} libraries:")
-    for i, cur_lib in enumerate(libraries):
-        print(f"[{i}]: {cur_lib}")
+
+def load_symbols(
+    libraries: list[str], index: SymbolIndex, jobs: int = 1
+) -> tuple[dict[str, list[str]], dict[str, list[str]]]:
+    """
+    Return the defined and undefined symbols of the libraries, only the
+    libraries changed since the last run are scanned (`jobs` libraries at the
+    same time), the others are read from the index.
+    """
+    scanned = index.update(libraries, get_symbols, jobs=jobs)
+    print(f"scanned {len(scanned)} changed libraries, {len(libraries) - len(scanned)} from index")
 
     # key: library path
     # value: list of undefined symbols
@@ -87,41 +126,252 @@ def list_libraries(directory: str, symbols: list[str]):
     # key: library path
     # value: list of defined symbols
     defined_symbols = dict()
-    for cur_lib in libraries:
-        defined, undefined = get_symbols(cur_lib)
+    for cur_lib, (defined, undefined) in index.get_symbols(libraries).items():
         defined_symbols[cur_lib] = defined
         undefined_symbols[cur_lib] = undefined
 
-    std_symbols = get_std_symbols()
+    return defined_symbols, undefined_symbols
 
-    # key: library
-    # value: list of libraries that the key library depends on
-    dependencies = dict()
 
+def build_definitions(defined_symbols: dict[str, list[str]]) -> dict[str, list[str]]:
+    """
+    Build the global symbol index.
+
+    key: symbol
+    value: list of libraries that define the symbol
+    """
+    definitions = dict()
+    for lib, symbols in defined_symbols.items():
+        for symbol in symbols:
+            libs = definitions.get(symbol)
+            if libs is None:
+                definitions[symbol] = [lib]
+            elif libs[-1] is not lib:
+                libs.append(lib)
+    return definitions
+
+
+def compute_dependencies(
+    undefined_symbols: dict[str, list[str]],
+    definitions: dict[str, list[str]],
+    std_symbols: set[str],
+) -> tuple[dict[str, set[str]], dict[str, list[str]]]:
+    """
+    Resolve the undefined symbols of every library with the symbol index, the
+    cost is linear in the total number of symbols.
+
+    Returns tuple(dependencies, unresolved):
+    - dependencies: key: library, value: set of libraries that the key library depends on
+    - unresolved: key: library, value: list of symbols that are defined by
+      neither a library nor the std libraries
+    """
+    dependencies = dict()
+    unresolved = dict()
     for cur_lib, cur_symbols in undefined_symbols.items():
         for symbol in cur_symbols:
-            found = False
-            for other_library, other_symbols in defined_symbols.items():
-                if symbol in other_symbols:
-                    dependencies.setdefault(cur_lib, set()).add(other_library)
-                    found = True
-            if not found:
-                if symbol not in std_symbols:
-                    # found an undefined symbol
-                    pass
+            libs = definitions.get(symbol)
+            if libs is not None:
+                dependencies.setdefault(cur_lib, set()).update(libs)
+            elif symbol not in std_symbols:
+                # found an undefined symbol
+                unresolved.setdefault(cur_lib, list()).append(symbol)
+    return dependencies, unresolved
+
+
+def resolve_symbols(
+    symbols: list[str],
+    libraries: list[str],
+    index: SymbolIndex,
+    std_symbols: set[str],
+) -> tuple[list[str], dict[str, set[str]], dict[str, list[str]]]:
+    """
+    Compute the minimal closure of libraries needed by the root symbols.
+
+    Starting from the root symbols, every symbol is resolved to the first
+    library (in the order of "libraries") that defines it, then the undefined
+    symbols of that library are resolved in the next round. Only the libraries
+    in the closure are read from the index.
+
+    Returns tuple(closure, dependencies, unresolved):
+    - closure: libraries in the order they are pulled in
+    - dependencies: key: library, value: set of libraries in the closure that the key library depends on
+    - unresolved: key: symbol that is defined by neither a library nor the std
+      libraries, value: list of libraries that need it ("<root>" for the root symbols)
+    """
+    closure = list()
+    dependencies = dict()
+    unresolved = dict()
+    # key: symbol
+    # value: library that the symbol is resolved to
+    resolved = dict()
+
+    # list of tuple(symbol, the library that needs it)
+    pending = [(sys.intern(symbol), "<root>") for symbol in symbols]
+    while pending:
+        lookup = {symbol for symbol, _ in pending if symbol not in resolved and symbol not in unresolved}
+        definitions = index.find_definitions(lookup, libraries)
+
+        new_libraries = list()
+        for symbol, requester in pending:
+            lib = resolved.get(symbol)
+            if lib is None and symbol in definitions:
+                lib = definitions[symbol][0]
+                resolved[symbol] = lib
+                if lib not in dependencies:
+                    dependencies[lib] = set()
+                    closure.append(lib)
+                    new_libraries.append(lib)
 
+            if lib is not None:
+                if requester != "<root>" and lib != requester:
+                    dependencies[requester].add(lib)
+            elif symbol not in std_symbols:
+                # found an undefined symbol
+                unresolved.setdefault(symbol, list()).append(requester)
+
+        pending = [
+            (symbol, lib) for lib in new_libraries for symbol in index.get_undefined(lib)
+        ]
+
+    return closure, dependencies, unresolved
+
+
+def link_order(libraries: list[str], dependencies: dict[str, set[str]]) -> list[list[str]]:
+    """
+    Return the libraries in link order: a library comes before the libraries it
+    depends on.
+
+    Libraries that depend on each other (a cycle) are returned in one group,
+    they must be linked inside "-Wl,--start-group ... -Wl,--end-group". The
+    other groups have exactly one library.
+    """
+    # Tarjan's strongly connected components algorithm (iterative), the
+    # components are found in reverse topological order: a component is found
+    # after all the components it depends on
+    positions = {lib: i for i, lib in enumerate(libraries)}
+    indexes = dict()
+    lowlinks = dict()
+    stack = list()
+    on_stack = set()
+    groups = list()
+
+    for root in libraries:
+        if root in indexes:
+            continue
+        work = [(root, iter(sorted(dependencies.get(root, ()), key=positions.get)))]
+        indexes[root] = lowlinks[root] = len(indexes)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            lib, deps = work[-1]
+            dep = next(deps, None)
+            if dep is not None:
+                if dep not in indexes:
+                    indexes[dep] = lowlinks[dep] = len(indexes)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(sorted(dependencies.get(dep, ()), key=positions.get))))
+                elif dep in on_stack:
+                    lowlinks[lib] = min(lowlinks[lib], indexes[dep])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlinks[parent] = min(lowlinks[parent], lowlinks[lib])
+            if lowlinks[lib] == indexes[lib]:
+                group = list()
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    group.append(member)
+                    if member == lib:
+                        break
+                groups.append(sorted(group, key=positions.get))
+
+    return groups[::-1]
+
+
+def query_symbols(
+    symbols: list[str], libraries: list[str], index: SymbolIndex, std_symbols: set[str]
+):
+    closure, dependencies, unresolved = resolve_symbols(
+        symbols, libraries, index, std_symbols
+    )
+
+    print(f"{len(closure)} libraries needed by {len(symbols)} symbols")
+    print("link order: (earlier libraries depend on later libraries)")
+    for group in link_order(closure, dependencies):
+        if len(group) == 1:
+            print(group[0])
+        else:
+            print("-Wl,--start-group")
+            for lib in group:
+                print(f"  {lib}")
+            print("-Wl,--end-group")
+
+    if unresolved:
+        print(f"{len(unresolved)} unresolved symbols:")
+        for symbol in sorted(unresolved):
+            print(f"{symbol} (needed by: {', '.join(unresolved[symbol])})")
+
+
+def list_libraries(
+    directory: str,
+    symbols: list[str],
+    index_path: Optional[str] = None,
+    rebuild: bool = False,
+    jobs: int = 1,
+    verbose: bool = False,
+):
+    """
+    Print all the libraries under the directory in dependency order, or if
+    symbols are given, only the libraries needed by the symbols in link order
+    and the unresolved symbols.
+    """
+    libraries = find_libraries(directory)
+
+    print(f"found {len(libraries)} libraries:")
+    if not symbols:
+        for i, cur_lib in enumerate(libraries):
+            print(f"[{i}]: {cur_lib}")
+
+    index = SymbolIndex(index_path, rebuild=rebuild)
+    index.prune(directory, libraries)
+    if symbols:
+        # only the changed libraries are scanned, the query reads the index
+        scanned = index.update(libraries, get_symbols, jobs=jobs)
+        print(f"scanned {len(scanned)} changed libraries")
+        query_symbols(symbols, libraries, index, get_std_symbols(jobs))
+        index.close()
+        return
+
+    defined_symbols, undefined_symbols = load_symbols(libraries, index, jobs)
+    index.close()
+
+    std_symbols = get_std_symbols(jobs)
+
+    definitions = build_definitions(defined_symbols)
+    dependencies, unresolved = compute_dependencies(
+        undefined_symbols, definitions, std_symbols
+    )
+
+    # key: library
+    # value: position in "libraries"
+    positions = {lib: i for i, lib in enumerate(libraries)}
     for i, cur_lib in enumerate(libraries):
-        # print(f"[{i}]: {cur_lib}")
-        if cur_lib in dependencies:
-            # print(f"  depends on:")
-            sorted_dependencies = list()
-            for j, lib in enumerate(libraries):
-                if lib in dependencies[cur_lib]:
-                    sorted_dependencies.append((j, lib))
+        if verbose:
+            print(f"[{i}]: {cur_lib}")
+        if cur_lib in dependencies and verbose:
+            print(f"  depends on:")
+            sorted_dependencies = sorted(
+                (positions[lib], lib) for lib in dependencies[cur_lib]
+            )
 
-            for id, dep in sorted(sorted_dependencies):
-                # print(f"    [{id}]: {dep}")
-                pass
+            for id, dep in sorted_dependencies:
+                print(f"    [{id}]: {dep}")
+        if cur_lib in unresolved and verbose:
+            print(f"  unresolved symbols: {', '.join(unresolved[cur_lib])}")
 
     sorted_libraries = topological_sort(libraries, dependencies)
     print("libraries in dependency order: (later libraries depend on earlier libraries)")
@@ -162,11 +412,31 @@ def topological_sort(libraries, dependencies):
 
 
 if __name__ == "__main__":
-    # Usage: ./xc_list_libraries.py <dir> [symbol_a] [symbol_b] ...
+    # Usage: ./xc_list_libraries.py [--index PATH] [--rebuild] [--jobs N] [--verbose] <dir> [symbol_a] [symbol_b] ...
+    #
+    # Without symbols, print all the libraries in dependency order. With
+    # symbols, print the libraries needed by the symbols in link order.
 
-    directory = "."
-    if len(sys.argv) >= 2:
-        directory = sys.argv[1]
-    symbols = sys.argv[2:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?", default=".")
+    parser.add_argument("symbols", nargs="*")
+    parser.add_argument(
+        "--index", help="path of the symbol index (default: ~/.cache/xc_symbol_index.sqlite)"
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="drop the symbol index and scan all libraries"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of libraries scanned at the same time (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="print the dependencies of every library"
+    )
+    args = parser.parse_args()
 
-    list_libraries(directory, symbols)
+    list_libraries(
+        args.directory, args.symbols, args.index, args.rebuild, args.jobs, args.verbose
+    )
@@ -0,0 +1,248 @@
+# An on-disk index of the external symbols of static libraries, shared by
+# xc_list_libraries.py and xc_search_symbol.
+#
+# Every archive is keyed by its path, mtime, size and inode, only the archives
+# that changed since the last run are scanned again.
+
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+
+def default_index_path() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "xc_symbol_index.sqlite")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    archive_id INTEGER NOT NULL REFERENCES archives(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    -- 1: defined, 0: undefined
+    defined INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_archive ON symbols(archive_id);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+"""
+
+
+class SymbolIndex:
+    def __init__(self, index_path: Optional[str] = None, rebuild: bool = False):
+        """
+        Open (or create) the index.
+
+        Args:
+        - index_path: The path of the index file, defaults to ~/.cache/xc_symbol_index.sqlite.
+        - rebuild: Drop everything in the index, all archives will be scanned again.
+        """
+        if index_path is None:
+            index_path = default_index_path()
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+        self.conn = sqlite3.connect(index_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        if rebuild:
+            self.conn.executescript("DROP TABLE IF EXISTS symbols; DROP TABLE IF EXISTS archives;")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def stale_libraries(self, libraries: list[str]) -> dict[str, tuple[int, int, int]]:
+        """
+        Return the libraries that are not in the index or changed since they
+        were indexed.
+
+        key: library path (as given)
+        value: tuple(mtime_ns, size, inode) of the library now
+        """
+        known = dict()
+        for path, mtime_ns, size, inode in self.conn.execute(
+            "SELECT path, mtime_ns, size, inode FROM archives"
+        ):
+            known[path] = (mtime_ns, size, inode)
+
+        stale = dict()
+        for library in libraries:
+            st = os.stat(library)
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if known.get(os.path.abspath(library)) != key:
+                stale[library] = key
+        return stale
+
+    def put(
+        self, library: str, key: tuple[int, int, int], defined: list[str], undefined: list[str]
+    ):
+        """
+        Replace the symbols of the library.
+
+        `key` is the (mtime_ns, size, inode) of the library taken before the
+        symbols were extracted, so an archive rewritten during the scan is
+        stale on the next run instead of keeping the old symbols.
+        """
+        path = os.path.abspath(library)
+        mtime_ns, size, inode = key
+        with self.conn:
+            self.conn.execute("DELETE FROM archives WHERE path = ?", (path,))
+            cursor = self.conn.execute(
+                "INSERT INTO archives (path, mtime_ns, size, inode) VALUES (?, ?, ?, ?)",
+                (path, mtime_ns, size, inode),
+            )
+            archive_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO symbols (archive_id, name, defined) VALUES (?, ?, 1)",
+                ((archive_id, name) for name in defined),
+            )
+            self.conn.executemany(
+                "INSERT INTO symbols (archive_id, name, defined) VALUES (?, ?, 0)",
+                ((archive_id, name) for name in undefined),
+            )
+
+    def update(
+        self,
+        libraries: list[str],
+        extract: Callable[[str], tuple[list[str], list[str]]],
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+        jobs: int = 1,
+    ) -> list[str]:
+        """
+        Scan the stale libraries with `extract` (which returns the defined and
+        undefined symbols of a library) and store the result.
+
+        If `on_error` is given, a failed library is passed to it and skipped,
+        otherwise the exception is raised.
+
+        Up to `jobs` libraries are scanned at the same time, `extract` runs in a
+        process pool (the symbol tables are parsed in Python, threads would be
+        serialized by the GIL), the results are stored as they come back.
+        `extract` must be a module-level function so it can be pickled.
+
+        Returns the scanned libraries.
+        """
+        stale = self.stale_libraries(libraries)
+        if jobs <= 1 or len(stale) <= 1:
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+        with executor:
+            futures = {executor.submit(extract, library): library for library in stale}
+            try:
+                for future in as_completed(futures):
+                    library = futures[future]
+                    try:
+                        defined, undefined = future.result()
+                    except Exception as e:
+                        if on_error is None:
+                            raise
+                        on_error(library, e)
+                        continue
+                    self.put(library, stale[library], defined, undefined)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return list(stale)
+
+    def prune(self, directory: str, libraries: list[str]):
+        """
+        Remove the archives under `directory` that are not in `libraries`
+        (i.e. deleted since they were indexed).
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        existing = {os.path.abspath(library) for library in libraries}
+        removed = [
+            (path,)
+            for (path,) in self.conn.execute("SELECT path FROM archives")
+            if path.startswith(prefix) and path not in existing
+        ]
+        with self.conn:
+            self.conn.executemany("DELETE FROM archives WHERE path = ?", removed)
+
+    def get_symbols(self, libraries: list[str]) -> dict[str, tuple[list[str], list[str]]]:
+        """
+        Return the defined and undefined symbols of the libraries.
+
+        key: library path (as given)
+        value: tuple(defined symbols, undefined symbols)
+        """
+        by_path = {os.path.abspath(library): library for library in libraries}
+        result = {library: (list(), list()) for library in libraries}
+        query = """
+            SELECT archives.path, symbols.name, symbols.defined
+            FROM symbols JOIN archives ON symbols.archive_id = archives.id
+        """
+        for path, name, defined in self.conn.execute(query):
+            library = by_path.get(path)
+            if library is None:
+                continue
+            name = sys.intern(name)
+            if defined:
+                result[library][0].append(name)
+            else:
+                result[library][1].append(name)
+        return result
+
+    def find_definitions(self, symbols: list[str], libraries: list[str]) -> dict[str, list[str]]:
+        """
+        Look up the libraries that define the symbols, with the index on the
+        symbol name, only the rows of the given symbols are read.
+
+        key: symbol
+        value: list of libraries (in the order of `libraries`) that define the symbol
+        """
+        by_path = {os.path.abspath(library): library for library in libraries}
+        positions = {library: i for i, library in enumerate(libraries)}
+        definitions = dict()
+        symbols = list(symbols)
+        # stay below the max number of host parameters of SQLite
+        for start in range(0, len(symbols), 500):
+            batch = symbols[start : start + 500]
+            query = f"""
+                SELECT symbols.name, archives.path
+                FROM symbols JOIN archives ON symbols.archive_id = archives.id
+                WHERE symbols.defined = 1 AND symbols.name IN ({", ".join("?" * len(batch))})
+            """
+            for name, path in self.conn.execute(query, batch):
+                library = by_path.get(path)
+                if library is not None:
+                    definitions.setdefault(sys.intern(name), set()).add(library)
+        return {
+            name: sorted(libs, key=lambda library: positions[library])
+            for name, libs in definitions.items()
+        }
+
+    def get_undefined(self, library: str) -> list[str]:
+        """
+        Return the undefined symbols of the library.
+        """
+        query = """
+            SELECT symbols.name
+            FROM symbols JOIN archives ON symbols.archive_id = archives.id
+            WHERE archives.path = ? AND symbols.defined = 0
+        """
+        path = os.path.abspath(library)
+        return [sys.intern(name) for (name,) in self.conn.execute(query, (path,))]
+
+    def search(self, symbol: str, libraries: list[str]) -> list[str]:
+        """
+        Return the libraries that have a symbol containing the given string.
+        """
+        by_path = {os.path.abspath(library): library for library in libraries}
+        query = """
+            SELECT DISTINCT archives.path
+            FROM symbols JOIN archives ON symbols.archive_id = archives.id
+            WHERE instr(symbols.name, ?) > 0
+        """
+        found = {path for (path,) in self.conn.execute(query, (symbol,))}
+        return [by_path[path] for path in by_path if path in found]
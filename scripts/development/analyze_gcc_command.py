@@ -1,4 +1,62 @@
 #!/usr/bin/env python3
+import argparse
+import collections
+import hashlib
+import json
+import os
+import pickle
+import re
+import shlex
+import sys
+from typing import Iterator, Optional
+
+
+TOKEN_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "xc_analyze_gcc_command",
+    "tokens.pickle",
+)
+
+# the options whose value may be the next argument or joined to the option,
+# the longer ones first (e.g. "-include" before "-I")
+VALUE_OPTIONS = (
+    "-isystem",
+    "-iquote",
+    "-idirafter",
+    "-isysroot",
+    "-include",
+    "-imacros",
+    "--sysroot",
+    "-MF",
+    "-MT",
+    "-MQ",
+    "-o",
+    "-I",
+    "-L",
+    "-l",
+    "-D",
+    "-U",
+    "-x",
+)
+# the options that are only followed by a separated value
+SEPARATED_OPTIONS = ("-Xassembler", "-Xpreprocessor", "-target")
+# the linker options (in "-Wl,") that take the next linker argument as value
+LINKER_VALUE_OPTIONS = ("-rpath", "-rpath-link", "-soname", "-T", "-Map", "--version-script", "-z")
+# the options that can appear many times, all their values are kept
+MULTI_OPTIONS = ("-isystem", "-iquote", "-idirafter", "-include", "-imacros", "-I", "-L", "-l")
+
+SOURCE_PATTERN = re.compile(r".*\.(c|cc|cpp|cxx|c\+\+|C|s|S|m|mm)$")
+# e.g. "gcc", "x86_64-linux-gnu-g++-12", "clang"
+COMPILER_NAME = r"(?:[\w.-]+-)?(?:gcc|g\+\+|cc|c\+\+|clang|clang\+\+)(?:-[\d.]+)?"
+COMPILER_PATTERN = re.compile(COMPILER_NAME)
+COMPILER_IN_LINE_PATTERN = re.compile(rf"(?:^|[\s/]){COMPILER_NAME}\s")
+
+SHELL_OPERATORS = (";", "&&", "||", "|", ">", "2>&1")
+
+# e.g. /home/user/.cache/bazel/_bazel_user/<hash>/sandbox/processwrapper-sandbox/25/execroot/_main
+SANDBOX_PATTERN = re.compile(
+    r"(?:/[^\s,:=']*)?/(?:sandbox/[\w-]+/\d+/)?execroot/[^/\s,:=']+|/[^\s,:=']*/_bazel_[^/]+/[0-9a-f]{32}"
+)
 
 
 def run():
@@ -6,9 +64,6 @@ def run():
 
     command_native = "gcc -Wall -Wmissing-prototypes -Wpointer-arith -Wdeclaration-after-statement -Werror=vla -Wendif-labels -Wmissing-format-attribute -Wimplicit-fallthrough=3 -Wcast-function-type -Wshadow=compatible-local -Wformat-security -fno-strict-aliasing -fwrapv -fexcess-precision=standard -Wno-format-truncation -Wno-stringop-truncation -O2 pg_recvlogical.o  receivelog.o streamutil.o walmethods.o -L../../../src/port -L../../../src/common -L../../../src/fe_utils -lpgfeutils -L../../../src/interfaces/libpq -lpq   -Wl,--as-needed -Wl,-rpath,'/usr/local/pgsql/lib',--enable-new-dtags  -lpgcommon -lpgport -lm  -o pg_recvlogical"
 
-    bazel_args = command_bazel.split()
-    native_args = command_native.split()
-
     args_1, output_files_1 = dismentle_command(command_bazel)
     args_2, output_files_2 = dismentle_command(command_native)
 
@@ -41,11 +96,8 @@ def compare(group1: list[str], group1_name: str, group2: list[str], group2_name:
 
 # return tuple(args, output_files)
 def dismentle_command(command: str) -> tuple[list[str], list[str]]:
-    args = command.split()
-    args = set(args)
-
     # remove entry "gcc"
-    args.remove("gcc")
+    args = set(normalize(split_command(command)[1:]))
 
     output_files = set()
     for arg in args:
@@ -63,5 +115,467 @@ def dismentle_command(command: str) -> tuple[list[str], list[str]]:
     return args, output_files
 
 
+# a word of a POSIX command line and the quoted parts of a word, as shlex
+# splits them (the whitespace is " \t\r\n", no comments)
+WORD_PATTERN = re.compile(r"""(?:[^ \t\r\n'"\\]+|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)+""", re.DOTALL)
+WORD_PART_PATTERN = re.compile(r"""[^'"\\]+|'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)""", re.DOTALL)
+# str.split() splits the same, unless there are quotes or other whitespace
+UNQUOTED_UNSAFE_PATTERN = re.compile(r"""['"\\]|[^\x20-\x7e\t\r\n]""")
+# in double quotes, only a quote or a backslash is escaped
+QUOTED_ESCAPE_PATTERN = re.compile(r'\\(["\\])')
+
+
+def unquote_word(word: str) -> str:
+    if "'" not in word and '"' not in word and "\\" not in word:
+        return word
+    parts = list()
+    for match in WORD_PART_PATTERN.finditer(word):
+        single, double, escaped = match.groups()
+        if single is not None:
+            parts.append(single)
+        elif double is not None:
+            parts.append(QUOTED_ESCAPE_PATTERN.sub(r"\1", double))
+        elif escaped is not None:
+            parts.append(escaped)
+        else:
+            parts.append(match.group())
+    return "".join(parts)
+
+
+def split_command(command: str) -> list[str]:
+    """
+    Split a command line as a POSIX shell does, with the same result as
+    shlex.split (which is used for the malformed ones, to raise the same
+    errors) at a fraction of its cost.
+    """
+    if not UNQUOTED_UNSAFE_PATTERN.search(command):
+        return command.split()
+    words = list()
+    pos = 0
+    for match in WORD_PATTERN.finditer(command):
+        if command[pos : match.start()].strip(" \t\r\n"):
+            # e.g. an unclosed quote
+            return shlex.split(command)
+        words.append(unquote_word(match.group()))
+        pos = match.end()
+    if command[pos:].strip(" \t\r\n"):
+        return shlex.split(command)
+    return words
+
+
+class TokenCache:
+    """
+    The tokenized command lines, keyed by the hash of the command, kept in a
+    pickle file between the runs (shlex is the slowest part of a diff).
+    """
+
+    def __init__(self, path: Optional[str] = TOKEN_CACHE_PATH):
+        self.path = path
+        self.tokens = dict()
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    self.tokens = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self.tokens = dict()
+
+    def split(self, command: str) -> tuple[str, ...]:
+        key = hashlib.blake2b(command.encode("utf-8", "surrogateescape"), digest_size=16).digest()
+        tokens = self.tokens.get(key)
+        if tokens is None:
+            # identical tokens are shared by the commands, and by the pickle
+            tokens = tuple(sys.intern(token) for token in split_command(command))
+            self.tokens[key] = tokens
+            self.dirty = True
+        return tokens
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}"
+        with open(temp_path, "wb") as f:
+            pickle.dump(self.tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+
+def canonicalize_path(value: str, prefixes: tuple[str, ...] = ()) -> str:
+    """
+    Replace the Bazel sandbox/execroot part of the paths in the value with
+    "<execroot>", and the given prefixes (e.g. the native build directory)
+    with "<root>".
+    """
+    if "execroot" in value or "_bazel_" in value:
+        value = SANDBOX_PATTERN.sub("<execroot>", value)
+    for prefix in prefixes:
+        if prefix in value:
+            value = value.replace(prefix, "<root>")
+    return value
+
+
+def normalize(args, prefixes: tuple[str, ...] = ()) -> list[str]:
+    """
+    Return the arguments (without the compiler) in a canonical form, see
+    Normalizer.
+    """
+    return Normalizer(prefixes).normalize(args)
+
+
+class Normalizer:
+    """
+    Put the arguments of the commands in a canonical form:
+    - an option and its value are one argument, "-o x" and "-ox" are "-o x",
+      "--sysroot=x" is "--sysroot x"
+    - "-Wl,a,b" and "-Xlinker a -Xlinker b" are "-Wl,a" and "-Wl,b", a linker
+      option and its value stay together ("-Wl,-rpath,x")
+    - the sandbox paths are canonicalized, see canonicalize_path()
+
+    Most arguments are repeated in every command, the result of each distinct
+    argument is kept.
+    """
+
+    def __init__(self, prefixes: tuple[str, ...] = ()):
+        self.prefixes = prefixes
+        # arg -> tuple(option waiting for the next arg as value, normalized arg)
+        self.known = dict()
+
+    def canonicalize(self, value: str) -> str:
+        return canonicalize_path(value, self.prefixes)
+
+    def classify(self, arg: str) -> tuple[Optional[str], Optional[str]]:
+        if arg.startswith("-Wl,") or arg == "-Xlinker":
+            return "-Wl,", None
+        if arg in SEPARATED_OPTIONS:
+            return arg, None
+        for option in VALUE_OPTIONS:
+            if arg.startswith(option):
+                if arg == option:
+                    return option, None
+                if option.startswith("--"):
+                    if arg[len(option)] != "=":
+                        continue
+                    value = arg[len(option) + 1 :]
+                else:
+                    value = arg[len(option) :]
+                return None, f"{option} {self.canonicalize(value)}"
+        return None, self.canonicalize(arg)
+
+    def normalize(self, args) -> list[str]:
+        result = list()
+        # a linker option waiting for its value, which may be in the next "-Wl,"
+        linker_option = None
+        known = self.known
+        args = iter(args)
+        for arg in args:
+            classified = known.get(arg)
+            if classified is None:
+                classified = known[arg] = self.classify(arg)
+            option, normalized = classified
+            if option == "-Wl,":
+                linker_args = arg[4:].split(",") if arg != "-Xlinker" else [next(args, "")]
+                for linker_arg in linker_args:
+                    linker_arg = self.canonicalize(linker_arg)
+                    if linker_option is not None:
+                        linker_arg = f"{linker_option},{linker_arg}"
+                        linker_option = None
+                    elif linker_arg in LINKER_VALUE_OPTIONS:
+                        linker_option = linker_arg
+                        continue
+                    result.append("-Wl," + linker_arg)
+                continue
+            if linker_option is not None:
+                result.append("-Wl," + linker_option)
+                linker_option = None
+
+            if option is not None:
+                result.append(f"{option} {self.canonicalize(next(args, ''))}")
+            else:
+                result.append(normalized)
+        if linker_option is not None:
+            result.append("-Wl," + linker_option)
+        return result
+
+
+def option_name(arg: str) -> Optional[str]:
+    """
+    Return the name of an option that takes one value (so a different value is
+    a change, not an addition), None for the other arguments.
+    """
+    if not arg.startswith("-"):
+        return None
+    option, _, value = arg.partition(" ")
+    if value:
+        if option in MULTI_OPTIONS:
+            return None
+        if option in ("-D", "-U"):
+            # the same macro
+            return "-D " + value.partition("=")[0]
+        return option
+    if arg.startswith("-Wl,"):
+        linker_option, _, linker_value = arg[4:].partition(",")
+        return "-Wl," + linker_option if linker_value and linker_option != "-z" else None
+    if arg.startswith("-O"):
+        return "-O"
+    if "=" in arg and not arg.startswith("-W"):
+        # e.g. "-std=c11", "-march=native"
+        return arg.partition("=")[0]
+    return None
+
+
+class Command:
+    """
+    A compiler invocation, normalized for diffing.
+    """
+
+    __slots__ = ("key", "compiler", "args")
+
+    def __init__(self, tokens, normalizer: Normalizer, file: Optional[str] = None):
+        self.compiler = os.path.basename(tokens[0]) if tokens else ""
+        self.args = normalizer.normalize(tokens[1:])
+
+        # the source file of a compile command, or the output of a link command
+        if file is None:
+            output = None
+            for arg in self.args:
+                if arg.startswith("-o "):
+                    output = arg[3:]
+                elif not arg.startswith("-") and SOURCE_PATTERN.match(arg):
+                    file = arg
+                    break
+            file = file if file is not None else output
+        else:
+            file = normalizer.canonicalize(file)
+        self.key = file or ""
+
+
+def load_compile_commands(
+    path: str, cache: TokenCache, normalizer: Normalizer
+) -> Iterator[Command]:
+    with open(path, "r") as f:
+        entries = json.load(f)
+    for entry in entries:
+        if "arguments" in entry:
+            tokens = entry["arguments"]
+        else:
+            tokens = cache.split(entry["command"])
+        yield Command(tokens, normalizer, entry.get("file"))
+
+
+def iter_log_commands(f) -> Iterator[str]:
+    """
+    Yield the lines of a build log, with the continued lines (ending with a
+    backslash) joined, and the subshell parentheses of the Bazel subcommands
+    ("(cd ... && exec env - ... gcc ...)") removed.
+    """
+    parts = list()
+    for line in f:
+        line = line.rstrip("\n")
+        if line.endswith("\\"):
+            parts.append(line[:-1])
+            continue
+        parts.append(line)
+        command = " ".join(parts).strip()
+        parts.clear()
+        if command.startswith("(") and command.endswith(")"):
+            command = command[1:-1]
+        yield command
+    if parts:
+        yield " ".join(parts)
+
+
+def load_build_log(path: str, cache: TokenCache, normalizer: Normalizer) -> Iterator[Command]:
+    """
+    Yield the compiler invocations in a build log (e.g. "make V=1" or
+    "bazel build --subcommands"), a command starts at the compiler and ends
+    at the end of the line or at a shell operator.
+    """
+    with open(path, "r", errors="surrogateescape") as f:
+        for line in iter_log_commands(f):
+            if not COMPILER_IN_LINE_PATTERN.search(line + "\n"):
+                continue
+            try:
+                tokens = cache.split(line)
+            except ValueError:
+                # e.g. an unclosed quote
+                continue
+            for i, token in enumerate(tokens):
+                if COMPILER_PATTERN.fullmatch(os.path.basename(token)):
+                    end = i + 1
+                    while end < len(tokens) and tokens[end] not in SHELL_OPERATORS:
+                        end += 1
+                    yield Command(tokens[i:end], normalizer)
+                    break
+
+
+def load_commands(
+    path: str, cache: TokenCache, normalizer: Normalizer
+) -> dict[str, list[Command]]:
+    """
+    Load a compile_commands.json or a build log, return the commands by key.
+    """
+    with open(path, "rb") as f:
+        is_json = f.read(64).lstrip().startswith(b"[")
+    loader = load_compile_commands if is_json else load_build_log
+    commands = dict()
+    for command in loader(path, cache, normalizer):
+        commands.setdefault(command.key, list()).append(command)
+    return commands
+
+
+def match_commands(
+    commands_a: dict[str, list[Command]], commands_b: dict[str, list[Command]]
+) -> tuple[list[tuple[str, Command, Command]], list[str], list[str]]:
+    """
+    Pair the commands by key, then the remaining ones by the base name of the
+    key if it's unique on both sides (e.g. "bazel-out/k8-fastbuild/bin/x.o"
+    and "x.o"). The commands of the same key are paired in order.
+
+    Return tuple(pairs, keys only in a, keys only in b).
+    """
+    pairs = list()
+    only_a = [key for key in commands_a if key not in commands_b]
+    only_b = [key for key in commands_b if key not in commands_a]
+    for key, list_a in commands_a.items():
+        for command_a, command_b in zip(list_a, commands_b.get(key, ())):
+            pairs.append((key, command_a, command_b))
+
+    by_name_a = collections.defaultdict(list)
+    by_name_b = collections.defaultdict(list)
+    for key in only_a:
+        by_name_a[os.path.basename(key)].append(key)
+    for key in only_b:
+        by_name_b[os.path.basename(key)].append(key)
+    matched = set()
+    for name, keys_a in by_name_a.items():
+        keys_b = by_name_b.get(name, ())
+        if len(keys_a) == 1 and len(keys_b) == 1:
+            key_a, key_b = keys_a[0], keys_b[0]
+            pairs.append((key_a, commands_a[key_a][0], commands_b[key_b][0]))
+            matched.update((key_a, key_b))
+
+    only_a = [key for key in only_a if key not in matched]
+    only_b = [key for key in only_b if key not in matched]
+    return pairs, only_a, only_b
+
+
+def diff_args(args_a: list[str], args_b: list[str]) -> tuple[list[str], list[str], list[tuple[str, str]]]:
+    """
+    Return tuple(removed, added, changed) from args_a to args_b, an option
+    with one value in both (e.g. "-O2" and "-O0") is changed, not removed and
+    added.
+    """
+    set_a = set(args_a)
+    set_b = set(args_b)
+    removed = [arg for arg in args_a if arg not in set_b]
+    added = [arg for arg in args_b if arg not in set_a]
+
+    removed_by_name = collections.defaultdict(list)
+    for arg in removed:
+        name = option_name(arg)
+        if name:
+            removed_by_name[name].append(arg)
+    added_by_name = collections.defaultdict(list)
+    for arg in added:
+        name = option_name(arg)
+        if name:
+            added_by_name[name].append(arg)
+
+    changed = list()
+    for name, old in removed_by_name.items():
+        new = added_by_name.get(name)
+        if len(old) == 1 and new and len(new) == 1:
+            changed.append((old[0], new[0]))
+    changed_args = {arg for pair in changed for arg in pair}
+    removed = [arg for arg in removed if arg not in changed_args]
+    added = [arg for arg in added if arg not in changed_args]
+    return removed, added, changed
+
+
+def diff(
+    path_a: str,
+    path_b: str,
+    prefixes: tuple[str, ...] = (),
+    use_cache: bool = True,
+    top: int = 20,
+):
+    """
+    Diff the commands of two compile_commands.json or build logs, print the
+    added, removed and changed flags of every file, then the most common
+    differences.
+    """
+    cache = TokenCache(TOKEN_CACHE_PATH if use_cache else None)
+    normalizer = Normalizer(prefixes)
+    commands_a = load_commands(path_a, cache, normalizer)
+    commands_b = load_commands(path_b, cache, normalizer)
+    cache.save()
+
+    pairs, only_a, only_b = match_commands(commands_a, commands_b)
+    pairs.sort(key=lambda pair: pair[0])
+    counter = collections.Counter()
+    different = 0
+    for key, command_a, command_b in pairs:
+        removed, added, changed = diff_args(command_a.args, command_b.args)
+        if command_a.compiler != command_b.compiler:
+            changed.insert(0, (command_a.compiler, command_b.compiler))
+        if not (removed or added or changed):
+            continue
+        different += 1
+        print(f"{key}:")
+        for old, new in changed:
+            print(f"\tchanged: {old} -> {new}")
+            counter[f"changed: {old} -> {new}"] += 1
+        for arg in removed:
+            print(f"\t- {arg}")
+            counter[f"- {arg}"] += 1
+        for arg in added:
+            print(f"\t+ {arg}")
+            counter[f"+ {arg}"] += 1
+
+    for key in sorted(only_a):
+        print(f"only in ({path_a}): {key}")
+    for key in sorted(only_b):
+        print(f"only in ({path_b}): {key}")
+
+    print(
+        f"{len(pairs)} commands compared, {different} differ,"
+        f" {len(only_a)} only in ({path_a}), {len(only_b)} only in ({path_b})"
+    )
+    if counter:
+        print("most common differences:")
+        for difference, count in counter.most_common(top):
+            print(f"\t{count}\t{difference}")
+
+
 if __name__ == "__main__":
-    run()
+    # Usage: ./analyze_gcc_command.py
+    #        ./analyze_gcc_command.py diff A B [--strip-prefix PREFIX]... [--no-cache] [--top N]
+    #
+    # Without arguments, compare the two commands in run(). "diff" compares
+    # two compile_commands.json or build logs (e.g. Bazel vs native), the
+    # commands are paired by source file (or output for link commands).
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="subcommand")
+    parser_diff = subparsers.add_parser("diff", help="diff two compile databases or build logs")
+    parser_diff.add_argument("a")
+    parser_diff.add_argument("b")
+    parser_diff.add_argument(
+        "--strip-prefix",
+        action="append",
+        default=[],
+        help='a path prefix (e.g. the native build directory) replaced with "<root>"',
+    )
+    parser_diff.add_argument(
+        "--no-cache", action="store_true", help="don't read or write the tokenized commands cache"
+    )
+    parser_diff.add_argument(
+        "--top", type=int, default=20, help="the number of most common differences to print"
+    )
+    args = parser.parse_args()
+
+    if args.subcommand == "diff":
+        diff(args.a, args.b, tuple(args.strip_prefix), not args.no_cache, args.top)
+    else:
+        run()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Diff two synthetic compile_commands.json (Bazel vs native, "command" strings
+# with quoted arguments) with analyze_gcc_command.diff, with a cold and a warm
+# tokenized commands cache. Also check that split_command() tokenizes as
+# shlex.split does, on random command lines.
+#
+# Usage: ./bench_analyze_gcc_command.py [commands]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shlex
+import tempfile
+import time
+
+import analyze_gcc_command
+
+
+SANDBOX = "/home/user/.cache/bazel/_bazel_user/def8392de60694faa9c9ea704dc32257/sandbox/processwrapper-sandbox/25/execroot/_main"
+
+
+def generate(path: str, commands: int, bazel: bool):
+    random.seed(0)
+    entries = []
+    for i in range(commands):
+        file = f"src/module_{i % 500}/file_{i}.c"
+        flags = [f"-Iinclude/dep_{j}" for j in range(40)] + [
+            "-Wall",
+            "-DVERSION='\"1.0\"'",
+            "-Wl,-rpath,'/usr/local/lib'",
+        ]
+        if bazel:
+            flags += ["-O0", f"-I{SANDBOX}/bazel-out/k8-dbg/bin/include", "-fvisibility=hidden"]
+            output = f"-o bazel-out/k8-dbg/bin/src/_objs/file_{i}.o"
+        else:
+            flags += ["-O2", "-I/home/user/native/build/include"]
+            output = f"-o src/module_{i % 500}/file_{i}.o"
+        if i % 100 == 0:
+            flags.append(f"-DCASE_{i}")
+        entries.append(
+            {
+                "directory": SANDBOX if bazel else "/home/user/native",
+                "command": f"gcc {' '.join(flags)} -c {file} {output}",
+                "file": file,
+            }
+        )
+    with open(path, "w") as f:
+        json.dump(entries, f, indent=2)
+
+
+def bench(path_a: str, path_b: str) -> tuple[float, str]:
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        analyze_gcc_command.diff(path_a, path_b, ("/home/user/native/build",))
+    return time.perf_counter() - start, output.getvalue()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "commands", nargs="?", type=int, default=100_000, help="random commands to split"
+    )
+    commands = parser.parse_args().commands
+
+    random.seed(0)
+    alphabet = ["a", "-", "=", " ", "\t", "\n", "\x0b", "\\", '"', "'", "$", "#", "é"]
+    for _ in range(100_000):
+        command = "".join(random.choices(alphabet, k=random.randrange(1, 16)))
+        try:
+            expected = shlex.split(command)
+        except ValueError as e:
+            expected = e.args
+        try:
+            actual = analyze_gcc_command.split_command(command)
+        except ValueError as e:
+            actual = e.args
+        if actual != expected:
+            raise RuntimeError(f"split_command differs from shlex.split: {command!r}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["XDG_CACHE_HOME"] = tmp
+        analyze_gcc_command.TOKEN_CACHE_PATH = os.path.join(tmp, "tokens.pickle")
+        path_a = os.path.join(tmp, "bazel.json")
+        path_b = os.path.join(tmp, "native.json")
+        generate(path_a, commands, True)
+        generate(path_b, commands, False)
+        print(f"commands: {commands} on each side")
+
+        cold, report = bench(path_a, path_b)
+        print(f"  cold cache: {cold:.3f}s")
+        warm, warm_report = bench(path_a, path_b)
+        print(f"  warm cache: {warm:.3f}s")
+        if report != warm_report:
+            raise RuntimeError("the reports differ")
+        lines = report.splitlines()
+        summary = next(i for i, line in enumerate(lines) if " commands compared, " in line)
+        print("\n".join(lines[summary : summary + 6]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Compare "the latest N records of a config" read from the JSON reports
+# (every report loaded with json_loader, like the comparison scripts did)
+# with BenchmarkStore, check that both return the same records, and time the
+# import of the reports and the appends.
+#
+# Usage: ./bench_benchmark_store.py [reports] [records per report]
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import xiaochen_py
+
+
+def generate(reports: int, per_report: int, report_dir: str):
+    random.seed(0)
+    for i in range(reports):
+        records = []
+        for j in range(per_report):
+            record = xiaochen_py.BenchmarkRecord(
+                target_attributes={"database": ["postgres", "cockroach"][j % 2], "threads": j // 2},
+                test_result={"tps": random.gauss(1000, 50), "latency_ms": random.gauss(5, 1)},
+            )
+            # one run every hour
+            month, day, hour = 1 + i // 672, 1 + i // 24 % 28, i % 24
+            record.record_time = f"2024-{month:02d}-{day:02d}T{hour:02d}:00:00.{j:06d}"
+            records.append(record)
+        path = os.path.join(report_dir, f"benchmark_2024{month:02d}{day:02d}_{hour:02d}0000.json")
+        with open(path, "w") as f:
+            json.dump(records, f, default=lambda x: x.__dict__, indent=4)
+
+
+def latest_from_reports(report_dir: str, target_attributes: dict, n: int) -> list:
+    records = []
+    for name in os.listdir(report_dir):
+        if not xiaochen_py.REPORT_NAME_PATTERN.fullmatch(name):
+            continue
+        with open(os.path.join(report_dir, name)) as f:
+            records += json.load(f, object_hook=lambda x: xiaochen_py.json_loader(**x))
+    records = [r for r in records if r.target_attributes == target_attributes]
+    records.sort(key=lambda r: r.record_time, reverse=True)
+    return records[:n]
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reports", nargs="?", type=int, default=2000)
+    parser.add_argument("per_report", nargs="?", type=int, default=20, help="records per report")
+    args = parser.parse_args()
+    reports = args.reports
+    per_report = args.per_report
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate(reports, per_report, tmp)
+        config = {"threads": 3, "database": "cockroach"}
+        print(f"{reports} reports, {reports * per_report} records")
+
+        start = time.perf_counter()
+        expected = latest_from_reports(tmp, config, 10)
+        print(f"  latest 10 from the reports: {time.perf_counter() - start:.3f}s")
+
+        store_path = os.path.join(tmp, xiaochen_py.BENCHMARK_STORE_NAME)
+        with xiaochen_py.BenchmarkStore(store_path) as store:
+            start = time.perf_counter()
+            store.import_reports(tmp)
+            print(f"  import: {time.perf_counter() - start:.3f}s")
+            assert store.import_reports(tmp) == 0
+
+        start = time.perf_counter()
+        with xiaochen_py.BenchmarkStore(store_path) as store:
+            actual = store.latest(config, 10)
+        print(f"  latest 10 from the store (open included): {time.perf_counter() - start:.4f}s")
+        if [r.__dict__ for r in actual] != [r.__dict__ for r in expected]:
+            raise RuntimeError("the latest records differ")
+
+        with xiaochen_py.BenchmarkStore(store_path) as store:
+            start = time.perf_counter()
+            found = store.find({"database": "cockroach"}, since="2024-01-02", limit=100)
+            print(f"  find by one attribute: {time.perf_counter() - start:.4f}s")
+            # the first day has 24 reports, every report has per_report // 2
+            # cockroach records
+            matches = max(0, reports - 24) * (per_report // 2)
+            assert len(found) == min(100, matches)
+            assert all(r.target_attributes["database"] == "cockroach" for r in found)
+            times = [r.record_time for r in found]
+            assert times == sorted(times, reverse=True) and all(t >= "2024-01-02" for t in times)
+            assert len(store.configs()) == (per_report if reports else 0)
+
+            start = time.perf_counter()
+            for _ in range(100):
+                record = xiaochen_py.BenchmarkRecord(
+                    target_attributes=config, test_result={"tps": 1}
+                )
+                store.append([record])
+            print(f"  append: {(time.perf_counter() - start) / 100 * 1000:.2f}ms per run")
+            assert store.latest(config)[0].test_result == {"tps": 1}
+    print("results are identical")
+
+
+if __name__ == "__main__":
+    run()
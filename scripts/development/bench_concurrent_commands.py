@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Run hundreds of commands at the same time from a thread pool, every one in
+# its own working directory with its own environment, some of them as dry
+# runs (with xiaochen_py.execution) and some failing, then the same with
+# asyncio tasks and background jobs. Check that every command ran where it
+# was asked to, that the dry runs didn't leak to the other threads, and that
+# the process-wide working directory never changed.
+#
+# It exits with an error on the first command that ran in the wrong context.
+#
+# Usage: ./bench_concurrent_commands.py [commands] [threads]
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import xiaochen_py
+
+COMMAND = 'pwd -P; echo "$XC_INDEX"; cat name'
+
+
+def expected_output(directory: str, i: int) -> bytes:
+    return f"{directory}\n{i}\n{i}\n".encode()
+
+
+def run_one(directories: list, i: int) -> str:
+    """
+    Run command `i` in one of the ways a script can choose the working
+    directory, return the way.
+    """
+    directory = directories[i]
+    env = {"XC_INDEX": str(i)}
+    quiet = dict(stream_output=False, slient=True)
+    mode = ["work_dir", "execution", "dry_run", "failure"][i % 4]
+
+    if mode == "work_dir":
+        result = xiaochen_py.run_command(COMMAND, work_dir=directory, env=env, **quiet)
+    elif mode == "execution":
+        # relative to the cwd of the block
+        with xiaochen_py.execution(cwd=os.path.dirname(directory), env=env):
+            result = xiaochen_py.run_command(COMMAND, work_dir=os.path.basename(directory), **quiet)
+    elif mode == "dry_run":
+        with xiaochen_py.execution(dry_run=True):
+            result = xiaochen_py.run_command("exit 1", work_dir=directory, **quiet)
+        if result.output != b"" or result.returncode != 0:
+            raise RuntimeError(f"dry run {i} ran: {result}")
+        return mode
+    else:
+        try:
+            xiaochen_py.run_command(COMMAND + "; exit 3", work_dir=directory, env=env, **quiet)
+        except subprocess.CalledProcessError as e:
+            result = xiaochen_py.CommandResult(COMMAND, e.output, e.returncode, 0.0)
+        else:
+            raise RuntimeError(f"command {i} didn't fail")
+
+    if result.output != expected_output(directory, i):
+        raise RuntimeError(f"command {i} ran in the wrong context: {result.output!r}")
+    return mode
+
+
+async def run_async(directories: list) -> int:
+    async def run_one_async(i: int):
+        # every task has its own copy of the context
+        with xiaochen_py.execution(cwd=directories[i], env={"XC_INDEX": str(i)}):
+            output, _ = await xiaochen_py.run_command_async(
+                COMMAND, stream_output=False, slient=True
+            )
+        if output != expected_output(directories[i], i):
+            raise RuntimeError(f"task {i} ran in the wrong context: {output!r}")
+
+    await asyncio.gather(*[run_one_async(i) for i in range(len(directories))])
+    return len(directories)
+
+
+def run_jobs(directories: list, tmp: str) -> int:
+    jobs = []
+    for i, directory in enumerate(directories):
+        log_path = os.path.join(tmp, f"job_{i}.log")
+        job = xiaochen_py.run_background(
+            COMMAND, log_path=log_path, work_dir=directory, env={"XC_INDEX": str(i)}
+        )
+        jobs.append((i, job, log_path))
+    for i, job, log_path in jobs:
+        job.wait()
+        with open(log_path, "rb") as f:
+            if f.read() != expected_output(directories[i], i):
+                raise RuntimeError(f"job {i} ran in the wrong context")
+    return len(jobs)
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("commands", nargs="?", type=int, default=400)
+    parser.add_argument("threads", nargs="?", type=int, default=32)
+    args = parser.parse_args()
+    count = args.commands
+    threads = args.threads
+
+    # the failures are expected, don't log them
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = os.path.realpath(tmp)
+        directories = []
+        for i in range(count):
+            directory = os.path.join(tmp, f"dir_{i}")
+            os.mkdir(directory)
+            with open(os.path.join(directory, "name"), "w") as f:
+                f.write(f"{i}\n")
+            directories.append(directory)
+
+        start_time = time.perf_counter()
+        modes = dict()
+        # the dry runs print the commands
+        with contextlib.redirect_stdout(io.StringIO()), concurrent.futures.ThreadPoolExecutor(
+            threads
+        ) as executor:
+            for mode in executor.map(lambda i: run_one(directories, i), range(count)):
+                modes[mode] = modes.get(mode, 0) + 1
+        duration = time.perf_counter() - start_time
+        print(f"threads: {threads}, commands: {count} {modes}")
+        print(f"  {duration:.2f}s, {count / duration:.0f} commands/s")
+
+        start_time = time.perf_counter()
+        tasks = asyncio.run(run_async(directories))
+        duration = time.perf_counter() - start_time
+        print(f"asyncio tasks: {tasks}, {duration:.2f}s")
+
+        start_time = time.perf_counter()
+        # run_background always prints the command
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs = run_jobs(directories[: count // 4], tmp)
+        duration = time.perf_counter() - start_time
+        print(f"background jobs: {jobs}, {duration:.2f}s")
+
+    if os.getcwd() != original_dir:
+        raise RuntimeError(f"the working directory changed to {os.getcwd()}")
+    if xiaochen_py.current_execution().dry_run:
+        raise RuntimeError("the dry run leaked out of its context")
+    print("all the commands ran in their own context")
+
+
+if __name__ == "__main__":
+    run()
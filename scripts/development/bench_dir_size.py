@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Compare get_dir_size with the os.walk + os.path.getsize implementation on a
+# generated tree (with hard links and a sparse file), check the apparent and
+# allocated sizes against a reference, and time an incremental snapshot
+# after a few directories changed.
+#
+# Usage: ./bench_dir_size.py [directories] [files per directory]
+
+import argparse
+import os
+import tempfile
+import time
+
+import xiaochen_py
+
+
+def walk_size(path: str) -> int:
+    total_size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            total_size += os.path.getsize(os.path.join(dirpath, f))
+    return total_size
+
+
+def reference_size(path: str) -> tuple[int, int]:
+    """
+    Return the apparent and the allocated size, hard links counted once.
+    """
+    seen = set()
+    size = blocks = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            st = os.lstat(os.path.join(dirpath, f))
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            size += st.st_size
+            blocks += st.st_blocks
+    return size, blocks * 512
+
+
+def generate(root: str, directories: int, files: int):
+    for i in range(directories):
+        # 3 levels, like base/<db oid>/<relation>
+        path = os.path.join(root, f"db_{i % 7}", f"table_{i % 31}", f"segment_{i}")
+        os.makedirs(path)
+        for j in range(files):
+            with open(os.path.join(path, f"{j}"), "wb") as f:
+                f.write(b"x" * (j * 37 % 5000))
+    # hard links (counted once) and a sparse file
+    first = os.path.join(root, "db_0", "table_0", "segment_0")
+    for j in range(files):
+        os.link(os.path.join(first, f"{j}"), os.path.join(root, f"link_{j}"))
+    with open(os.path.join(root, "sparse"), "wb") as f:
+        f.truncate(64 * 1024 * 1024)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directories", nargs="?", type=int, default=2000)
+    parser.add_argument("files", nargs="?", type=int, default=50, help="files per directory")
+    args = parser.parse_args()
+    directories = args.directories
+    files = args.files
+
+    with tempfile.TemporaryDirectory() as root:
+        generate(root, directories, files)
+        print(f"{directories} directories, {directories * files} files")
+        size, allocated = reference_size(root)
+
+        walked, duration = timed(walk_size, root)
+        print(f"  os.walk + getsize: {duration:.3f}s")
+        # the hard links are counted once now
+        assert walked == size + sum(j * 37 % 5000 for j in range(files))
+
+        for jobs in [1, 8]:
+            actual, duration = timed(xiaochen_py.get_dir_size, root, jobs=jobs)
+            print(f"  get_dir_size (jobs {jobs}): {duration:.3f}s")
+            assert actual == size, (actual, size)
+        assert xiaochen_py.get_dir_size(root, allocated=True) == allocated
+
+        # old enough for the mtime to be trusted
+        snapshot, duration = timed(xiaochen_py.snapshot_dir, root)
+        time.sleep(xiaochen_py.RACY_MTIME_NS / 1e9)
+        snapshot = xiaochen_py.snapshot_dir(root)
+        for i in range(0, directories, 100):
+            path = os.path.join(root, f"db_{i % 7}", f"table_{i % 31}", f"segment_{i}")
+            with open(os.path.join(path, "new"), "wb") as f:
+                f.write(b"y" * 1000)
+            os.unlink(os.path.join(path, "1"))
+        incremental, duration = timed(xiaochen_py.snapshot_dir, root, snapshot)
+        print(f"  incremental snapshot ({len(range(0, directories, 100))} changed): {duration:.3f}s")
+        full = xiaochen_py.snapshot_dir(root)
+        assert (incremental.size, incremental.allocated) == (full.size, full.allocated)
+        assert incremental.size == reference_size(root)[0]
+        changes = incremental.delta(snapshot)
+        assert len(changes) == len(range(0, directories, 100))
+        assert all(change == 1000 - 37 for change in changes.values()), changes
+    print("sizes are identical")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Measure the per-invocation overhead of run_command for a short command,
+# through /bin/sh and run directly (no shell), and with capture_tty through
+# the native pty and through "script" (what capture_tty used to run). Check
+# first that both paths produce the same output and exit codes, and that the
+# pty capture works for commands with single quotes and in both tee modes.
+#
+# Usage: ./bench_exec_overhead.py [invocations]
+
+import argparse
+import logging
+import shutil
+import subprocess
+import sys
+import time
+
+import xiaochen_py
+
+QUIET = dict(stream_output=False, slient=True)
+
+
+def check():
+    for command in [
+        "true",
+        "ls -d /",
+        "printf '%s|%s\\n' 'a b' c",
+        "echo hi",
+        "cat /proc/self/comm",
+        f"{sys.executable} -c 'import sys; sys.exit(3)'",
+        "no_such_program_xc arg",
+    ]:
+        results = []
+        for shell in [True, None]:
+            try:
+                result = xiaochen_py.run_command(command, shell=shell, **QUIET)
+                results.append((result.output, result.returncode))
+            except subprocess.CalledProcessError as e:
+                results.append((e.output, e.returncode))
+        # the program itself runs instead of "sh"
+        if command.startswith("cat /proc"):
+            results = [(output.replace(b"sh\n", b"cat\n"), code) for output, code in results]
+        if results[0] != results[1]:
+            raise RuntimeError(f"different results of {command!r}: {results}")
+
+    result = xiaochen_py.run_command(["printf", "%s\\n", "it's", "a b"], **QUIET)
+    if result.output != b"it's\na b\n" or result.command != "printf '%s\\n' 'it'\"'\"'s' 'a b'":
+        raise RuntimeError(f"wrong result of an argv: {result.output!r} {result.command!r}")
+
+    tty_check = f"{sys.executable} -c 'import sys; print(sys.stdout.isatty(), sys.stderr.isatty())'"
+    for tee_mode in ["line", "chunk"]:
+        result = xiaochen_py.run_command(tty_check, capture_tty=True, tee_mode=tee_mode, **QUIET)
+        if result.output != b"True True\r\n":
+            raise RuntimeError(f"not a tty ({tee_mode}): {result.output!r}")
+        result = xiaochen_py.run_command(
+            "echo 'it'\"'\"'s'; seq 1 100000 | tail -n 1",
+            capture_tty=True,
+            tee_mode=tee_mode,
+            **QUIET,
+        )
+        if result.output != b"it's\r\n100000\r\n":
+            raise RuntimeError(f"wrong tty output ({tee_mode}): {result.output!r}")
+    result = xiaochen_py.run_command(
+        tty_check, capture_tty=True, include_stderr=False, **QUIET
+    )
+    if result.output != b"True False\r\n":
+        raise RuntimeError(f"stderr should not be a tty: {result.output!r}")
+
+
+def measure(count: int, command, **kwargs) -> float:
+    """
+    Return the mean milliseconds of one run_command.
+    """
+    start_time = time.perf_counter()
+    for _ in range(count):
+        xiaochen_py.run_command(command, **QUIET, **kwargs)
+    return (time.perf_counter() - start_time) / count * 1000
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("invocations", nargs="?", type=int, default=300)
+    count = parser.parse_args().invocations
+
+    # the failures are expected, don't log them
+    logging.getLogger().setLevel(logging.CRITICAL)
+    check()
+
+    print(f"invocations: {count}, per invocation:")
+    print(f"  shell:            {measure(count, 'true', shell=True):.3f}ms")
+    print(f"  no shell:         {measure(count, 'true'):.3f}ms")
+    print(f"  no shell (argv):  {measure(count, ['true']):.3f}ms")
+    print(f"  pty:              {measure(count, 'true', capture_tty=True):.3f}ms")
+    print(f"  pty (shell):      {measure(count, 'true', capture_tty=True, shell=True):.3f}ms")
+    if shutil.which("script"):
+        duration = measure(count, "script -qec 'true' /dev/null")
+        print(f"  script -c:        {duration:.3f}ms")
+    print("both paths produce the same output")
+
+
+if __name__ == "__main__":
+    run()
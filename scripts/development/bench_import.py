@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Measure the cold import time of xiaochen_py with "python -X importtime"
+# (the best of several runs, the bytecode is written by a first run), and
+# exit with an error if it's over the budget, or if the import loads the
+# modules that only the helpers need. The import time of every submodule is
+# printed too.
+#
+# Run it after changing the imports of the package.
+#
+# Usage: ./bench_import.py [budget in ms]
+
+import argparse
+import os
+import subprocess
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported on the first use of a helper, not by "import xiaochen_py"
+HEAVY_MODULES = ["asyncio", "logging", "subprocess", "threading", "json", "datetime", "re"]
+
+
+def import_time(module: str, runs: int = 10) -> float:
+    """
+    Return the cumulative import time of the module in ms, the best of `runs`.
+    """
+    env = dict(os.environ, PYTHONPATH=SCRIPTS_DIR)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    # write the bytecode
+    subprocess.check_call([sys.executable, "-c", f"import {module}"], env=env)
+    best = None
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=env,
+            stderr=subprocess.PIPE,
+            check=True,
+        ).stderr.decode()
+        for line in output.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1]) / 1000
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("budget", nargs="?", type=float, default=1.0, help="max import time in ms")
+    budget = parser.parse_args().budget
+
+    env = dict(os.environ, PYTHONPATH=SCRIPTS_DIR)
+    loaded = subprocess.check_output(
+        [sys.executable, "-c", f"import sys, xiaochen_py; print(*sys.modules)"], env=env
+    ).split()
+    heavy = [module for module in HEAVY_MODULES if module.encode() in loaded]
+
+    total = import_time("xiaochen_py")
+    print(f"import xiaochen_py: {total:.2f}ms (budget {budget:.2f}ms)")
+    for module in [
+        "output",
+        "process",
+        "execution_config",
+        "command",
+        "command_async",
+        "jobs",
+        "files",
+        "benchmark",
+        "regression",
+    ]:
+        print(f"  xiaochen_py.{module}: {import_time(f'xiaochen_py.{module}', 3):.2f}ms")
+
+    if heavy:
+        print(f"error: import xiaochen_py loads {', '.join(heavy)}")
+        sys.exit(1)
+    if total > budget:
+        print("error: over the budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Measure the throughput of OutputMatcher (used by "kill_on_output") with
+# growing output volume and pattern count, it should stay flat.
+#
+# Usage: ./bench_output_matcher.py
+
+import re
+import time
+
+import xiaochen_py
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def bench(patterns, data: bytes) -> float:
+    matcher = xiaochen_py.OutputMatcher(patterns)
+    start_time = time.perf_counter()
+    for i in range(0, len(data), CHUNK_SIZE):
+        chunk = data[i : i + CHUNK_SIZE]
+        matcher.feed(chunk, len(chunk))
+    duration = time.perf_counter() - start_time
+    assert matcher.matched is None
+    return len(data) / 1024 / 1024 / duration
+
+
+def run():
+    line = b"INFO: From Compiling src/backend/utils/adt/ruleutils.c: warning: unused variable\n"
+
+    for size_mb in [16, 64, 256]:
+        data = line * (size_mb * 1024 * 1024 // len(line))
+        for count in [1, 100, 10000]:
+            literals = [f"server is ready on port {i}" for i in range(count)]
+            speed = bench(literals, data)
+            print(f"{size_mb:>4} MiB, {count:>5} literals: {speed:8.1f} MiB/s")
+
+        speed = bench([re.compile(rb"listening on .*:\d+")], data)
+        print(f"{size_mb:>4} MiB,     1 regex:    {speed:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    run()
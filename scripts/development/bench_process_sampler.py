@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Measure the CPU overhead of ProcessTreeSampler at 100 ms intervals, with a
+# tree of processes under the command and many unrelated processes on the
+# system (every sample lists /proc), and check the time series written next
+# to the log (the peak RSS of a process allocating memory must show up).
+#
+# Usage: ./bench_process_sampler.py [tree processes] [other processes]
+
+import argparse
+import os
+import subprocess
+import tempfile
+
+import xiaochen_py
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tree", nargs="?", type=int, default=20, help="processes in the tree")
+    parser.add_argument("others", nargs="?", type=int, default=500, help="other processes")
+    args = parser.parse_args()
+    tree = args.tree
+    others = args.others
+
+    background = [subprocess.Popen(["sleep", "60"]) for _ in range(others)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, "command.log")
+            # short-lived children, idle children, and a memory peak
+            command = (
+                f"for i in $(seq {tree}); do sleep 5 & done; "
+                "for i in $(seq 50); do true; sleep 0.05; done; "
+                "python3 -c 'a = bytearray(200 * 1024 * 1024); import time; time.sleep(0.5)'; "
+                "wait"
+            )
+            result = xiaochen_py.run_command(
+                command, log_path=log_path, stream_output=False, slient=True, sample_interval=0.1
+            )
+            sampler = result.samples
+            print(f"tree: {tree} processes, others: {others} processes")
+            print(f"samples: {sampler}")
+
+            header, columns = xiaochen_py.load_samples(xiaochen_py.samples_path_of(log_path))
+            assert header["rows"] == len(sampler.columns["time"])
+            assert all(columns[name] == sampler.columns[name] for name in columns)
+            assert max(columns["processes"]) >= tree
+            if max(columns["rss"]) < 200 * 1024 * 1024:
+                raise RuntimeError("the peak RSS is missing")
+            print(f"time series: {os.path.getsize(xiaochen_py.samples_path_of(log_path))} bytes")
+            if sampler.overhead >= 0.01:
+                raise RuntimeError(f"overhead {sampler.overhead * 100:.2f}% >= 1%")
+    finally:
+        for process in background:
+            process.kill()
+            process.wait()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Generate a benchmark store with a baseline and a candidate version, where
+# one config regresses, one improves and the others are the same, check the
+# verdicts of xiaochen_py.regression (and its exit code) and time it.
+#
+# Usage: ./bench_regression.py [records per config and version]
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import xiaochen_py
+from xiaochen_py import regression
+
+
+def generate(store: xiaochen_py.BenchmarkStore, per_config: int):
+    random.seed(0)
+    records = []
+    for version in ["v1", "v2"]:
+        for threads in [1, 2, 4, 8, 16]:
+            for database in ["postgres", "cockroach"]:
+                # postgres with 16 threads is 20% slower in v2, cockroach
+                # with 1 thread 20% faster. The noise (2%) is small enough
+                # for the other configs to stay within the 5% threshold
+                # and the planted changes to be found with few records
+                factor = 1.0
+                if version == "v2" and (database, threads) == ("postgres", 16):
+                    factor = 1.2
+                if version == "v2" and (database, threads) == ("cockroach", 1):
+                    factor = 0.8
+                for _ in range(per_config):
+                    latency = random.lognormvariate(0, 0.02) * 5 * factor
+                    records.append(
+                        xiaochen_py.BenchmarkRecord(
+                            target_attributes={
+                                "version": version,
+                                "database": database,
+                                "threads": threads,
+                            },
+                            test_result={"latency_ms": latency, "tps": threads * 1000 / latency},
+                        )
+                    )
+    store.append(records)
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "per_config", nargs="?", type=int, default=1000, help="records per config and version"
+    )
+    per_config = parser.parse_args().per_config
+    if per_config < 10:
+        parser.error("at least 10 records per config and version are needed to find the changes")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, xiaochen_py.BENCHMARK_STORE_NAME)
+        with xiaochen_py.BenchmarkStore(store_path) as store:
+            generate(store, per_config)
+            records = store.find()
+        print(f"{len(records)} records, numpy: {regression.numpy is not None}")
+
+        baseline = [r for r in records if r.target_attributes["version"] == "v1"]
+        candidate = [r for r in records if r.target_attributes["version"] == "v2"]
+        start = time.perf_counter()
+        comparisons = regression.compare(
+            baseline, candidate, "version", higher_is_better=("tps",), resamples=1000
+        )
+        print(f"  compare: {time.perf_counter() - start:.2f}s")
+
+        verdicts = {
+            (c.group["database"], c.group["threads"], c.metric): c.verdict for c in comparisons
+        }
+        assert len(verdicts) == 20
+        for (database, threads, metric), verdict in verdicts.items():
+            expected = "unchanged"
+            if (database, threads) == ("postgres", 16):
+                expected = "regression"
+            if (database, threads) == ("cockroach", 1):
+                expected = "improvement"
+            if verdict != expected:
+                raise RuntimeError(f"{database} {threads} {metric}: {verdict}, expected {expected}")
+
+        # the CLI, its output is not checked
+        code = regression.main(
+            [store_path, "--attribute", "version", "v1", "v2", "--higher-is-better", "tps"]
+        )
+        assert code == regression.EXIT_REGRESSION, code
+        code = regression.main(
+            [store_path, "--attribute", "threads", "2", "4", "--metric", "latency_ms", "--json"]
+        )
+        assert code == regression.EXIT_OK, code
+        code = regression.main([store_path, "--attribute", "version", "v1", "v3"])
+        assert code == regression.EXIT_NO_DATA, code
+    print("verdicts are as expected")
+
+
+if __name__ == "__main__":
+    run()
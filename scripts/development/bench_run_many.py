@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# Compare the wall time of running commands one by one with run_command and
+# concurrently with run_many.
+#
+# Usage: ./bench_run_many.py [commands] [concurrency]
+
+import argparse
+import time
+
+import xiaochen_py
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("commands", nargs="?", type=int, default=32)
+    parser.add_argument("concurrency", nargs="?", type=int, default=8)
+    args = parser.parse_args()
+    count = args.commands
+    concurrency = args.concurrency
+
+    # a mix of waiting and printing, like "nm" or VM setup commands
+    commands = [f"sleep 0.1; seq 1 1000 | tail -n 1" for _ in range(count)]
+
+    start_time = time.perf_counter()
+    for command in commands:
+        xiaochen_py.run_command(command, stream_output=False, slient=True)
+    sequential = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    results = xiaochen_py.run_many(
+        commands, concurrency=concurrency, stream_output=False, slient=True
+    )
+    concurrent = time.perf_counter() - start_time
+    assert len(results) == count
+
+    print(f"commands: {count}, concurrency: {concurrency}")
+    print(f"sequential run_command: {sequential:.2f}s")
+    print(f"run_many:               {concurrent:.2f}s")
+    print(f"speedup: {sequential / concurrent:.1f}x")
+
+
+if __name__ == "__main__":
+    run()
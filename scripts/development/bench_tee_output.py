@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Compare the throughput of the per-line tee path (tee_output) and the chunked
+# tee path (tee_output_chunked).
+#
+# Usage: ./bench_tee_output.py [lines] [line_length]
+
+import argparse
+import io
+import subprocess
+import time
+
+import xiaochen_py
+
+
+def bench(tee, lines: int, line_length: int) -> float:
+    # the child prints "lines" lines as fast as possible
+    command = f"yes {'x' * (line_length - 1)} | head -n {lines}"
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        bufsize=1000 if tee is xiaochen_py.tee_output else 0,
+    )
+
+    devnull = open("/dev/null", "wb")
+    buffer = io.BytesIO()
+    writers = [devnull, io.BufferedWriter(buffer, buffer_size=1000)]
+
+    start_time = time.perf_counter()
+    tee(process, writers)
+    process.wait()
+    duration = time.perf_counter() - start_time
+
+    devnull.close()
+    expected = lines * line_length
+    if len(buffer.getvalue()) != expected:
+        raise RuntimeError(f"captured {len(buffer.getvalue())} bytes, expect {expected}")
+
+    return duration
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("lines", nargs="?", type=int, default=1_000_000)
+    parser.add_argument("line_length", nargs="?", type=int, default=80)
+    args = parser.parse_args()
+    lines = args.lines
+    line_length = args.line_length
+
+    size_mb = lines * line_length / 1024 / 1024
+    print(f"lines: {lines}, line length: {line_length}, total: {size_mb:.1f} MiB")
+
+    results = {}
+    for name, tee in [
+        ("line", xiaochen_py.tee_output),
+        ("chunk", xiaochen_py.tee_output_chunked),
+    ]:
+        duration = bench(tee, lines, line_length)
+        results[name] = duration
+        print(f"{name:>6}: {duration:.3f}s, {size_mb / duration:.1f} MiB/s")
+
+    print(f"speedup: {results['line'] / results['chunk']:.1f}x")
+
+
+if __name__ == "__main__":
+    run()
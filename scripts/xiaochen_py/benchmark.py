@@ -0,0 +1,255 @@
+# Benchmark records and their store.
+
+import datetime
+import json
+import os
+import re
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from xiaochen_py.process import ResourceUsage
+
+
+class BenchmarkRecord:
+    record_time: str
+    target_attributes: dict[str, object]
+    test_result: dict[str, object]
+
+    def __init__(self, **kwargs):
+        self.record_time = datetime.datetime.now().isoformat()
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return f"{self.record_time}, {self.target_attributes}, {self.test_result}"
+
+    def add_usage(self, usage: "ResourceUsage", prefix: str = ""):
+        """
+        Add the resource usage of a command to test_result, e.g.
+        record.add_usage(result.usage, prefix="build_").
+        """
+        if not hasattr(self, "test_result"):
+            self.test_result = dict()
+        self.test_result.update(usage.to_dict(prefix))
+
+
+def dump_records(records: List[BenchmarkRecord], dir_path: str, legacy_json: bool = True):
+    """
+    Append the records to the benchmark store in the directory (see
+    BenchmarkStore). With `legacy_json`, also write them to a
+    benchmark_<timestamp>.json report like before, for the scripts that read
+    the reports with get_latest_report(). It's the default for now, pass
+    legacy_json=False once the readers use the store.
+    """
+    with BenchmarkStore(os.path.join(dir_path, BENCHMARK_STORE_NAME)) as store:
+        store.append(records)
+    if not legacy_json:
+        return
+
+    records_json = json.dumps(records, default=lambda x: x.__dict__, indent=4)
+    record_path = os.path.join(
+        dir_path,
+        f"benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+    )
+
+    with open(record_path, "w") as f:
+        f.write(records_json)
+
+
+# example of file name: docs/record/benchmark_20240527_220536.json
+REPORT_NAME_PATTERN = re.compile(r"benchmark_\d{8}_\d{6}\.json")
+
+
+def get_latest_report(report_dir: str) -> str:
+    """
+    Return the latest JSON report written by dump_records() with
+    `legacy_json`, the other files are ignored.
+
+    Deprecated: the JSON reports are not written with legacy_json=False,
+    read the records from the store instead, e.g.
+    BenchmarkStore(path).latest(target_attributes).
+    """
+    # the time in the file name sorts like a string
+    report_files = [name for name in os.listdir(report_dir) if REPORT_NAME_PATTERN.fullmatch(name)]
+    if not report_files:
+        raise FileNotFoundError(
+            f"no benchmark_<timestamp>.json report in {report_dir}, dump_records() doesn't"
+            f" write them with legacy_json=False, the records are in"
+            f" {os.path.join(report_dir, BENCHMARK_STORE_NAME)} (see BenchmarkStore)"
+        )
+    return os.path.join(report_dir, max(report_files))
+
+
+def json_loader(**kwargs):
+    if "record_time" in kwargs:
+        return BenchmarkRecord(**kwargs)
+
+    return kwargs
+
+
+def record_to_json(record: BenchmarkRecord) -> str:
+    return json.dumps(record, default=lambda x: x.__dict__)
+
+
+def record_from_json(text: str) -> BenchmarkRecord:
+    return json.loads(text, object_hook=lambda x: json_loader(**x))
+
+
+def config_key(target_attributes: dict) -> str:
+    """
+    Return the canonical JSON of the target attributes, the records of the
+    same config have the same key whatever the order of the attributes.
+    """
+    return json.dumps(target_attributes, sort_keys=True, separators=(",", ":"), default=str)
+
+
+BENCHMARK_STORE_NAME = "benchmarks.sqlite"
+
+BENCHMARK_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    -- ISO 8601, sorts like the time
+    record_time TEXT NOT NULL,
+    -- see config_key()
+    config TEXT NOT NULL,
+    -- the JSON of the whole record
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_time ON records(record_time);
+CREATE INDEX IF NOT EXISTS records_config_time ON records(config, record_time);
+-- one row per target attribute of every record, values in JSON
+CREATE TABLE IF NOT EXISTS attributes (
+    record_id INTEGER NOT NULL REFERENCES records(id),
+    key TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attributes_key_value ON attributes(key, value, record_id);
+-- the report files imported by import_reports()
+CREATE TABLE IF NOT EXISTS imported_reports (
+    path TEXT PRIMARY KEY
+);
+"""
+
+
+class BenchmarkStore:
+    """
+    An append-only store of BenchmarkRecord, in SQLite.
+
+    The records are indexed by time and by config (the target attributes as
+    a whole), so the latest records of a config are read from the index
+    (O(log n)) instead of loading every report. Every attribute is indexed
+    too, to find the records that have some of the attributes.
+    """
+
+    def __init__(self, path: str):
+        # imported here, most scripts don't need it
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(BENCHMARK_STORE_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, records: List[BenchmarkRecord]):
+        with self.conn:
+            self._insert(records)
+
+    def _insert(self, records: List[BenchmarkRecord]):
+        """
+        Insert the records, the caller commits them (in a "with self.conn" block).
+        """
+        for record in records:
+            target_attributes = getattr(record, "target_attributes", None) or dict()
+            cursor = self.conn.execute(
+                "INSERT INTO records (record_time, config, record) VALUES (?, ?, ?)",
+                (record.record_time, config_key(target_attributes), record_to_json(record)),
+            )
+            self.conn.executemany(
+                "INSERT INTO attributes (record_id, key, value) VALUES (?, ?, ?)",
+                (
+                    (cursor.lastrowid, key, json.dumps(value, default=str))
+                    for key, value in target_attributes.items()
+                ),
+            )
+
+    def latest(self, target_attributes: dict, n: int = 1) -> List[BenchmarkRecord]:
+        """
+        Return the latest `n` records of the config, newest first.
+        """
+        rows = self.conn.execute(
+            "SELECT record FROM records WHERE config = ? ORDER BY record_time DESC LIMIT ?",
+            (config_key(target_attributes), n),
+        )
+        return [record_from_json(record) for (record,) in rows]
+
+    def find(
+        self,
+        attributes: Optional[dict] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[BenchmarkRecord]:
+        """
+        Return the records that have all the given target attributes (and
+        maybe others), recorded in [since, until) (ISO 8601), newest first.
+        """
+        conditions = []
+        params = []
+        if attributes:
+            subquery = " INTERSECT ".join(
+                ["SELECT record_id FROM attributes WHERE key = ? AND value = ?"] * len(attributes)
+            )
+            conditions.append(f"id IN ({subquery})")
+            for key, value in attributes.items():
+                params += [key, json.dumps(value, default=str)]
+        if since is not None:
+            conditions.append("record_time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("record_time < ?")
+            params.append(until)
+        query = "SELECT record FROM records"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY record_time DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        return [record_from_json(record) for (record,) in self.conn.execute(query, params)]
+
+    def configs(self) -> List[dict]:
+        """
+        Return the target attributes of every config in the store.
+        """
+        rows = self.conn.execute("SELECT DISTINCT config FROM records ORDER BY config")
+        return [json.loads(config) for (config,) in rows]
+
+    def import_reports(self, report_dir: str) -> int:
+        """
+        Append the records of the JSON reports written by dump_records() with
+        `legacy_json`, every report is imported once. Return the number of
+        imported reports.
+        """
+        done = {path for (path,) in self.conn.execute("SELECT path FROM imported_reports")}
+        count = 0
+        for name in sorted(os.listdir(report_dir)):
+            path = os.path.abspath(os.path.join(report_dir, name))
+            if not REPORT_NAME_PATTERN.fullmatch(name) or path in done:
+                continue
+            with open(path, "r") as f:
+                records = json.load(f, object_hook=lambda x: json_loader(**x))
+            # the records and the mark in one transaction, an interrupted
+            # import leaves neither, and the report is imported again
+            with self.conn:
+                self._insert([record for record in records if isinstance(record, BenchmarkRecord)])
+                self.conn.execute("INSERT INTO imported_reports (path) VALUES (?)", (path,))
+            count += 1
+        return count
@@ -0,0 +1,389 @@
+# Run shell commands in the foreground: run_command.
+
+import logging
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from io import BufferedReader
+from typing import List, Mapping, Optional, Tuple, Union
+
+from xiaochen_py.execution_config import command_context
+from xiaochen_py.output import (
+    OutputMatcher,
+    PtyReader,
+    new_capture,
+    tee_output,
+    tee_output_chunked,
+)
+from xiaochen_py.process import (
+    ProcessTreeIO,
+    ProcessTreeSampler,
+    ResourceUsage,
+    samples_path_of,
+    terminate_process_group,
+    wait_with_usage,
+)
+
+# the characters that only a shell can interpret (quotes are understood by
+# shlex the same way), a command without them is run without the shell
+SHELL_CHARACTERS = frozenset("|&;<>()$`\\*?[]{}~#!\n")
+
+# the first words that are not programs, or programs that behave differently
+# from the shell builtins
+SHELL_BUILTINS = frozenset(
+    """
+    . : ! { } [ alias bg break case cd command continue do done echo elif else
+    esac eval exec exit export fg fi for function getopts hash if jobs local
+    printf pwd read readonly return select set shift source test then time
+    times trap type ulimit umask unalias unset until wait while
+    """.split()
+)
+
+
+def split_command(command: str) -> Optional[List[str]]:
+    """
+    Return the argv of a shell command that needs no shell feature (pipes,
+    redirections, variables, globs, builtins, ...), None if it needs the
+    shell. Running the argv directly saves the fork and exec of /bin/sh.
+    """
+    if not SHELL_CHARACTERS.isdisjoint(command):
+        return None
+    if "'" in command or '"' in command:
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+    else:
+        argv = command.split()
+    # "A=1 command" sets a variable
+    if not argv or argv[0] in SHELL_BUILTINS or "=" in argv[0]:
+        return None
+    return argv
+
+
+def open_pty() -> Tuple[int, int]:
+    """
+    Open a pseudo-terminal, return tuple(master fd, slave fd). The window size
+    is copied from the terminal of stdout, if any.
+    """
+    import fcntl
+    import pty
+    import termios
+
+    master, slave = pty.openpty()
+    if sys.stdout.isatty():
+        size = fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, bytes(8))
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, size)
+    return master, slave
+
+
+def run_command(
+    command: Union[str, List[str]],
+    include_stderr: bool = True,
+    capture_tty: bool = False,
+    log_path: Optional[str] = None,
+    stream_output: bool = True,
+    kill_on_output: Optional[Union[str, bytes, re.Pattern, List[Union[str, bytes, re.Pattern]]]] = None,
+    raise_on_failure: bool = True,
+    slient: bool = False,
+    work_dir: Optional[str] = None,
+    env: Optional[Mapping[str, Optional[str]]] = None,
+    tee_mode: str = "line",
+    kill_grace_period: float = 1.0,
+    kill_timeout: float = 5.0,
+    capture: str = "full",
+    capture_limit: int = 16 * 1024 * 1024,
+    io_sample_interval: Optional[float] = None,
+    sample_interval: Optional[float] = None,
+    shell: Optional[bool] = None,
+) -> "CommandResult":
+    """
+    Run a shell command and return its output, exit code and resource usage.
+
+    Args:
+        command (str): The shell command to execute, or the argv of a program (a list of strings).
+        include_stderr (bool, optional): If True, stderr is included in the output. Defaults to True.
+        capture_tty (bool, optional): Run the command with its stdout (and stderr if `include_stderr`) on a
+                                      pseudo-terminal, for the programs that only print colors or progress to
+                                      a terminal. The output goes through the same tee pipeline, with the
+                                      line endings of a terminal ("\r\n"). Defaults to False.
+        log_path (Optional[str], optional): The file path where output will be written in real-time. If None, no file is written.
+                                               If the file exists, it will be overwritten. Defaults to None.
+        stream_output (bool, optional): If True, streams the output to stdout while executing. Defaults to False.
+        kill_on_output (optional): If the pattern (or any of the list of patterns) is found in the output, the
+                                   process group is killed after `kill_grace_period` seconds. A str or bytes is
+                                   a literal, a re.Pattern is matched against every line (see OutputMatcher).
+                                   Being killed this way is not treated as a failure. Defaults to None.
+        raise_on_failure: Throw an exception when the command exit with a non-zero exit code.
+        work_dir (Optional[str], optional): The directory to run the command in, relative to the cwd of the
+                                            execution config (see execution()). If None, uses that directory.
+        env (Optional[Mapping], optional): The variables set in the environment of the command, on top of the
+                                           env of the execution config, a None value removes the variable.
+                                           Defaults to None.
+        tee_mode (str, optional): How the output is captured, "line" flushes every line to the writers, "chunk"
+                                  reads large chunks and flushes by time or size (see tee_output_chunked), which
+                                  is much cheaper for commands with huge output. Defaults to "line".
+        capture (str, optional): How the output is kept in memory:
+                                 - "full": keep the whole output.
+                                 - "head_tail": keep the first and the last bytes of the output, at most
+                                   `capture_limit` bytes in total.
+                                 - "spill": move the output to a temporary file once it exceeds `capture_limit`
+                                   bytes, the returned output is a read-only mmap of the file.
+                                 - "none": discard the output, an empty bytes is returned.
+                                 Except "full", CalledProcessError.output only gets the tail of the output.
+                                 Defaults to "full".
+        capture_limit (int, optional): The max bytes kept in memory by "head_tail" and "spill". Defaults to 16 MiB.
+        kill_grace_period (float, optional): Seconds to wait after the output matched `kill_on_output` before
+                                             sending SIGTERM. Defaults to 1.0.
+        kill_timeout (float, optional): Seconds to wait after SIGTERM before sending SIGKILL. Defaults to 5.0.
+        io_sample_interval (Optional[float], optional): Seconds between the samples of the I/O of the processes
+                                                        orphaned by the command (see ProcessTreeIO), e.g.
+                                                        the daemons it started. None disables the sampling,
+                                                        the I/O is then the one of the command and the
+                                                        descendants it waited for. Defaults to None.
+        sample_interval (Optional[float], optional): Seconds between the samples of the CPU usage, RSS, threads
+                                                     and open files of the process tree (see ProcessTreeSampler).
+                                                     The time series is written next to `log_path` (see
+                                                     samples_path_of()) and kept in the result. None disables
+                                                     the sampler. Defaults to None.
+        shell (Optional[bool], optional): True runs the command with /bin/sh, False runs it directly (a string
+                                          is split with shlex). None runs a string with the shell only if it
+                                          needs it (see split_command) and a list directly. Defaults to None.
+
+    Returns:
+        CommandResult: The output, the exit code and the resource usage (see ResourceUsage). It can still be
+                       unpacked as tuple(output, exit code).
+    """
+
+    if tee_mode not in ("line", "chunk"):
+        raise ValueError(f"unknown tee mode: {tee_mode}")
+    output_capture = new_capture(capture, capture_limit)
+
+    matcher = None
+    if kill_on_output is not None:
+        if isinstance(kill_on_output, list):
+            matcher = OutputMatcher(kill_on_output)
+        else:
+            matcher = OutputMatcher([kill_on_output])
+
+    if isinstance(command, str):
+        argv = None if shell else split_command(command)
+        if argv is None and shell is False:
+            argv = shlex.split(command)
+    else:
+        argv = list(command)
+        command = shlex.join(argv)
+        if shell:
+            argv = None
+
+    # the working directory and the environment are passed to Popen, the
+    # process-wide ones are never changed, so commands can run in threads
+    dry_run, cwd, command_env = command_context(work_dir, env)
+
+    if dry_run:
+        print(f"(dry run) command: {command}")
+        return CommandResult(command, bytes(), 0, 0.0)
+
+    if not slient:
+        print(f"running command: {command}")
+
+    start_time = time.time()
+
+    stdout_target = subprocess.PIPE
+    stderr_target = None
+    if include_stderr:
+        stderr_target = subprocess.STDOUT
+
+    master = None
+    if capture_tty:
+        master, slave = open_pty()
+        stdout_target = slave
+        if include_stderr:
+            stderr_target = slave
+
+    # explaination of args:
+    # - "shell=True" makes us can use a string for "command", the argv of a
+    #   command that needs no shell is run directly, which saves the fork and
+    #   exec of /bin/sh
+    # - "text=False" makes the output as bytes, which is required by api
+    #   "writer.write"
+    # - "bufsize=1000" makes the output got buffered (don't set bufsize=1, which
+    #   set the buffer mode to "line buffer" and not avaliable for bytes output)
+    # - in "chunk" mode the pipe is read directly from the file descriptor, so
+    #   the buffer is not needed
+    # - "start_new_session=True" makes the command the leader of a new process
+    #   group, so "kill_on_output" can kill it with all its children
+    # - with "capture_tty" the output goes to the slave side of a pty, it's
+    #   read from the master side instead of a pipe
+    popen_kwargs = dict(
+        stdout=stdout_target,
+        stderr=stderr_target,
+        text=False,
+        bufsize=1000 if tee_mode == "line" else 0,
+        start_new_session=matcher is not None,
+        cwd=cwd,
+        env=command_env,
+    )
+    try:
+        if argv is None:
+            process = subprocess.Popen(command, shell=True, **popen_kwargs)
+        else:
+            try:
+                process = subprocess.Popen(argv, **popen_kwargs)
+            except (FileNotFoundError, PermissionError):
+                if shell is False or (cwd and not os.path.isdir(cwd)):
+                    raise
+                # let the shell report the missing program, with exit code 127
+                # (or 126) like before
+                process = subprocess.Popen(command, shell=True, **popen_kwargs)
+    except BaseException:
+        if master is not None:
+            os.close(master)
+        raise
+    finally:
+        if master is not None:
+            # only the child keeps the slave side open, so reading the master
+            # side ends when the child (and its children) exit
+            os.close(slave)
+
+    if master is not None:
+        reader = PtyReader(master)
+        process.stdout = BufferedReader(reader, 1000) if tee_mode == "line" else reader
+
+    io_sampler = None
+    if io_sample_interval is not None and os.path.isdir("/proc"):
+        io_sampler = ProcessTreeIO(process.pid, io_sample_interval)
+        io_sampler.start()
+
+    sampler = None
+    if sample_interval is not None and os.path.isdir("/proc"):
+        sampler = ProcessTreeSampler(
+            process.pid, sample_interval, samples_path_of(log_path) if log_path else None
+        )
+        sampler.start()
+
+    def signal_handler(sig, frame):
+        logging.debug(f"get signal: {sig}({signal.strsignal(sig)}), frame: {frame}")
+        if sig == signal.SIGINT:
+            # kill the process when get SIGINT
+            logging.debug("got SIGINT, killing the process")
+        process.kill()
+
+    # signal handlers can only be set in the main thread
+    if threading.current_thread() is threading.main_thread():
+        # NB: SIGKILL cannot be caught, blocked, or ignored.
+        # https://docs.python.org/3/library/signal.html#signal.SIGKILL
+        signal.signal(signal.SIGINT, signal_handler)
+        # SIG_DFL is the default signal handler, which is the default behavior of the
+        # system.
+        # https://docs.python.org/3/library/signal.html#signal.SIG_DFL
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    writers = []
+    if stream_output:
+        writers.append(sys.stdout.buffer)
+    if log_path:
+        f = open(log_path, "w")
+        print(f"running command: {command}", file=f)
+        writers.append(f)
+    writers.append(output_capture)
+
+    chunk_callbacks = []
+    # set once wait_with_usage() reaped the process, the killer must not reap
+    # it first, or its resource usage is lost
+    reaped = threading.Event()
+    if matcher:
+        killer = threading.Thread(
+            target=terminate_process_group,
+            args=(process, kill_grace_period, kill_timeout, reaped),
+        )
+
+        def on_output(buffer, size):
+            if matcher.matched is None and matcher.feed(buffer, size) is not None:
+                logging.debug(f"output matched {matcher.matched!r}, killing the process")
+                killer.start()
+
+        chunk_callbacks.append(on_output)
+
+    # Create a thread to handle the tee output
+    tee = tee_output if tee_mode == "line" else tee_output_chunked
+    thread = threading.Thread(
+        target=tee, args=(process, writers), kwargs={"chunk_callbacks": chunk_callbacks}
+    )
+    thread.start()
+
+    # Wait for the subprocess to finish
+    rusage, io = wait_with_usage(process)
+    reaped.set()
+    if io_sampler:
+        io = io_sampler.stop(io)
+    if sampler:
+        sampler.stop()
+
+    # Ensure the thread finishes
+    thread.join()
+    if master is not None:
+        process.stdout.close()
+    if matcher and matcher.matched is not None:
+        killer.join()
+
+    duration = time.time() - start_time
+    usage = ResourceUsage(duration, rusage, io)
+    if not slient:
+        print(f"command finished in {duration:.2f} seconds.")
+    logging.debug(f"resource usage: {usage}")
+
+    killed_on_output = matcher is not None and matcher.matched is not None
+    if raise_on_failure and process.returncode != 0 and not killed_on_output:
+        # logging.error(f"command output: {buffer.getvalue().decode('utf-8')}")
+        logging.error(f"return code: {process.returncode}")
+        raise subprocess.CalledProcessError(
+            returncode=process.returncode,
+            cmd=command,
+            output=output_capture.error_output(),
+        )
+
+    return CommandResult(
+        command, output_capture.getvalue(), process.returncode, duration, usage, sampler
+    )
+
+
+class CommandResult:
+    command: str
+    output: bytes
+    returncode: int
+    # wall time in seconds
+    duration: float
+    usage: Optional[ResourceUsage]
+    samples: Optional[ProcessTreeSampler]
+
+    def __init__(
+        self,
+        command: str,
+        output: bytes,
+        returncode: int,
+        duration: float,
+        usage: Optional[ResourceUsage] = None,
+        samples: Optional[ProcessTreeSampler] = None,
+    ):
+        self.command = command
+        self.output = output
+        self.returncode = returncode
+        self.duration = duration
+        self.usage = usage
+        self.samples = samples
+
+    # run_command used to return tuple(output, returncode)
+    def __iter__(self):
+        return iter((self.output, self.returncode))
+
+    def __getitem__(self, index):
+        return (self.output, self.returncode)[index]
+
+    def __repr__(self):
+        return f"{self.command}, returncode: {self.returncode}, duration: {self.duration:.2f}s"
@@ -0,0 +1,194 @@
+# Run shell commands with asyncio: run_command_async, run_many_async and
+# run_many.
+
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import AsyncIterator, List, Mapping, Optional, Tuple
+
+from xiaochen_py.command import CommandResult
+from xiaochen_py.execution_config import command_context
+from xiaochen_py.output import LineSplitter, new_capture
+
+
+async def run_command_async(
+    command: str,
+    include_stderr: bool = True,
+    log_path: Optional[str] = None,
+    stream_output: bool = True,
+    raise_on_failure: bool = True,
+    slient: bool = False,
+    work_dir: Optional[str] = None,
+    env: Optional[Mapping[str, Optional[str]]] = None,
+    capture: str = "full",
+    capture_limit: int = 16 * 1024 * 1024,
+    prefix: Optional[str] = None,
+) -> Tuple[bytes, int]:
+    """
+    The asyncio version of run_command, no thread is used to tee the output.
+
+    Args:
+        command (str): The shell command to execute.
+        include_stderr (bool, optional): If True, stderr is included in the output. Defaults to True.
+        log_path (Optional[str], optional): The file path where output will be written in real-time. If None, no file is written.
+                                               If the file exists, it will be overwritten. Defaults to None.
+        stream_output (bool, optional): If True, streams the output to stdout while executing. Defaults to True.
+        raise_on_failure: Throw an exception when the command exit with a non-zero exit code.
+        work_dir (Optional[str], optional): The directory to run the command in, see run_command.
+        env (Optional[Mapping], optional): The variables set in the environment of the command, see run_command.
+        capture (str, optional): How the output is kept in memory, see run_command. Defaults to "full".
+        capture_limit (int, optional): The max bytes kept in memory, see run_command. Defaults to 16 MiB.
+        prefix (Optional[str], optional): If given, every line streamed to stdout starts with it, which tells the
+                                          output of concurrent commands apart. Defaults to None.
+
+    Returns:
+        Tuple[bytes, int]: A tuple containing the output of the command and the exit code of the process.
+    """
+    output_capture = new_capture(capture, capture_limit)
+    prefix_bytes = (prefix or "").encode("utf-8")
+
+    dry_run, cwd, command_env = command_context(work_dir, env)
+
+    if dry_run:
+        print(f"{prefix or ''}(dry run) command: {command}")
+        return bytes(), 0
+
+    if not slient:
+        print(f"{prefix or ''}running command: {command}")
+
+    start_time = time.time()
+
+    stderr_target = None
+    if include_stderr:
+        stderr_target = asyncio.subprocess.STDOUT
+
+    # the log is opened before the command starts, if it can't be opened
+    # nothing is left running
+    writers = [output_capture]
+    log_file = None
+    if log_path:
+        log_file = open(log_path, "wb")
+        log_file.write(f"running command: {command}\n".encode("utf-8"))
+        writers.append(log_file)
+
+    # start the command in a new session, so it can be killed with all its
+    # children when the task is cancelled, otherwise the grandchildren keep the
+    # pipe open and "process.wait()" won't return until they exit
+    try:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=stderr_target,
+            cwd=cwd,
+            env=command_env,
+            start_new_session=True,
+        )
+    except BaseException:
+        if log_file:
+            log_file.close()
+        raise
+
+    splitter = None
+    if stream_output and prefix:
+        stdout = sys.stdout.buffer
+        splitter = LineSplitter([lambda line: stdout.write(prefix_bytes + line)])
+    elif stream_output:
+        sys.stdout.flush()
+        writers.append(sys.stdout.buffer)
+
+    try:
+        while True:
+            chunk = await process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            for writer in writers:
+                writer.write(chunk)
+            if splitter:
+                splitter.feed(chunk, len(chunk))
+            if stream_output:
+                sys.stdout.buffer.flush()
+
+        if splitter:
+            splitter.close()
+            sys.stdout.buffer.flush()
+
+        await process.wait()
+    except asyncio.CancelledError:
+        # don't leave the process running when the caller gives up
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+    finally:
+        if log_file:
+            log_file.close()
+
+    duration = time.time() - start_time
+    if not slient:
+        print(f"{prefix or ''}command finished in {duration:.2f} seconds.")
+
+    if raise_on_failure and process.returncode != 0:
+        logging.error(f"return code: {process.returncode}")
+        raise subprocess.CalledProcessError(
+            returncode=process.returncode,
+            cmd=command,
+            output=output_capture.error_output(),
+        )
+
+    return output_capture.getvalue(), process.returncode
+
+
+async def run_many_async(
+    commands: List[str],
+    concurrency: Optional[int] = None,
+    raise_on_failure: bool = True,
+    **kwargs,
+) -> AsyncIterator[CommandResult]:
+    """
+    Run the commands concurrently, yield the results in the order they finish.
+
+    Args:
+    - commands: The shell commands to execute.
+    - concurrency: The max number of commands running at the same time, defaults to the number of CPUs.
+    - raise_on_failure: If True, the first failed command cancels (and kills) all the other commands and its
+      CalledProcessError is raised.
+    - kwargs: Passed to run_command_async.
+    """
+    semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+    async def run_one(i: int, command: str) -> CommandResult:
+        async with semaphore:
+            start_time = time.time()
+            output, returncode = await run_command_async(
+                command, raise_on_failure=raise_on_failure, prefix=f"[{i}] ", **kwargs
+            )
+            return CommandResult(command, output, returncode, time.time() - start_time)
+
+    tasks = [asyncio.ensure_future(run_one(i, c)) for i, c in enumerate(commands)]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_many(
+    commands: List[str], concurrency: Optional[int] = None, **kwargs
+) -> List[CommandResult]:
+    """
+    The blocking version of run_many_async, return the results in the order
+    they finish.
+    """
+
+    async def collect():
+        return [result async for result in run_many_async(commands, concurrency, **kwargs)]
+
+    return asyncio.run(collect())
@@ -0,0 +1,141 @@
+# The execution config of the helpers that run commands (dry run, working
+# directory and environment), scoped to the current context with contextvars
+# instead of process-wide globals, so the threads and the asyncio tasks
+# running commands at the same time don't see each other's settings.
+
+import contextlib
+import contextvars
+import os
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+import xiaochen_py
+
+
+class ExecutionConfig:
+    """
+    How run_command, run_command_async and run_background run the commands.
+
+    - dry_run: Print the commands instead of running them.
+    - cwd: The working directory of the commands, None is the current
+      directory of the process.
+    - env: The variables set in the environment of the commands, on top of
+      the environment of the process. A None value removes the variable.
+    """
+
+    __slots__ = ("dry_run", "cwd", "env")
+
+    dry_run: bool
+    cwd: Optional[str]
+    env: Dict[str, Optional[str]]
+
+    def __init__(
+        self,
+        dry_run: bool = False,
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+    ):
+        self.dry_run = dry_run
+        self.cwd = cwd
+        self.env = dict(env or {})
+
+    def replace(
+        self,
+        dry_run: Optional[bool] = None,
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+    ) -> "ExecutionConfig":
+        """
+        Return a copy with the given fields changed, a relative `cwd` is
+        relative to the current one, `env` is added to the current one.
+        """
+        return ExecutionConfig(
+            self.dry_run if dry_run is None else dry_run,
+            self.command_cwd(cwd),
+            {**self.env, **(env or {})},
+        )
+
+    def command_cwd(self, work_dir: Optional[str] = None) -> Optional[str]:
+        """
+        Return the `cwd` argument of Popen for a command run in `work_dir`.
+        """
+        if not work_dir:
+            return self.cwd
+        if self.cwd is None:
+            return work_dir
+        return os.path.join(self.cwd, work_dir)
+
+    def command_env(
+        self, env: Optional[Mapping[str, Optional[str]]] = None
+    ) -> Optional[Dict[str, str]]:
+        """
+        Return the `env` argument of Popen for a command run with the extra
+        variables `env`, None (inherit the environment) if nothing changes.
+        """
+        if not self.env and not env:
+            return None
+        environ = dict(os.environ)
+        for changes in (self.env, env or {}):
+            for key, value in changes.items():
+                if value is None:
+                    environ.pop(key, None)
+                else:
+                    environ[key] = value
+        return environ
+
+    def __repr__(self):
+        return f"ExecutionConfig(dry_run={self.dry_run}, cwd={self.cwd!r}, env={self.env!r})"
+
+
+EXECUTION_CONFIG: "contextvars.ContextVar[ExecutionConfig]" = contextvars.ContextVar(
+    "xiaochen_py.execution_config"
+)
+
+
+def current_execution() -> ExecutionConfig:
+    """
+    Return the execution config of the current context.
+
+    Outside any "with execution(...)" block, the commands run in the current
+    directory of the process, and xiaochen_py.DRY_RUN (kept for the old
+    scripts) tells whether they are dry runs.
+    """
+    config = EXECUTION_CONFIG.get(None)
+    if config is None:
+        return ExecutionConfig(dry_run=xiaochen_py.DRY_RUN)
+    return config
+
+
+@contextlib.contextmanager
+def execution(
+    dry_run: Optional[bool] = None,
+    cwd: Optional[str] = None,
+    env: Optional[Mapping[str, Optional[str]]] = None,
+) -> Iterator[ExecutionConfig]:
+    """
+    Change the execution config (see ExecutionConfig.replace) of the commands
+    run inside the block, e.g.
+
+        with xiaochen_py.execution(dry_run=True, cwd="build"):
+            xiaochen_py.run_command("make")
+
+    The asyncio tasks created inside the block inherit the config, but a new
+    thread starts with the default one: enter the block in the thread, or run
+    it with contextvars.copy_context().run.
+    """
+    config = current_execution().replace(dry_run, cwd, env)
+    token = EXECUTION_CONFIG.set(config)
+    try:
+        yield config
+    finally:
+        EXECUTION_CONFIG.reset(token)
+
+
+def command_context(
+    work_dir: Optional[str], env: Optional[Mapping[str, Optional[str]]]
+) -> Tuple[bool, Optional[str], Optional[Dict[str, str]]]:
+    """
+    Return tuple(dry run, cwd, env) of a command, the per-call `work_dir` and
+    `env` applied on top of the current execution config.
+    """
+    config = current_execution()
+    return config.dry_run, config.command_cwd(work_dir), config.command_env(env)
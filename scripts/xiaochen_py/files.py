@@ -0,0 +1,225 @@
+# The size of directories and files.
+
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+class DirState:
+    """
+    The files of one directory (not recursive) in a DirSnapshot.
+    """
+
+    __slots__ = ("mtime_ns", "size", "blocks", "links", "subdirs")
+
+    # None if the directory changed too recently to trust its mtime
+    mtime_ns: Optional[int]
+    # the apparent size and the 512-byte blocks of the files with one link
+    size: int
+    blocks: int
+    # tuple(size, blocks) of the files with hard links, by (st_dev, st_ino)
+    links: dict[Tuple[int, int], Tuple[int, int]]
+    subdirs: List[str]
+
+    def __init__(self, mtime_ns: Optional[int]):
+        self.mtime_ns = mtime_ns
+        self.size = 0
+        self.blocks = 0
+        self.links = dict()
+        self.subdirs = []
+
+
+# directories modified less than this long before a scan are scanned again by
+# the next one, a change in the same mtime tick as the scan would be missed
+RACY_MTIME_NS = 2 * 1000 * 1000 * 1000
+
+
+def scan_dir(path: str, previous: Optional[DirState], started_ns: int) -> Optional[DirState]:
+    """
+    Return the state of a directory, `previous` if its mtime didn't change.
+    None if it's gone (or can't be read).
+    """
+    try:
+        mtime_ns = os.lstat(path).st_mtime_ns
+    except OSError:
+        return None
+    if previous is not None and previous.mtime_ns == mtime_ns:
+        return previous
+
+    state = DirState(mtime_ns if mtime_ns < started_ns - RACY_MTIME_NS else None)
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        state.subdirs.append(entry.name)
+                        continue
+                    # the stat of the scan, no extra call for the type
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    # deleted during the scan
+                    continue
+                if st.st_nlink > 1:
+                    state.links[(st.st_dev, st.st_ino)] = (st.st_size, st.st_blocks)
+                else:
+                    state.size += st.st_size
+                    state.blocks += st.st_blocks
+    except OSError:
+        return None
+    return state
+
+
+class DirSnapshot:
+    """
+    The sizes of the files under a directory, by directory.
+
+    `size` is the apparent size, `allocated` the bytes of the allocated
+    blocks (like "du", smaller for sparse files, larger for small files).
+    A file with several hard links under the directory is counted once.
+    Symlinks are not followed, their own size is counted.
+    """
+
+    path: str
+    dirs: dict[str, DirState]
+
+    def __init__(self, path: str, dirs: dict[str, DirState]):
+        self.path = path
+        self.dirs = dirs
+        self.size = 0
+        blocks = 0
+        links = dict()
+        for state in dirs.values():
+            self.size += state.size
+            blocks += state.blocks
+            links.update(state.links)
+        for size, link_blocks in links.values():
+            self.size += size
+            blocks += link_blocks
+        self.allocated = blocks * 512
+
+    def delta(self, previous: "DirSnapshot") -> dict[str, int]:
+        """
+        Return the change of the apparent size of every directory that
+        changed since the previous snapshot (the files of a directory only,
+        not its subdirectories; the hard links are counted in every
+        directory).
+        """
+
+        def dir_size(state: Optional[DirState]) -> int:
+            if state is None:
+                return 0
+            return state.size + sum(size for size, _ in state.links.values())
+
+        changes = dict()
+        for path in self.dirs.keys() | previous.dirs.keys():
+            state = self.dirs.get(path)
+            previous_state = previous.dirs.get(path)
+            if state is previous_state:
+                continue
+            change = dir_size(state) - dir_size(previous_state)
+            if change:
+                changes[path] = change
+        return changes
+
+    def __repr__(self):
+        return (
+            f"{self.path}: {self.size / 1024 / 1024:.1f} MiB,"
+            f" allocated {self.allocated / 1024 / 1024:.1f} MiB, {len(self.dirs)} directories"
+        )
+
+
+def snapshot_dir(
+    path: str, previous: Optional[DirSnapshot] = None, jobs: Optional[int] = None
+) -> DirSnapshot:
+    """
+    Scan the directory tree with os.scandir, the subdirectories are scanned
+    by a thread pool of `jobs` threads (the stat calls release the GIL).
+
+    With the previous snapshot of the same directory, only the directories
+    whose mtime changed are scanned again. The mtime of a directory changes
+    when files are created, deleted or renamed in it, not when a file is
+    written, so a file growing in place (e.g. a Postgres relation segment)
+    is only seen when its directory changes; take a full snapshot for that.
+    RocksDB/Pebble (CockroachDB) files are written once, the mtime is enough.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if jobs is None:
+        jobs = min(32, (os.cpu_count() or 1) + 4)
+    previous_dirs = previous.dirs if previous is not None else dict()
+    started_ns = time.time_ns()
+    dirs = dict()
+
+    if jobs <= 1:
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            state = scan_dir(dir_path, previous_dirs.get(dir_path), started_ns)
+            if state is not None:
+                dirs[dir_path] = state
+                stack.extend(os.path.join(dir_path, name) for name in state.subdirs)
+        return DirSnapshot(path, dirs)
+
+    # every scan submits the scans of the subdirectories, the snapshot is
+    # done when no scan is left
+    lock = threading.Lock()
+    remaining = 1
+    done = threading.Event()
+    errors = []
+
+    def scan(dir_path: str):
+        nonlocal remaining
+        try:
+            state = scan_dir(dir_path, previous_dirs.get(dir_path), started_ns)
+            if state is not None:
+                dirs[dir_path] = state
+                with lock:
+                    remaining += len(state.subdirs)
+                for name in state.subdirs:
+                    executor.submit(scan, os.path.join(dir_path, name))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with lock:
+                remaining -= 1
+                if remaining == 0:
+                    done.set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        executor.submit(scan, path)
+        done.wait()
+    if errors:
+        raise errors[0]
+    return DirSnapshot(path, dirs)
+
+
+def get_dir_size(path: str, allocated: bool = False, jobs: Optional[int] = None) -> int:
+    """
+    Return the total size of all files in the given directory.
+
+    Args:
+    - path: The directory.
+    - allocated: Return the bytes of the allocated blocks instead of the
+      apparent size (see DirSnapshot).
+    - jobs: The number of threads scanning the directories, see snapshot_dir().
+    """
+    snapshot = snapshot_dir(path, jobs=jobs)
+    return snapshot.allocated if allocated else snapshot.size
+
+
+class FileInfo:
+    size: int
+
+    def __init__(self, size: int):
+        self.size = size
+
+
+def get_file_info(file_path: str) -> FileInfo:
+    """
+    Return the file size of the given file.
+
+    Args:
+    - file_path: The path to the file.
+    """
+    return FileInfo(os.path.getsize(file_path))
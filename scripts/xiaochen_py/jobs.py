@@ -0,0 +1,392 @@
+# Background commands: JobManager and run_background.
+
+import logging
+import os
+import re
+import select
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, List, Mapping, Optional, Union
+
+from xiaochen_py.execution_config import command_context
+from xiaochen_py.output import LineSplitter
+from xiaochen_py.process import ProcessTreeSampler, process_group_alive, samples_path_of
+
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+
+
+class Waiter:
+    """
+    Sleep until a file changes, a process exits or the timeout expires, with
+    inotify and pidfd on Linux. Elsewhere (or if they are unavailable) it
+    sleeps with a growing interval, so a long wait never spins.
+    """
+
+    def __init__(self, pid: Optional[int] = None):
+        self.fds = list()
+        self.inotify_fd = -1
+        self.interval = 0.01
+        if pid is not None and pid > 0 and hasattr(os, "pidfd_open"):
+            try:
+                self.fds.append(os.pidfd_open(pid))
+            except OSError:
+                pass
+
+        try:
+            import ctypes
+
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            # IN_NONBLOCK | IN_CLOEXEC
+            self.inotify_fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            self.inotify_fd = -1
+        if self.inotify_fd >= 0:
+            self.fds.append(self.inotify_fd)
+
+    def watch(self, path: str, mask: int) -> bool:
+        """
+        Wake up on the inotify events of the path, return False if it can't be
+        watched.
+        """
+        if self.inotify_fd < 0:
+            return False
+        return self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(path), mask) >= 0
+
+    def wait(self, timeout: float):
+        if self.inotify_fd < 0 or not self.fds:
+            time.sleep(min(timeout, self.interval))
+            self.interval = min(self.interval * 2, 0.5)
+            return
+        readable, _, _ = select.select(self.fds, [], [], timeout)
+        if self.inotify_fd in readable:
+            try:
+                while os.read(self.inotify_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def sleep(self, timeout: float):
+        """
+        Sleep with a growing interval (for the waits without an event, e.g. a
+        port), wake up early if the process exits.
+        """
+        pid_fds = [fd for fd in self.fds if fd != self.inotify_fd]
+        timeout = min(timeout, self.interval)
+        self.interval = min(self.interval * 2, 0.5)
+        if pid_fds:
+            select.select(pid_fds, [], [], timeout)
+        else:
+            time.sleep(timeout)
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds.clear()
+
+
+class Job:
+    """
+    A background command started by JobManager, it runs in its own session
+    (so its process group includes all the processes started by the shell).
+    """
+
+    command: str
+    process: Optional[subprocess.Popen]
+    log_path: Optional[str]
+    returncode: Optional[int]
+    sampler: Optional[ProcessTreeSampler]
+
+    def __init__(
+        self,
+        command: str,
+        process: Optional[subprocess.Popen],
+        manager: Optional["JobManager"] = None,
+        log_path: Optional[str] = None,
+        sampler: Optional[ProcessTreeSampler] = None,
+    ):
+        self.command = command
+        self.process = process
+        self.manager = manager
+        self.log_path = log_path
+        self.returncode = None
+        self.sampler = sampler
+        self.start_time = time.time()
+        self.done = threading.Event()
+        if process is None:
+            # not started (dry run)
+            self.done.set()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid if self.process else -1
+
+    def running(self) -> bool:
+        return not self.done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Wait for the job to exit (it's reaped by the manager), return the exit
+        code, or None on timeout.
+        """
+        self.done.wait(timeout)
+        return self.returncode
+
+    def exit(self, timeout: Optional[float] = None):
+        """
+        Terminate the process group of the job, see JobManager.stop().
+        """
+        if self.manager is not None:
+            self.manager.stop([self], timeout)
+
+    def wait_for_file(self, path: str, timeout: float = 60.0) -> bool:
+        """
+        Wait for the file to exist (e.g. a socket or a pid file), return False
+        on timeout or if the job exited first.
+        """
+        return self._wait_until(lambda: os.path.exists(path), timeout, path)
+
+    def wait_for_port(self, port: int, host: str = "127.0.0.1", timeout: float = 60.0) -> bool:
+        """
+        Wait for the port to accept connections, return False on timeout or if
+        the job exited first.
+        """
+        import socket
+
+        def connectable():
+            try:
+                with socket.create_connection((host, port), timeout=1.0):
+                    return True
+            except OSError:
+                return False
+
+        return self._wait_until(connectable, timeout)
+
+    def wait_for_log_line(self, pattern: Union[str, bytes, re.Pattern], timeout: float = 60.0) -> bool:
+        """
+        Wait for a line of the log (from its beginning) to match the regex,
+        return False on timeout or if the job exited first.
+        """
+        if not self.log_path:
+            raise ValueError("the job has no log file")
+        if isinstance(pattern, str):
+            pattern = pattern.encode()
+        if isinstance(pattern, bytes):
+            pattern = re.compile(pattern)
+
+        matched = list()
+
+        def match_line(line: bytes):
+            if pattern.search(line):
+                matched.append(line)
+
+        splitter = LineSplitter([match_line])
+        with open(self.log_path, "rb") as log_file:
+
+            def read_lines():
+                chunk = log_file.read()
+                if chunk:
+                    splitter.feed(chunk, len(chunk))
+                return bool(matched)
+
+            return self._wait_until(read_lines, timeout, self.log_path, IN_MODIFY)
+
+    def _wait_until(
+        self,
+        condition: Callable[[], bool],
+        timeout: float,
+        path: Optional[str] = None,
+        mask: int = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE,
+    ) -> bool:
+        deadline = time.monotonic() + timeout
+        waiter = Waiter(self.pid)
+        try:
+            watching = False
+            if path is not None:
+                # a file to create is watched in its directory
+                target = path if mask == IN_MODIFY else os.path.dirname(os.path.abspath(path))
+                watching = waiter.watch(target, mask)
+            while True:
+                # the condition is checked once more after the job exits
+                exited = self.done.is_set() or (
+                    self.process is not None and self.process.poll() is not None
+                )
+                if condition():
+                    return True
+                remaining = deadline - time.monotonic()
+                if exited or remaining <= 0:
+                    logging.debug(f"job {self.pid} is not ready: {'exited' if exited else 'timeout'}")
+                    return False
+                if watching:
+                    waiter.wait(remaining)
+                else:
+                    waiter.sleep(remaining)
+        finally:
+            waiter.close()
+
+
+class JobManager:
+    """
+    Start background commands and keep their Popen handles: every job is
+    reaped by a thread as soon as it exits (so no zombie is left behind), and
+    stopped with its whole process group (a shell command's children
+    included).
+
+    It can be used as a context manager, all the jobs are stopped on exit.
+    """
+
+    def __init__(self, stop_timeout: float = 5.0):
+        self.stop_timeout = stop_timeout
+        self.jobs: List[Job] = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_all()
+
+    def start(
+        self,
+        command: str,
+        log_path: Optional[str] = None,
+        work_dir: Optional[str] = None,
+        sample_interval: Optional[float] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+    ) -> Job:
+        """
+        Run a shell command in the background, in a new session. The output
+        (stdout and stderr) is written to `log_path` if given.
+
+        If `sample_interval` is given, the process tree is sampled until the
+        job exits (see ProcessTreeSampler), the time series is written next
+        to `log_path`.
+
+        `work_dir` and `env` are applied on top of the execution config, see
+        run_command().
+        """
+        dry_run, cwd, command_env = command_context(work_dir, env)
+        if dry_run:
+            print(f"(dry run) command: {command}")
+            return Job(command, None, self, log_path)
+
+        print(f"running command in background: {command}")
+        if log_path:
+            with open(log_path, "w") as log_file:
+                process = subprocess.Popen(
+                    command,
+                    shell=True,
+                    stdout=log_file,
+                    stderr=log_file,
+                    cwd=cwd,
+                    env=command_env,
+                    start_new_session=True,
+                )
+        else:
+            process = subprocess.Popen(
+                command,
+                shell=True,
+                stdout=subprocess.DEVNULL,
+                cwd=cwd,
+                env=command_env,
+                start_new_session=True,
+            )
+
+        sampler = None
+        if sample_interval is not None and os.path.isdir("/proc"):
+            sampler = ProcessTreeSampler(
+                process.pid, sample_interval, samples_path_of(log_path) if log_path else None
+            )
+            sampler.start()
+
+        job = Job(command, process, self, log_path, sampler)
+        with self.lock:
+            self.jobs.append(job)
+        threading.Thread(target=self._reap, args=(job,), daemon=True).start()
+        return job
+
+    def _reap(self, job: Job):
+        job.returncode = job.process.wait()
+        if job.sampler:
+            job.sampler.stop()
+        logging.debug(f"job {job.pid} exited with code {job.returncode}: {job.command}")
+        with self.lock:
+            self.jobs.remove(job)
+        job.done.set()
+
+    def running_jobs(self) -> List[Job]:
+        with self.lock:
+            return list(self.jobs)
+
+    def stop(self, jobs: List[Job], timeout: Optional[float] = None):
+        """
+        Send SIGTERM to the process groups of the jobs, then SIGKILL to the
+        groups still alive after `timeout` seconds (defaults to
+        `stop_timeout`), and wait for the jobs to be reaped.
+        """
+        timeout = self.stop_timeout if timeout is None else timeout
+        groups = [job.pid for job in jobs if job.process is not None]
+        for pgid in groups:
+            try:
+                os.killpg(pgid, signal.SIGTERM)
+                logging.debug(f"sent SIGTERM to process group {pgid}")
+            except ProcessLookupError:
+                pass
+
+        # the children may outlive the leaders, so wait for the whole groups
+        deadline = time.monotonic() + timeout
+        alive = [pgid for pgid in groups if process_group_alive(pgid)]
+        waiter = Waiter()
+        while alive and time.monotonic() < deadline:
+            waiter.sleep(deadline - time.monotonic())
+            alive = [pgid for pgid in alive if process_group_alive(pgid)]
+        waiter.close()
+
+        for pgid in alive:
+            logging.debug(f"sending SIGKILL to process group {pgid}")
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for job in jobs:
+            job.wait()
+
+    def stop_all(self, timeout: Optional[float] = None):
+        self.stop(self.running_jobs(), timeout)
+
+
+# the manager of the jobs started by run_background()
+JOB_MANAGER = JobManager()
+
+# the jobs used to be plain processes
+Process = Job
+
+
+def run_background(
+    command: str,
+    log_path: Optional[str] = None,
+    work_dir: Optional[str] = None,
+    sample_interval: Optional[float] = None,
+    env: Optional[Mapping[str, Optional[str]]] = None,
+) -> Job:
+    """
+    Run a shell command in the background and return its job.
+
+    Args:
+        command (str): The shell command to execute.
+        log_path (Optional[str], optional): The file path where output will be written in real-time. If None, no file is written.
+        work_dir (Optional[str], optional): The directory to run the command in, see run_command().
+        sample_interval (Optional[float], optional): Seconds between the samples of the process tree, see
+                                                     run_command(). Defaults to None.
+        env (Optional[Mapping], optional): The variables set in the environment of the command, see
+                                           run_command(). Defaults to None.
+
+    Returns:
+        Job: The background job, stop it with "exit()".
+    """
+    return JOB_MANAGER.start(command, log_path, work_dir, sample_interval, env)
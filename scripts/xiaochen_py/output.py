@@ -0,0 +1,588 @@
+# Tee the output of a command to several writers, match it while streaming,
+# and keep a bounded capture of it (see run_command).
+
+import collections
+import errno
+import io
+import mmap
+import os
+import re
+import select
+import subprocess
+import tempfile
+import time
+from io import BufferedWriter
+from typing import IO, Callable, List, Optional, Union
+
+
+def tee_print(input_str: str, writers: List[IO]):
+    """
+    Write the given string to multiple writers simultaneously.
+
+    Args:
+    - input_str: The string to be written to the writers.
+    - writers: A list of file-like objects (e.g., sys.stdout, file, BytesIO) to write the output to.
+    """
+    if not input_str.endswith("\n"):
+        input_str += "\n"
+
+    for writer in writers:
+        if isinstance(writer, io.TextIOWrapper):
+            writer.write(input_str)
+        else:
+            # convert the str to bytes for binary writers
+            encoded_line = input_str.encode("utf-8")
+            writer.write(encoded_line)
+        writer.flush()
+
+
+# def tee_output(process, writers):
+def tee_output(
+    process: subprocess.Popen,
+    writers: List[IO],
+    line_callbacks: Optional[List[Callable[[bytes], None]]] = None,
+    chunk_callbacks: Optional[List[Callable[[bytes, int], None]]] = None,
+):
+    """
+    Capture the subprocess output, write it to multiple writers simultaneously.
+
+    Args:
+    - process: The subprocess.Popen object.
+    - writers: A list of file-like objects (e.g., sys.stdout, file, BytesIO) to write the output to.
+    - line_callbacks: Functions called with every line of the output.
+    - chunk_callbacks: Functions called with (buffer, size) for every piece of
+      the output, here every piece is a line.
+    """
+
+    # b"" indicates the end of the iteration.
+    # (The iteration stops when process.stdout.readline returns b"".)
+    for line in iter(process.stdout.readline, b""):
+        for writer in writers:
+            if isinstance(writer, io.TextIOWrapper):
+                writer.write(line.decode("utf-8"))
+            else:
+                writer.write(line)
+            writer.flush()  # Ensure the output appears immediately
+        if line_callbacks:
+            for callback in line_callbacks:
+                callback(line)
+        if chunk_callbacks:
+            for callback in chunk_callbacks:
+                callback(line, len(line))
+
+
+class PtyReader(io.RawIOBase):
+    """
+    The master side of a pseudo-terminal as a raw readable file, used as the
+    "stdout" of a process whose output goes to the pty (see run_command).
+
+    Linux reports EIO instead of EOF once every process closed the slave
+    side, it's turned into EOF so the tee functions stop normally.
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def readable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def readinto(self, buffer) -> int:
+        try:
+            return os.readv(self.fd, [buffer])
+        except OSError as e:
+            if e.errno == errno.EIO:
+                return 0
+            raise
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
+
+
+class LineSplitter:
+    """
+    Split a stream of chunks into lines and pass every complete line (including
+    the trailing b"\n") to the callbacks. The incomplete line at the end of a
+    chunk is kept until the next chunk arrives.
+    """
+
+    def __init__(self, callbacks: List[Callable[[bytes], None]]):
+        self.callbacks = callbacks
+        self.pending = bytearray()
+
+    def feed(self, buffer: bytearray, size: int):
+        """
+        Feed the first `size` bytes of `buffer`.
+        """
+        start = 0
+        while start < size:
+            end = buffer.find(b"\n", start, size)
+            if end == -1:
+                self.pending += buffer[start:size]
+                return
+
+            if self.pending:
+                self.pending += buffer[start : end + 1]
+                line = bytes(self.pending)
+                self.pending.clear()
+            else:
+                line = bytes(buffer[start : end + 1])
+
+            for callback in self.callbacks:
+                callback(line)
+            start = end + 1
+
+    def close(self):
+        """
+        Pass the last line which has no trailing b"\n".
+        """
+        if self.pending:
+            line = bytes(self.pending)
+            self.pending.clear()
+            for callback in self.callbacks:
+                callback(line)
+
+
+class OutputMatcher:
+    """
+    Search the patterns in a stream of chunks, the chunks are scanned only once
+    and a match across the chunk boundary is found as well.
+
+    - Literal patterns (str or bytes) are matched with an Aho-Corasick
+      automaton, its state is kept between chunks. While the automaton is in the
+      root state, a regex of the prefixes of the patterns skips to the next
+      candidate position, so the common case runs at C speed.
+    - Regex patterns (re.Pattern) are matched line by line, a line split by the
+      chunk boundary is matched once it's complete. Patterns compiled from str
+      are matched against the line decoded as UTF-8.
+
+    The matcher stops scanning after the first match.
+    """
+
+    matched: Optional[Union[str, bytes, re.Pattern]]
+
+    def __init__(self, patterns: List[Union[str, bytes, re.Pattern]]):
+        self.matched = None
+        self.literals = []
+        self.regexes = []
+        for pattern in patterns:
+            if isinstance(pattern, re.Pattern):
+                self.regexes.append(pattern)
+            elif isinstance(pattern, (str, bytes)):
+                if not pattern:
+                    raise ValueError("empty pattern")
+                self.literals.append(pattern)
+            else:
+                raise TypeError(f"unsupported pattern: {pattern!r}")
+
+        self.build_automaton()
+        self.state = 0
+
+        self.splitter = None
+        if self.regexes:
+            self.splitter = LineSplitter([self.match_line])
+
+    def build_automaton(self):
+        # state 0 is the root
+        # goto: transitions of every state, key: byte, value: next state
+        # fail: the longest proper suffix of the state that is also a state
+        # output: index of a literal that ends at the state (or its suffixes)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for i, literal in enumerate(self.literals):
+            if isinstance(literal, str):
+                literal = literal.encode("utf-8")
+            state = 0
+            for byte in literal:
+                if byte not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                    self.goto[state][byte] = len(self.goto) - 1
+                state = self.goto[state][byte]
+            if self.output[state] is None:
+                self.output[state] = i
+
+        # breadth-first, the fail state is always shallower than the state
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and byte not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(byte, 0)
+                if self.output[next_state] is None:
+                    self.output[next_state] = self.output[self.fail[next_state]]
+                queue.append(next_state)
+
+        # the prefilter finds where the first `prefix_length` bytes of any
+        # literal start, a match can't start anywhere else
+        self.prefilter = None
+        if self.literals:
+            encoded = [
+                l.encode("utf-8") if isinstance(l, str) else l for l in self.literals
+            ]
+            self.prefix_length = min(4, min(len(l) for l in encoded))
+            prefixes = sorted({l[: self.prefix_length] for l in encoded})
+            self.prefilter = re.compile(b"|".join(re.escape(p) for p in prefixes))
+
+    def feed(self, buffer: bytes, size: int):
+        """
+        Feed the first `size` bytes of `buffer`, return the matched pattern or
+        None.
+        """
+        if self.matched is not None:
+            return self.matched
+
+        if self.prefilter:
+            self.scan_literals(buffer, size)
+        if self.matched is None and self.splitter:
+            self.splitter.feed(buffer, size)
+        return self.matched
+
+    def scan_literals(self, buffer: bytes, size: int):
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = self.state
+        pos = 0
+        # a prefix may be cut by the end of the chunk, the automaton steps
+        # through the tail instead of skipping it
+        tail_start = size - self.prefix_length + 1
+        while pos < size:
+            if state == 0 and pos < tail_start:
+                match = self.prefilter.search(buffer, pos, size)
+                pos = match.start() if match else tail_start
+                if pos >= size:
+                    break
+
+            byte = buffer[pos]
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            if output[state] is not None:
+                self.matched = self.literals[output[state]]
+                break
+            pos += 1
+        self.state = state
+
+    def match_line(self, line: bytes):
+        if self.matched is not None:
+            return
+        text = None
+        for regex in self.regexes:
+            if isinstance(regex.pattern, str):
+                if text is None:
+                    text = line.decode("utf-8", errors="replace")
+                found = regex.search(text)
+            else:
+                found = regex.search(line)
+            if found:
+                self.matched = regex
+                return
+
+
+def tee_output_chunked(
+    process: subprocess.Popen,
+    writers: List[IO],
+    line_callbacks: Optional[List[Callable[[bytes], None]]] = None,
+    chunk_callbacks: Optional[List[Callable[[bytearray, int], None]]] = None,
+    chunk_size: int = 64 * 1024,
+    flush_interval: float = 0.1,
+    flush_size: int = 256 * 1024,
+):
+    """
+    Capture the subprocess output in large chunks, write it to multiple writers
+    simultaneously.
+
+    Unlike tee_output, the output is not split into lines. Every chunk is read
+    into a reused buffer and the same memoryview is written to all writers,
+    text writers get it through their underlying binary buffer so nothing is
+    decoded. Writers are flushed once `flush_size` bytes are pending or
+    `flush_interval` seconds have passed, instead of after every line.
+
+    Args:
+    - process: The subprocess.Popen object.
+    - writers: A list of file-like objects (e.g., sys.stdout, file, BytesIO) to write the output to.
+    - line_callbacks: Functions called with every line of the output, for the
+      consumers that need line-oriented output.
+    - chunk_callbacks: Functions called with (buffer, size) for every chunk,
+      only the first `size` bytes of the reused buffer are valid.
+    - chunk_size: The size of the read buffer.
+    - flush_interval: The max seconds that written data stays unflushed.
+    - flush_size: The max bytes that written data stays unflushed.
+    """
+    sinks = []
+    for writer in writers:
+        if isinstance(writer, io.TextIOWrapper):
+            # write bytes to the underlying buffer, the pending text must go
+            # first to keep the order
+            writer.flush()
+            sinks.append(writer.buffer)
+        else:
+            sinks.append(writer)
+
+    splitter = None
+    if line_callbacks:
+        splitter = LineSplitter(line_callbacks)
+
+    fd = process.stdout.fileno()
+    if isinstance(process.stdout, PtyReader):
+        readinto = process.stdout.readinto
+    else:
+        # read the file descriptor directly, bypassing any buffer of stdout
+        def readinto(buffer) -> int:
+            return os.readv(fd, [buffer])
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    pending = 0
+    last_flush = time.monotonic()
+
+    def flush():
+        nonlocal pending, last_flush
+        for sink in sinks:
+            sink.flush()
+        pending = 0
+        last_flush = time.monotonic()
+
+    while True:
+        if pending:
+            # wake up in time to flush the pending data even if the process
+            # prints nothing more
+            timeout = max(0.0, last_flush + flush_interval - time.monotonic())
+            readable, _, _ = select.select([fd], [], [], timeout)
+            if not readable:
+                flush()
+                continue
+
+        size = readinto(view)
+        if not size:
+            break
+
+        chunk = view[:size]
+        for sink in sinks:
+            sink.write(chunk)
+        if splitter:
+            splitter.feed(buffer, size)
+        if chunk_callbacks:
+            for callback in chunk_callbacks:
+                callback(buffer, size)
+
+        pending += size
+        if pending >= flush_size or time.monotonic() - last_flush >= flush_interval:
+            flush()
+
+    if splitter:
+        splitter.close()
+    flush()
+
+
+# The size of the output tail kept for CalledProcessError when the output is
+# not captured.
+ERROR_TAIL_SIZE = 64 * 1024
+
+
+class RingBuffer:
+    """
+    Keep the last `size` bytes written to it.
+    """
+
+    size: int
+    total: int
+
+    def __init__(self, size: int):
+        if size <= 0:
+            raise ValueError(f"the size of a ring buffer must be positive: {size}")
+        self.size = size
+        self.total = 0
+        self.buffer = bytearray(size)
+        self.pos = 0
+
+    def write(self, data) -> int:
+        data = memoryview(data).cast("B")
+        n = len(data)
+        self.total += n
+        if n >= self.size:
+            self.buffer[:] = data[n - self.size :]
+            self.pos = 0
+            return n
+
+        first = min(n, self.size - self.pos)
+        self.buffer[self.pos : self.pos + first] = data[:first]
+        if first < n:
+            self.buffer[: n - first] = data[first:]
+        self.pos = (self.pos + n) % self.size
+        return n
+
+    def flush(self):
+        pass
+
+    def getvalue(self, n: Optional[int] = None) -> bytes:
+        """
+        Return the last `n` bytes (all the kept bytes if `n` is None).
+        """
+        kept = min(self.total, self.size)
+        if n is None or n > kept:
+            n = kept
+        start = (self.pos - n) % self.size
+        if start + n <= self.size:
+            return bytes(self.buffer[start : start + n])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[: self.pos])
+
+
+class FullCapture:
+    """
+    Keep the whole output in memory.
+    """
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.writer = BufferedWriter(self.buffer, buffer_size=1000)
+
+    def write(self, data) -> int:
+        return self.writer.write(data)
+
+    def flush(self):
+        self.writer.flush()
+
+    def getvalue(self) -> bytes:
+        self.writer.flush()
+        return self.buffer.getvalue()
+
+    def error_output(self) -> bytes:
+        return self.getvalue()
+
+
+class HeadTailCapture:
+    """
+    Keep the first `head_size` bytes and the last `tail_size` bytes of the
+    output, the bytes in between are replaced by a marker line.
+    """
+
+    def __init__(self, head_size: int, tail_size: int):
+        if head_size < 0 or tail_size <= 0:
+            raise ValueError(f"invalid head and tail sizes: {head_size}, {tail_size}")
+        self.head_size = head_size
+        self.head = bytearray()
+        self.tail = RingBuffer(tail_size)
+
+    def write(self, data) -> int:
+        if len(self.head) < self.head_size:
+            self.head += memoryview(data)[: self.head_size - len(self.head)]
+        return self.tail.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        total = self.tail.total
+        if total <= self.head_size:
+            return bytes(self.head)
+
+        rest = total - self.head_size
+        if rest <= self.tail.size:
+            return bytes(self.head) + self.tail.getvalue(rest)
+
+        omitted = rest - self.tail.size
+        marker = f"\n... ({omitted} bytes omitted) ...\n".encode("utf-8")
+        return bytes(self.head) + marker + self.tail.getvalue()
+
+    def error_output(self) -> bytes:
+        return self.getvalue()
+
+
+class SpillCapture:
+    """
+    Keep the output in memory until it exceeds `threshold` bytes, then move it
+    to a temporary file. The result of a spilled capture is a read-only mmap of
+    the file, which is paged in by the kernel on demand.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.buffer = io.BytesIO()
+        self.file = None
+
+    def write(self, data) -> int:
+        if self.file:
+            return self.file.write(data)
+
+        n = self.buffer.write(data)
+        if self.buffer.tell() > self.threshold:
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.buffer.getbuffer())
+            self.buffer = None
+        return n
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def getvalue(self):
+        if not self.file:
+            return self.buffer.getvalue()
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def error_output(self) -> bytes:
+        if not self.file:
+            return self.buffer.getvalue()
+        self.file.flush()
+        size = self.file.tell()
+        self.file.seek(max(0, size - self.threshold))
+        tail = self.file.read()
+        self.file.seek(size)
+        return tail
+
+
+class NoCapture:
+    """
+    Discard the output, only a small tail is kept for the error message.
+    """
+
+    def __init__(self):
+        self.tail = RingBuffer(ERROR_TAIL_SIZE)
+
+    def write(self, data) -> int:
+        return self.tail.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        return bytes()
+
+    def error_output(self) -> bytes:
+        return self.tail.getvalue()
+
+
+def new_capture(capture: str, capture_limit: int):
+    """
+    Create the writer that captures the output of run_command.
+
+    Args:
+    - capture: The capture policy, one of "full", "head_tail", "spill" and "none".
+    - capture_limit: The max bytes kept in memory by "head_tail" and "spill".
+    """
+    # checked before the command runs, not when its output is read
+    if capture_limit <= 0:
+        raise ValueError(f"capture_limit must be positive: {capture_limit}")
+    if capture == "full":
+        return FullCapture()
+    if capture == "head_tail":
+        # the tail always gets at least 1 byte
+        head_size = capture_limit // 4
+        return HeadTailCapture(head_size, capture_limit - head_size)
+    if capture == "spill":
+        return SpillCapture(capture_limit)
+    if capture == "none":
+        return NoCapture()
+    raise ValueError(f"unknown capture policy: {capture}")
@@ -0,0 +1,561 @@
+# Process groups, resource usage and /proc sampling of the process tree of a
+# command.
+
+import array
+import collections
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+def process_group_alive(pgid: int) -> bool:
+    """
+    Return True if any process of the process group is alive.
+    """
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def terminate_process_group(
+    process: subprocess.Popen,
+    grace_period: float = 1.0,
+    kill_timeout: float = 5.0,
+    reaped: Optional[threading.Event] = None,
+):
+    """
+    Wait `grace_period` seconds, then send SIGTERM to the process group of the
+    process, send SIGKILL if any process of the group is still alive after
+    `kill_timeout` seconds.
+
+    The process must be the leader of its process group (e.g. started with
+    "start_new_session=True"), otherwise the caller's group is killed.
+
+    If another thread reaps the process (e.g. with wait_with_usage), it sets
+    `reaped` afterwards, the process is not waited for here.
+    """
+
+    def wait(timeout: Optional[float] = None):
+        if reaped is not None:
+            reaped.wait(timeout)
+            return
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            pass
+
+    wait(grace_period)
+
+    pgid = process.pid
+    if not process_group_alive(pgid):
+        return
+
+    logging.debug(f"sending SIGTERM to process group {pgid}")
+    os.killpg(pgid, signal.SIGTERM)
+
+    # the children may outlive the leader, so wait for the whole group
+    deadline = time.monotonic() + kill_timeout
+    while time.monotonic() < deadline:
+        if reaped is None:
+            process.poll()
+        if not process_group_alive(pgid):
+            return
+        time.sleep(0.05)
+
+    logging.debug(f"sending SIGKILL to process group {pgid}")
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    wait()
+
+
+def read_process_io(pid: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Return tuple(rchar, wchar, read_bytes, write_bytes) from /proc/<pid>/io,
+    None if it can't be read (the process is gone, or not Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # rchar, wchar, syscr, syscw, read_bytes, write_bytes, cancelled_write_bytes
+    values = [int(line.split()[1]) for line in data.splitlines()]
+    return values[0], values[1], values[4], values[5]
+
+
+def list_parents() -> dict[int, int]:
+    """
+    Return the parent pid of every process, from /proc/<pid>/stat.
+    """
+    parents = dict()
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name is in parentheses and may contain anything
+        parents[int(name)] = int(stat[stat.rindex(b")") + 2 :].split(None, 2)[1])
+    return parents
+
+
+def process_tree(pid: int, parents: dict[int, int]) -> List[int]:
+    """
+    Return the pid and the pids of all its descendants.
+    """
+    children = collections.defaultdict(list)
+    for child, parent in parents.items():
+        children[parent].append(child)
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, ()))
+    return tree
+
+
+class ProcessTreeIO:
+    """
+    Sample /proc/<pid>/io of the descendants of a process in a thread.
+
+    The kernel adds the I/O of a reaped child to its parent, so the I/O of the
+    whole tree is the I/O of the root (read before the root is reaped), plus
+    the I/O of the descendants that were orphaned (re-parented out of the
+    tree, e.g. daemons), which are never reaped by the tree. Only those need
+    the samples.
+    """
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.tree = set()
+        self.orphans = set()
+        self.last_io = dict()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        parents = list_parents()
+        tree = set(process_tree(self.pid, parents))
+        # alive, but not in the tree any more
+        self.orphans.update(p for p in self.tree - tree if p in parents)
+        self.tree = tree
+        for p in self.orphans:
+            io = read_process_io(p)
+            if io is not None:
+                self.last_io[p] = io
+
+    def stop(self, root_io: Optional[Tuple[int, ...]]) -> Optional[Tuple[int, ...]]:
+        """
+        Stop sampling, return the I/O of the tree given the I/O of the root.
+        """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if root_io is None:
+            return None
+        # the descendants still alive when the root exited are orphaned too,
+        # the ones started and orphaned between two samples are missed
+        self.orphans.update(p for p in self.tree - {self.pid} if read_process_io(p) is not None)
+        total = list(root_io)
+        for p in self.orphans:
+            io = read_process_io(p) or self.last_io.get(p)
+            if io is not None:
+                total = [a + b for a, b in zip(total, io)]
+        return tuple(total)
+
+
+def wait_with_usage(process: subprocess.Popen):
+    """
+    Wait for the process like process.wait(), return tuple(rusage, /proc I/O)
+    of it and the descendants it waited for, (None, None) if it was reaped
+    before.
+
+    The process is reaped here with os.wait4 and its returncode is set
+    afterwards, no other thread may wait for it until this returns (with
+    Popen.wait(), poll(), or send_signal() and kill() which poll first), see
+    the `reaped` event of terminate_process_group.
+    """
+    if process.returncode is not None:
+        return None, None
+
+    io = None
+    if hasattr(os, "waitid"):
+        # wait for the exit without reaping, the I/O of a zombie is still
+        # readable (including the I/O of its reaped children)
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            process.wait()
+            return None, None
+        io = read_process_io(process.pid)
+
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # reaped by someone else, process.wait() sets the returncode (0 if
+        # it wasn't reaped through the Popen, like Popen itself does)
+        process.wait()
+        return None, None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage, io
+
+
+class ResourceUsage:
+    """
+    The resources used by a command: CPU time, max RSS and context switches of
+    the command and the descendants it waited for (rusage), and the I/O of
+    the process tree (None if /proc is not available).
+    """
+
+    # wall time in seconds
+    duration: float
+    # CPU time in seconds
+    user_time: float
+    system_time: float
+    # KiB, the largest of the processes
+    max_rss: int
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+    # bytes passed to read()/write() (including the page cache)
+    read_chars: Optional[int]
+    write_chars: Optional[int]
+    # bytes read from/written to the storage
+    read_bytes: Optional[int]
+    write_bytes: Optional[int]
+
+    def __init__(self, duration: float, rusage=None, io: Optional[Tuple[int, ...]] = None):
+        self.duration = duration
+        self.user_time = rusage.ru_utime if rusage else 0.0
+        self.system_time = rusage.ru_stime if rusage else 0.0
+        self.max_rss = rusage.ru_maxrss if rusage else 0
+        self.voluntary_context_switches = rusage.ru_nvcsw if rusage else 0
+        self.involuntary_context_switches = rusage.ru_nivcsw if rusage else 0
+        self.read_chars, self.write_chars, self.read_bytes, self.write_bytes = (
+            io if io is not None else (None, None, None, None)
+        )
+
+    def to_dict(self, prefix: str = "") -> dict[str, object]:
+        """
+        Return the fields as a dict, e.g. for BenchmarkRecord.test_result.
+        """
+        return {f"{prefix}{key}": value for key, value in self.__dict__.items()}
+
+    def __repr__(self):
+        text = (
+            f"wall {self.duration:.2f}s, user {self.user_time:.2f}s, sys {self.system_time:.2f}s,"
+            f" max RSS {self.max_rss / 1024:.1f} MiB, context switches"
+            f" {self.voluntary_context_switches}/{self.involuntary_context_switches}"
+        )
+        if self.read_bytes is not None:
+            text += (
+                f", read {self.read_bytes / 1024 / 1024:.1f} MiB,"
+                f" written {self.write_bytes / 1024 / 1024:.1f} MiB"
+            )
+        return text
+
+
+SAMPLES_FORMAT = "xc-process-samples/1"
+
+
+def samples_path_of(log_path: str) -> str:
+    """
+    Return the path of the time series written next to a log file.
+    """
+    return log_path + ".samples"
+
+
+class ProcessTreeSampler:
+    """
+    Sample the CPU usage, RSS, threads and open file descriptors of a process
+    and all its descendants in a thread, every `interval` seconds.
+
+    The samples are kept in a columnar time series, one array per column (see
+    COLUMNS), one row per sample with the sums over the tree:
+    - time: seconds since the sampler started.
+    - cpu_percent: CPU usage since the previous sample, 100 is one core.
+    - rss: bytes.
+
+    The tree is tracked incrementally: only the processes started since the
+    previous sample are looked up (a new descendant's parent is in the tree),
+    then the stat of the tree members is read. Listing /proc costs more than
+    the rest of a sample on a busy machine, so it's skipped when only a few
+    pids were allocated since the previous sample (the last one is in
+    /proc/loadavg), those pids are probed one by one instead. The stat files
+    of the tree are kept open and read again with pread(), a reaped process
+    fails with ESRCH, even if its pid is reused. The pids are kept as bytes,
+    like the fields of the stat files.
+
+    `overhead` is the CPU time of the sampler thread divided by the wall time.
+    """
+
+    COLUMNS = (
+        ("time", "d"),
+        ("processes", "I"),
+        ("cpu_percent", "f"),
+        ("rss", "Q"),
+        ("threads", "I"),
+        ("fds", "I"),
+    )
+    # probe at most this many new pids, list /proc otherwise
+    PROBE_LIMIT = 64
+    STATUS_PATTERN = re.compile(rb"\nTgid:\t(\d+)\n.*?\nPPid:\t(\d+)\n", re.DOTALL)
+
+    def __init__(self, pid: int, interval: float = 0.1, path: Optional[str] = None):
+        self.pid = pid
+        self.interval = interval
+        self.path = path
+        self.columns = {name: array.array(typecode) for name, typecode in self.COLUMNS}
+        self.root = str(pid).encode()
+        self.tree = {self.root}
+        # the pids known not to be in the tree (and the other entries of /proc)
+        self.outside = set()
+        # the descendants are started after the root (until the pids wrap around)
+        self.last_pid = pid
+        self.stat_fds = dict()
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.last_ticks = 0
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def overhead(self) -> float:
+        return self.cpu_time / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def peak_rss(self) -> int:
+        return max(self.columns["rss"], default=0)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        start_cpu = time.thread_time()
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except OSError as e:
+                logging.debug(f"failed to sample process {self.pid}: {e}")
+        for fd in self.stat_fds.values():
+            os.close(fd)
+        self.stat_fds.clear()
+        self.cpu_time = time.thread_time() - start_cpu
+        self.wall_time = time.monotonic() - self.start_time
+
+    @staticmethod
+    def read_head(path: bytes) -> Optional[bytes]:
+        """
+        Return the first 512 bytes of a /proc file, None if the process is
+        gone. Cheaper than open(), which sets up a buffered reader.
+        """
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            return os.read(fd, 512)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def parse_stat(stat: bytes) -> List[bytes]:
+        """
+        Return the fields of /proc/<pid>/stat after the command name (the
+        first one is the state).
+        """
+        # the command name is in parentheses and may contain anything
+        return stat[stat.rindex(b")") + 2 :].split()
+
+    def read_stat(self, pid: bytes) -> Optional[List[bytes]]:
+        """
+        Return the stat fields of a tree member, None if it's gone.
+        """
+        fd = self.stat_fds.get(pid)
+        try:
+            if fd is None:
+                fd = self.stat_fds[pid] = os.open(b"/proc/" + pid + b"/stat", os.O_RDONLY)
+            stat = os.pread(fd, 512, 0)
+        except OSError:
+            stat = None
+        if not stat:
+            self.forget(pid)
+            return None
+        return self.parse_stat(stat)
+
+    def forget(self, pid: bytes):
+        self.tree.discard(pid)
+        fd = self.stat_fds.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+
+    def new_processes(self) -> dict[bytes, bytes]:
+        """
+        Return the parent pid of every process started since the previous
+        sample.
+        """
+        parents = dict()
+        last_pid = int(self.read_head(b"/proc/loadavg").split()[-1])
+        previous, self.last_pid = self.last_pid, last_pid
+        if 0 <= last_pid - previous <= self.PROBE_LIMIT:
+            # pids are allocated in increasing order until they wrap around,
+            # the new ones may be threads, which are not listed in /proc
+            for pid in range(previous + 1, last_pid + 1):
+                pid = str(pid).encode()
+                self.outside.discard(pid)
+                status = self.read_head(b"/proc/" + pid + b"/status")
+                match = status and self.STATUS_PATTERN.search(status)
+                if match and match[1] == pid:
+                    parents[pid] = match[2]
+            return parents
+
+        pids = set(os.listdir(b"/proc"))
+        self.outside &= pids
+        for pid in pids - self.tree - self.outside:
+            stat = self.read_head(b"/proc/" + pid + b"/stat") if pid.isdigit() else None
+            if stat:
+                parents[pid] = self.parse_stat(stat)[1]
+            else:
+                self.outside.add(pid)
+        return parents
+
+    def sample(self):
+        now = time.monotonic()
+        new = self.new_processes()
+        # the parent of a new descendant may be new too
+        added = True
+        while added:
+            added = False
+            for pid, ppid in list(new.items()):
+                if ppid in self.tree:
+                    self.tree.add(pid)
+                    del new[pid]
+                    added = True
+        self.outside.update(new)
+
+        processes = ticks = rss = threads = fds = 0
+        for pid in list(self.tree):
+            stat = self.read_stat(pid)
+            if stat is None:
+                continue
+            if pid != self.root and stat[1] not in self.tree:
+                # orphaned, re-parented out of the tree
+                self.forget(pid)
+                self.outside.add(pid)
+                continue
+            processes += 1
+            # utime, stime, and cutime, cstime of the reaped children
+            ticks += int(stat[11]) + int(stat[12]) + int(stat[13]) + int(stat[14])
+            threads += int(stat[17])
+            rss += int(stat[21]) * self.page_size
+            try:
+                # the size is the number of fds since Linux 6.2, 0 before
+                fds += os.stat(b"/proc/" + pid + b"/fd").st_size or len(
+                    os.listdir(b"/proc/" + pid + b"/fd")
+                )
+            except OSError:
+                pass
+
+        # the ticks of a process that left the tree are lost
+        cpu_percent = max(ticks - self.last_ticks, 0) / self.clock_ticks / (now - self.last_time) * 100
+        self.last_ticks = ticks
+        self.last_time = now
+
+        columns = self.columns
+        columns["time"].append(now - self.start_time)
+        columns["processes"].append(processes)
+        columns["cpu_percent"].append(cpu_percent)
+        columns["rss"].append(rss)
+        columns["threads"].append(threads)
+        columns["fds"].append(fds)
+
+    def stop(self):
+        """
+        Stop sampling, and write the time series to `path` if given.
+        """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.path:
+            self.save(self.path)
+        logging.debug(f"process tree samples: {self}")
+
+    def save(self, path: str):
+        """
+        Write a JSON header line, then the raw bytes of every column (see
+        load_samples()).
+        """
+        header = {
+            "format": SAMPLES_FORMAT,
+            "pid": self.pid,
+            "interval": self.interval,
+            "overhead": self.overhead,
+            "byteorder": sys.byteorder,
+            "rows": len(self.columns["time"]),
+            "columns": [[name, typecode] for name, typecode in self.COLUMNS],
+        }
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for column in self.columns.values():
+                column.tofile(f)
+
+    def __repr__(self):
+        columns = self.columns
+        return (
+            f"{len(columns['time'])} samples, peak RSS {self.peak_rss / 1024 / 1024:.1f} MiB,"
+            f" max CPU {max(columns['cpu_percent'], default=0):.0f}%,"
+            f" max threads {max(columns['threads'], default=0)},"
+            f" max fds {max(columns['fds'], default=0)}, overhead {self.overhead * 100:.2f}%"
+        )
+
+
+def load_samples(path: str) -> Tuple[dict, dict[str, array.array]]:
+    """
+    Read a time series written by ProcessTreeSampler, return tuple(header,
+    columns).
+    """
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != SAMPLES_FORMAT:
+            raise ValueError(f"not a process samples file: {path}")
+        columns = dict()
+        for name, typecode in header["columns"]:
+            column = array.array(typecode)
+            column.fromfile(f, header["rows"])
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+    return header, columns
+
+
+def process_stopped(process: subprocess.Popen):
+    status = process.poll()
+    if status is None:
+        return False
+    else:
+        logging.debug(f"Process finished with exit code {status}")
+        return True
@@ -0,0 +1,407 @@
+# Detect regressions between the benchmark records of a baseline and a
+# candidate (see BenchmarkStore).
+#
+# The records are grouped by their target attributes, for every numeric
+# metric of test_result the median and p95 of both sides are compared, and a
+# bootstrap confidence interval of the change of the median tells if the
+# change is significant. NumPy is used if it's installed, the statistics and
+# random modules otherwise (same results for the median and p95, the
+# bootstrap draws differ). The bootstrap medians are drawn directly (see
+# resampled_medians()), so a comparison costs O(n log n + resamples).
+#
+# Usage:
+#   python3 -m xiaochen_py.regression STORE --split TIME
+#   python3 -m xiaochen_py.regression STORE --attribute KEY BASELINE CANDIDATE
+#
+# The exit code is 0 without regression, 1 with a regression, 3 if no group
+# has records on both sides (2 is a usage error).
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from xiaochen_py.benchmark import BenchmarkRecord, BenchmarkStore, config_key
+
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_NO_DATA = 3
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """
+    Return the q-quantile with linear interpolation between the closest
+    ranks, like numpy.quantile() (and statistics.quantiles(method="inclusive")).
+    """
+    position = q * (len(sorted_values) - 1)
+    low = math.floor(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    fraction = position - low
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * fraction
+
+
+class Summary:
+    count: int
+    median: float
+    p95: float
+
+    def __init__(self, values: List[float]):
+        self.count = len(values)
+        if numpy is not None:
+            self.median, self.p95 = (float(x) for x in numpy.quantile(values, [0.5, 0.95]))
+        else:
+            sorted_values = sorted(values)
+            self.median = statistics.median(sorted_values)
+            self.p95 = quantile(sorted_values, 0.95)
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def resampled_medians(sorted_values: List[float], resamples: int, rng) -> List[float]:
+    """
+    Return the medians of `resamples` bootstrap resamples of the values
+    (drawn with replacement, the same size), without drawing the resamples.
+
+    A resample is n indices floor(n * U) of n uniform U, so its k-th smallest
+    value is sorted_values[floor(n * U(k))], where U(k), the k-th smallest of
+    n uniforms, follows Beta(k, n - k + 1). The next one is U(k) plus the
+    smallest of the n - k uniforms above it: U(k) + (1 - U(k)) * Beta(1, n - k).
+    So a median costs one or two beta variates instead of n draws.
+
+    `rng` is a numpy Generator (the medians are an array) or a random.Random.
+    """
+    n = len(sorted_values)
+    k = (n + 1) // 2
+    if numpy is not None and not isinstance(rng, random.Random):
+        values = numpy.asarray(sorted_values, dtype=float)
+        u = rng.beta(k, n - k + 1, resamples)
+        medians = values[numpy.minimum((u * n).astype(int), n - 1)]
+        if n % 2 == 0:
+            u = u + (1 - u) * rng.beta(1, n - k, resamples)
+            medians = (medians + values[numpy.minimum((u * n).astype(int), n - 1)]) / 2
+        return medians
+
+    medians = []
+    for _ in range(resamples):
+        u = rng.betavariate(k, n - k + 1)
+        median = sorted_values[min(int(u * n), n - 1)]
+        if n % 2 == 0:
+            u += (1 - u) * rng.betavariate(1, n - k)
+            median = (median + sorted_values[min(int(u * n), n - 1)]) / 2
+        medians.append(median)
+    return medians
+
+
+def bootstrap_difference(
+    baseline: List[float], candidate: List[float], confidence: float, resamples: int, seed: int
+) -> Tuple[float, float]:
+    """
+    Return the percentile bootstrap confidence interval of the difference of
+    the medians (candidate - baseline).
+    """
+    alpha = 1 - confidence
+    baseline = sorted(baseline)
+    candidate = sorted(candidate)
+    if numpy is not None:
+        rng = numpy.random.default_rng(seed)
+        differences = resampled_medians(candidate, resamples, rng) - resampled_medians(
+            baseline, resamples, rng
+        )
+        low, high = numpy.quantile(differences, [alpha / 2, 1 - alpha / 2])
+        return float(low), float(high)
+
+    rng = random.Random(seed)
+    candidate_medians = resampled_medians(candidate, resamples, rng)
+    baseline_medians = resampled_medians(baseline, resamples, rng)
+    differences = sorted(c - b for c, b in zip(candidate_medians, baseline_medians))
+    return quantile(differences, alpha / 2), quantile(differences, 1 - alpha / 2)
+
+
+class Comparison:
+    """
+    The comparison of one metric of one group. The change and its confidence
+    interval are relative to the baseline median (0.1 is 10% more).
+    """
+
+    group: dict
+    metric: str
+    baseline: Summary
+    candidate: Summary
+    change: float
+    change_low: Optional[float]
+    change_high: Optional[float]
+    higher_is_better: bool
+    # "regression", "improvement", "unchanged", or "insufficient" (less than
+    # 2 records on a side, no confidence interval)
+    verdict: str
+
+    def __init__(
+        self,
+        group: dict,
+        metric: str,
+        baseline: List[float],
+        candidate: List[float],
+        higher_is_better: bool,
+        threshold: float,
+        confidence: float,
+        resamples: int,
+        seed: int,
+    ):
+        self.group = group
+        self.metric = metric
+        self.baseline = Summary(baseline)
+        self.candidate = Summary(candidate)
+        self.higher_is_better = higher_is_better
+
+        scale = abs(self.baseline.median)
+        difference = self.candidate.median - self.baseline.median
+        if scale:
+            self.change = difference / scale
+        else:
+            self.change = 0.0 if difference == 0 else math.copysign(math.inf, difference)
+
+        self.change_low = self.change_high = None
+        if len(baseline) < 2 or len(candidate) < 2:
+            self.verdict = "insufficient"
+            return
+        low, high = bootstrap_difference(baseline, candidate, confidence, resamples, seed)
+        if scale:
+            self.change_low, self.change_high = low / scale, high / scale
+        else:
+            self.change_low, self.change_high = low, high
+
+        # significant: the interval doesn't include 0, and large enough
+        worse = -self.change if higher_is_better else self.change
+        if self.change_low > 0 or self.change_high < 0:
+            if worse >= threshold:
+                self.verdict = "regression"
+                return
+            if -worse >= threshold:
+                self.verdict = "improvement"
+                return
+        self.verdict = "unchanged"
+
+    def to_dict(self) -> dict:
+        """
+        Return the comparison as a JSON-compatible dict, the infinite change
+        of a zero baseline (not valid JSON) is None.
+        """
+        result = {key: finite_or_none(value) for key, value in self.__dict__.items()}
+        result["baseline"] = {
+            key: finite_or_none(value) for key, value in self.baseline.to_dict().items()
+        }
+        result["candidate"] = {
+            key: finite_or_none(value) for key, value in self.candidate.to_dict().items()
+        }
+        return result
+
+    def __repr__(self):
+        interval = ""
+        if self.change_low is not None:
+            interval = f" [{self.change_low * 100:+.1f}%, {self.change_high * 100:+.1f}%]"
+        return (
+            f"{self.verdict:<12} {self.metric}: median {self.baseline.median:.4g} -> "
+            f"{self.candidate.median:.4g} ({self.change * 100:+.1f}%{interval}),"
+            f" p95 {self.baseline.p95:.4g} -> {self.candidate.p95:.4g},"
+            f" n {self.baseline.count} -> {self.candidate.count}"
+        )
+
+
+def finite_or_none(value):
+    """
+    Return None for an infinite or NaN float, the value otherwise.
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def numeric_metrics(records: List[BenchmarkRecord]) -> Dict[str, List[float]]:
+    """
+    Return the values of every numeric metric in the test results.
+    """
+    metrics = dict()
+    for record in records:
+        for name, value in (getattr(record, "test_result", None) or dict()).items():
+            # bool is an int
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics.setdefault(name, []).append(float(value))
+    return metrics
+
+
+def group_records(
+    records: List[BenchmarkRecord], ignored_key: Optional[str] = None
+) -> Dict[str, Tuple[dict, List[BenchmarkRecord]]]:
+    """
+    Group the records by target attributes (without `ignored_key`).
+
+    key: config_key() of the attributes
+    value: tuple(attributes, records)
+    """
+    groups = dict()
+    for record in records:
+        attributes = dict(getattr(record, "target_attributes", None) or dict())
+        attributes.pop(ignored_key, None)
+        key = config_key(attributes)
+        if key not in groups:
+            groups[key] = (attributes, [])
+        groups[key][1].append(record)
+    return groups
+
+
+def compare(
+    baseline: List[BenchmarkRecord],
+    candidate: List[BenchmarkRecord],
+    ignored_key: Optional[str] = None,
+    metrics: Optional[List[str]] = None,
+    higher_is_better: Tuple[str, ...] = (),
+    threshold: float = 0.05,
+    confidence: float = 0.95,
+    resamples: int = 2000,
+    seed: int = 0,
+) -> List[Comparison]:
+    """
+    Compare every metric of every group that has records on both sides.
+
+    Args:
+    - ignored_key: The target attribute that differs between the baseline
+      and the candidate (e.g. the version), not used to group.
+    - metrics: The metrics to compare, all the numeric ones by default.
+    - higher_is_better: The metrics that regress when they decrease (e.g.
+      throughput), the others regress when they increase (e.g. latency).
+    - threshold: The min relative change of the median to report.
+    """
+    baseline_groups = group_records(baseline, ignored_key)
+    candidate_groups = group_records(candidate, ignored_key)
+    comparisons = []
+    for key in sorted(baseline_groups.keys() & candidate_groups.keys()):
+        attributes, baseline_records = baseline_groups[key]
+        baseline_metrics = numeric_metrics(baseline_records)
+        candidate_metrics = numeric_metrics(candidate_groups[key][1])
+        for name in sorted(baseline_metrics.keys() & candidate_metrics.keys()):
+            if metrics and name not in metrics:
+                continue
+            comparisons.append(
+                Comparison(
+                    attributes,
+                    name,
+                    baseline_metrics[name],
+                    candidate_metrics[name],
+                    name in higher_is_better,
+                    threshold,
+                    confidence,
+                    resamples,
+                    seed,
+                )
+            )
+    return comparisons
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m xiaochen_py.regression",
+        description="Compare the benchmark records of a baseline and a candidate.",
+    )
+    parser.add_argument("store", help="the benchmark store (see BenchmarkStore)")
+    side = parser.add_mutually_exclusive_group(required=True)
+    side.add_argument(
+        "--split",
+        metavar="TIME",
+        help="the records before TIME (ISO 8601) are the baseline, the others the candidate",
+    )
+    side.add_argument(
+        "--attribute",
+        nargs=3,
+        metavar=("KEY", "BASELINE", "CANDIDATE"),
+        help="the records with the target attribute KEY equal to BASELINE (JSON, or a string)"
+        " are the baseline, to CANDIDATE the candidate",
+    )
+    parser.add_argument("--since", help="ignore the records before this time")
+    parser.add_argument("--until", help="ignore the records from this time")
+    parser.add_argument("--metric", action="append", help="compare only this metric")
+    parser.add_argument(
+        "--higher-is-better",
+        action="append",
+        default=[],
+        metavar="METRIC",
+        help="a metric that regresses when it decreases",
+    )
+    parser.add_argument("--threshold", type=float, default=0.05, help="min relative change")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the comparisons in JSON")
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.store):
+        parser.error(f"no such benchmark store: {args.store}")
+
+    with BenchmarkStore(args.store) as store:
+        records = store.find(since=args.since, until=args.until)
+
+    ignored_key = None
+    if args.split:
+        baseline = [record for record in records if record.record_time < args.split]
+        candidate = [record for record in records if record.record_time >= args.split]
+    else:
+        ignored_key, *sides = args.attribute
+        values = []
+        for side_value in sides:
+            try:
+                values.append(json.loads(side_value))
+            except json.JSONDecodeError:
+                values.append(side_value)
+        sides = ([], [])
+        for record in records:
+            value = (getattr(record, "target_attributes", None) or dict()).get(ignored_key)
+            for i, side_value in enumerate(values):
+                if value == side_value:
+                    sides[i].append(record)
+        baseline, candidate = sides
+
+    comparisons = compare(
+        baseline,
+        candidate,
+        ignored_key,
+        args.metric,
+        tuple(args.higher_is_better),
+        args.threshold,
+        args.confidence,
+        args.resamples,
+        args.seed,
+    )
+
+    if args.json:
+        print(
+            json.dumps(
+                [comparison.to_dict() for comparison in comparisons], indent=2, allow_nan=False
+            )
+        )
+    else:
+        print(f"baseline: {len(baseline)} records, candidate: {len(candidate)} records")
+        group = None
+        for comparison in comparisons:
+            if comparison.group != group:
+                group = comparison.group
+                print(json.dumps(group, sort_keys=True))
+            print(f"  {comparison}")
+
+    if not comparisons:
+        return EXIT_NO_DATA
+    if any(comparison.verdict == "regression" for comparison in comparisons):
+        return EXIT_REGRESSION
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())